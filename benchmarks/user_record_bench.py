@@ -0,0 +1,82 @@
+"""Микробенчмарк: `SELECT *` + `dict(mapping)` против проекции + `UserRecord`.
+
+Запуск: `python benchmarks/user_record_bench.py`. Используется SQLite в
+памяти, поэтому измеряется только клиентская часть — разбор строки и
+выделение памяти на запись; экономия на трафике к Postgres идёт сверху.
+"""
+import os
+import sys
+import timeit
+import tracemalloc
+from datetime import datetime, timezone
+
+from sqlalchemy import create_engine, text
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from services.users import (  # noqa: E402
+    CONTEXT_COLUMNS,
+    STATS_FIELDS,
+    USER_FIELDS,
+    UserRecord,
+    select_users_sql,
+)
+
+PROFILE_FIELDS = [name for name in USER_FIELDS if name not in STATS_FIELDS]
+
+ROWS = 2000
+ITERATIONS = 20
+
+
+def build_engine():
+    engine = create_engine("sqlite://")
+    columns = ", ".join(f"{name} TEXT" for name in PROFILE_FIELDS if name != "id")
+    stats_columns = ", ".join(f"{name} TEXT" for name in STATS_FIELDS)
+    now = datetime.now(timezone.utc).isoformat()
+    with engine.begin() as conn:
+        conn.execute(text(f"CREATE TABLE users (id INTEGER PRIMARY KEY, {columns}, diary_password TEXT)"))
+        conn.execute(text(f"CREATE TABLE user_stats (user_id INTEGER PRIMARY KEY, {stats_columns})"))
+        for telegram_id in range(ROWS):
+            values = {name: now for name in PROFILE_FIELDS if name != "id"}
+            values.update(telegram_id=telegram_id, name="Пользователь", diary_password="secret")
+            insert(conn, "users", values)
+            insert(conn, "user_stats", {"user_id": telegram_id, **{name: now for name in STATS_FIELDS}})
+    return engine
+
+
+def insert(conn, table, values):
+    conn.execute(
+        text(f"INSERT INTO {table} ({', '.join(values)}) VALUES ({', '.join(':' + k for k in values)})"),
+        values,
+    )
+
+
+def old_path(conn):
+    sql = text("SELECT * FROM users JOIN user_stats ON user_stats.user_id = users.telegram_id")
+    return [dict(row) for row in conn.execute(sql).mappings()]
+
+
+def new_path(conn):
+    sql = text(select_users_sql(CONTEXT_COLUMNS, "1 = 1"))
+    return [UserRecord.from_row(CONTEXT_COLUMNS, row) for row in conn.execute(sql)]
+
+
+def measure(name, func, conn):
+    seconds = timeit.timeit(lambda: func(conn), number=ITERATIONS)
+    tracemalloc.start()
+    records = func(conn)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    per_row_us = seconds / (ITERATIONS * ROWS) * 1e6
+    print(f"{name:<28} {per_row_us:8.2f} мкс/строка  {size / len(records):8.0f} байт/запись")
+
+
+def main():
+    engine = build_engine()
+    with engine.connect() as conn:
+        measure("SELECT * + dict(mapping)", old_path, conn)
+        measure("проекция + UserRecord", new_path, conn)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""Статические inline-клавиатуры, собранные один раз из каталога.
+
+Разметка не зависит от пользователя, поэтому обработчики отдают готовые
+объекты `InlineKeyboardMarkup`. Меню практик зависит только от премиум-
+статуса и хранится в двух вариантах.
+"""
+from typing import Dict, List
+
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+from services.catalog import Catalog
+from services.delivery import DELIVERY_TIMEZONES
+
+
+def _markup(rows: List[List[InlineKeyboardButton]]) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+
+def _button(text: str, callback_data: str) -> List[InlineKeyboardButton]:
+    return [InlineKeyboardButton(text=text, callback_data=callback_data)]
+
+
+class Keyboards:
+    def __init__(self, catalog: Catalog) -> None:
+        self.main_menu = _markup([
+            [InlineKeyboardButton(text="🧠 Психология", callback_data="psychology_menu"),
+             InlineKeyboardButton(text="📔 Дневник", callback_data="diary_menu")],
+            [InlineKeyboardButton(text="✅ Привычки", callback_data="habits_menu"),
+             InlineKeyboardButton(text="🛍 Магазин", callback_data="shop_menu")],
+            [InlineKeyboardButton(text="🎯 Челлендж дня", callback_data="daily_challenge"),
+             InlineKeyboardButton(text="💬 Спросить у GPT-4o", callback_data="ask_ai")],
+            [InlineKeyboardButton(text="👥 Рефералы", callback_data="referrals"),
+             InlineKeyboardButton(text="🏆 Уровень", callback_data="level_progress")],
+        ])
+
+        # Меню практик: вариант для премиума и для бесплатного доступа
+        self._psychology: Dict[bool, InlineKeyboardMarkup] = {
+            premium: self._build_psychology(catalog, premium) for premium in (False, True)
+        }
+
+        self.shop = _markup([
+            _button("💎 Премиум за сердечки", "hearts_shop"),
+            _button("💳 Платные функции", "paid_shop"),
+            _button("💎 Премиум подписка", "premium_shop"),
+            _button("🔙 Назад", "back_to_main"),
+        ])
+        self.shop_categories = _markup([
+            _button("📚 Психологические материалы", "shop_digital"),
+            _button("💎 Премиум за сердечки", "shop_premium"),
+            _button("🔙 Назад", "back_to_profile"),
+        ])
+        self.shop_digital = _markup([
+            _button(f"{item['name']} - {item['price']}💖", f"shop_item_{item['id']}")
+            for item in catalog.shop_items if item["type"] == "digital"
+        ] + [_button("🔙 Назад", "shop_menu")])
+        self.hearts_shop = _markup([
+            _button(f"{item['name']} - {item['price']}💖", f"buy_hearts_{item['id']}")
+            for item in catalog.hearts_shop_items
+        ] + [_button("🔙 Назад", "shop_menu")])
+        self.paid_shop = _markup([
+            _button(f"{item['name']} - {item['price_usd']}$", f"buy_paid_{item['id']}")
+            for item in catalog.paid_shop_items
+        ] + [_button("🔙 Назад", "shop_menu")])
+        self.premium_shop = _markup([
+            _button(f"{item['name']} - {item['price_usd']}$", f"buy_premium_{item['id']}")
+            for item in catalog.premium_shop_items
+        ] + [_button("🔙 Назад", "shop_menu")])
+
+        zones = [
+            InlineKeyboardButton(text=label, callback_data=f"tz_{name}")
+            for name, label in DELIVERY_TIMEZONES.items()
+        ]
+        self.timezones = _markup(
+            [zones[i:i + 2] for i in range(0, len(zones), 2)] + [_button("🔙 Назад", "back_to_main")]
+        )
+
+        self.back_to_main = _markup([_button("🏠 Главное меню", "back_to_main")])
+        self.back_to_profile = _markup([_button("🔙 Назад в профиль", "back_to_profile")])
+
+    @staticmethod
+    def _build_psychology(catalog: Catalog, premium: bool) -> InlineKeyboardMarkup:
+        rows = []
+        for practice in catalog.psychology_practices:
+            if practice["premium_only"] and not premium:
+                continue
+            text = practice["title"]
+            if practice["hearts_cost"] > 0:
+                text += f" ({practice['hearts_cost']}💖)"
+            rows.append(_button(text, f"psy_{practice['id']}"))
+        rows.append(_button("🔙 Назад", "back_to_profile"))
+        return _markup(rows)
+
+    def psychology(self, premium: bool) -> InlineKeyboardMarkup:
+        return self._psychology[bool(premium)]
@@ -4,12 +4,10 @@ import logging
 import os
 import random
 import re
-from datetime import datetime, timedelta, timezone
+from datetime import date, datetime, timedelta, timezone, tzinfo
 from decimal import Decimal, getcontext
-from typing import Optional, Dict, Any, List, Tuple
+from typing import Optional, Dict, Any, Awaitable, Callable, List, Sequence, Tuple
 
-import aiocron
-import httpx
 import pytz
 from dotenv import load_dotenv
 
@@ -38,22 +36,70 @@ from aiogram.types import (
 )
 from aiogram.utils.markdown import hide_link
 
-from sqlalchemy import (
-    BigInteger,
-    Boolean,
-    Column,
-    DateTime,
-    Float,
-    Integer,
-    MetaData,
-    String,
-    Table,
-    Text,
-    text,
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from keyboards import Keyboards
+from models import (  # Base — для reset_db.py
+    Base,
+    diary_entries,
+    habits,
+    metadata,
+    payments,
+    promo_codes,
+    user_stats,
+    users,
+)
+from services.admission import AdmissionController, AdmissionRejected
+from services.broadcast import Broadcaster
+from services.broadcast_jobs import BroadcastJob, BroadcastJobs
+from services.cache import TTLCache, invalidate_user, user_cache
+from services.coalescing import SingleFlight, StreamFlight, payload_key
+from services.catalog import Catalog
+from services.conversations import ConversationStore
+from services.counters import CounterAggregator
+from services.delivery import (
+    BUCKET_WHERE,
+    DEFAULT_TIMEZONE,
+    DELIVERY_TIMEZONES,
+    DeliveryScheduler,
+    find_timezone,
+    user_timezone,
+)
+from services.database import PoolSettings, build_engine, pool_snapshot
+from services.openai_client import OpenAIClient
+from services.periods import period_params, period_sql
+from services.progression import LevelCurve, LevelProgress, add_experience_sql
+from services.quota import QuotaService, estimate_tokens, request_max_tokens
+from services.rates import RateProvider
+from services.resilience import CircuitBreaker, CircuitOpen, Resilient
+from services.streaming import StreamingMessage
+from services.uow import (
+    ReleaseConnectionRequestMiddleware,
+    UnitOfWorkMiddleware,
+    after_commit,
+    release_connection,
+    session_scope,
+)
+from services.user_context import RequestUserMiddleware, current_user_context
+from services.users import (
+    ADMIN_COLUMNS,
+    CONTEXT_COLUMNS,
+    ENTITLEMENT_COLUMNS,
+    PROFILE_COLUMNS,
+    STATS_FIELDS,
+    UserRecord,
+    fetch_diary_password,
+    fetch_user_record,
+    fetch_user_record_by_username,
+    fetch_user_records,
+    REACHABLE_WHERE,
+    iter_user_records,
+    mark_reachable,
+    mark_unreachable,
+    select_users_sql,
+    update_stats,
 )
-from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
-from sqlalchemy.orm import declarative_base
-from sqlalchemy.sql import func
 
 # Загрузка переменных окружения
 load_dotenv()
@@ -100,10 +146,97 @@ router = Router()
 dp.include_router(router)
 
 # База данных
-engine = create_async_engine(DB_URL, echo=False)
+engine = build_engine(DB_URL, PoolSettings.from_env())
 async_session = async_sessionmaker(engine, expire_on_commit=False)
-metadata = MetaData()
-Base = declarative_base(metadata=metadata)
+
+def db_session():
+    """Сессия транзакции текущего апдейта (вне апдейта — отдельная транзакция)"""
+    return session_scope(async_session)
+
+# Кривая уровней: LEVEL_CURVE="100,150,200" — XP на прохождение уровней 1, 2, 3...
+# (последний шаг повторяется до LEVEL_MAX)
+LEVEL_CURVE = LevelCurve.from_string(
+    os.getenv("LEVEL_CURVE"), max_level=int(os.getenv("LEVEL_MAX", "100"))
+)
+
+# Write-behind счётчик сердечек (опыт всегда пишется сразу, см. add_experience).
+# COUNTERS_FLUSH_INTERVAL — одновременно и максимальное окно потерь при падении
+COUNTERS_WRITE_BEHIND = os.getenv("COUNTERS_WRITE_BEHIND", "1") == "1"
+COUNTERS_FLUSH_INTERVAL = float(os.getenv("COUNTERS_FLUSH_INTERVAL", "2"))
+COUNTERS_MAX_PENDING = int(os.getenv("COUNTERS_MAX_PENDING", "500"))
+# Кэш записей пользователей между апдейтами (USER_CACHE_SIZE=0 — выключить)
+user_cache.configure(
+    maxsize=int(os.getenv("USER_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("USER_CACHE_TTL", "60")),
+)
+counters = CounterAggregator(
+    async_session,
+    flush_interval=COUNTERS_FLUSH_INTERVAL,
+    max_pending=COUNTERS_MAX_PENDING,
+    on_flush=user_cache.invalidate_many,
+)
+# Рассылки: пул воркеров и общий лимит ~28 сообщений/с (лимит Telegram — 30);
+# получатели читаются страницами по BROADCAST_PAGE_SIZE
+BROADCAST_PAGE_SIZE = int(os.getenv("BROADCAST_PAGE_SIZE", "1000"))
+broadcaster = Broadcaster(
+    bot,
+    workers=int(os.getenv("BROADCAST_WORKERS", "20")),
+    rate=float(os.getenv("BROADCAST_RATE", "28")),
+    on_unreachable=lambda recipients: set_unreachable(recipients),
+)
+# Запуски рассылок с курсором в БД: после рестарта продолжаются, никому не приходят дважды
+broadcasts = BroadcastJobs(
+    async_session,
+    broadcaster,
+    lambda job: broadcast_recipients(job),
+    resume_window=timedelta(hours=float(os.getenv("BROADCAST_RESUME_HOURS", "3"))),
+    purge_interval=timedelta(minutes=float(os.getenv("BROADCAST_PURGE_MINUTES", "30"))),
+)
+# Расход запросов и токенов AI по тарифам (сутки и окна — в поясе пользователя)
+quota = QuotaService(async_session)
+# История диалога с AI: последние AI_HISTORY_TURNS реплик в пределах AI_HISTORY_TOKENS
+conversations = ConversationStore(
+    async_session,
+    max_turns=int(os.getenv("AI_HISTORY_TURNS", "10")),
+    token_budget=int(os.getenv("AI_HISTORY_TOKENS", "1500")),
+)
+# Курс USD→RUB для оплаты криптовалютой: фоновое обновление раз в
+# RATES_REFRESH_INTERVAL секунд, курс старше RATES_MAX_AGE не используется
+usd_rates = RateProvider(
+    fallback=float(os.getenv("RATES_FALLBACK_RUB", "90")),
+    refresh_interval=float(os.getenv("RATES_REFRESH_INTERVAL", "600")),
+    max_age=float(os.getenv("RATES_MAX_AGE", "3600")),
+)
+# Не больше AI_MAX_CONCURRENT запросов к OpenAI одновременно, премиум — вне очереди
+ai_admission = AdmissionController(
+    max_concurrent=int(os.getenv("AI_MAX_CONCURRENT", "8")),
+    max_queue=int(os.getenv("AI_MAX_QUEUE", "50")),
+    max_wait=float(os.getenv("AI_QUEUE_TIMEOUT", "30")),
+)
+# Одинаковые одновременные запросы к OpenAI выполняются один раз
+ai_single_flight = SingleFlight()
+ai_stream_flight = StreamFlight()
+# Кэш ответов только для шаблонных промптов без личных данных (ask_openai(cacheable=True))
+ai_response_cache = TTLCache(
+    maxsize=int(os.getenv("AI_RESPONSE_CACHE_SIZE", "256")),
+    ttl=float(os.getenv("AI_RESPONSE_CACHE_TTL", "300")),
+)
+# Общий пул соединений к OpenAI на всё время работы бота
+openai_client = OpenAIClient(
+    OPENAI_API_KEY,
+    connect_timeout=float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5")),
+    read_timeout=float(os.getenv("OPENAI_READ_TIMEOUT", "60")),
+    max_connections=int(os.getenv("OPENAI_MAX_CONNECTIONS", "20")),
+    max_keepalive_connections=int(os.getenv("OPENAI_MAX_KEEPALIVE", "10")),
+)
+# Повторы при 429/5xx/таймаутах и выключатель при затяжном сбое OpenAI
+openai_resilience = Resilient(
+    CircuitBreaker(
+        failure_threshold=int(os.getenv("OPENAI_BREAKER_THRESHOLD", "5")),
+        reset_timeout=float(os.getenv("OPENAI_BREAKER_RESET", "30")),
+    ),
+    attempts=int(os.getenv("OPENAI_RETRY_ATTEMPTS", "3")),
+)
 
 CRISIS_KEYWORDS = [
     "суицид", "покончить с собой", "умру", "не хочу жить", 
@@ -112,6 +245,7 @@ CRISIS_KEYWORDS = [
 
 PSYCHOLOGY_PRACTICES = [
     {
+        "id": "a336df93",
         "title": "⚖️ Колесо баланса",
         "description": "Проанализируйте 8 сфер жизни и найдите точки роста.",
         "content": "Колесо баланса - это инструмент для оценки удовлетворенности различными сферами жизни...",
@@ -119,6 +253,7 @@ PSYCHOLOGY_PRACTICES = [
         "premium_only": False
     },
     {
+        "id": "105092b6",
         "title": "🙏 Дневник благодарности",
         "description": "Ежедневная практика для развития позитивного мышления.",
         "content": "Записывайте 3 вещи, за которые вы благодарны каждый день...",
@@ -126,6 +261,7 @@ PSYCHOLOGY_PRACTICES = [
         "premium_only": False
     },
     {
+        "id": "a61586c8",
         "title": "🌀 Техника 5-4-3-2-1",
         "description": "Метод для снятия тревоги и возвращения в настоящий момент.",
         "content": "Когда чувствуете тревогу, назовите:\n5 вещей, которые видите...",
@@ -133,6 +269,7 @@ PSYCHOLOGY_PRACTICES = [
         "premium_only": True
     },
     {
+        "id": "7fe89c15",
         "title": "🛡️ Установка личных границ",
         "description": "Научитесь говорить 'нет' и сохранять свои границы без чувства вины.",
         "content": "Определите, в каких ситуациях ваши границы нарушаются, и потренируйтесь говорить 'нет' с уважением к себе и другим.",
@@ -140,6 +277,7 @@ PSYCHOLOGY_PRACTICES = [
         "premium_only": True
     },
     {
+        "id": "58f33bbf",
         "title": "🔄 Переписывание негативных установок",
         "description": "Измените ограничивающие убеждения на поддерживающие.",
         "content": "Запишите негативные мысли и сформулируйте их по-новому с акцентом на возможности и рост.",
@@ -147,6 +285,7 @@ PSYCHOLOGY_PRACTICES = [
         "premium_only": True
     },
     {
+        "id": "56495c1b",
         "title": "🌿 Практика осознанности",
         "description": "Научитесь быть здесь и сейчас без осуждения себя.",
         "content": "Выберите любое действие (например, еду) и сделайте его осознанным: наблюдайте ощущения, запахи, эмоции.",
@@ -154,6 +293,7 @@ PSYCHOLOGY_PRACTICES = [
         "premium_only": False
     },
     {
+        "id": "158a6332",
         "title": "🔥 Визуализация цели",
         "description": "Создайте яркий мысленный образ своего успеха.",
         "content": "Закройте глаза и во всех деталях представьте, что цель достигнута. Какие эмоции вы испытываете? Что вы видите и слышите?",
@@ -161,6 +301,7 @@ PSYCHOLOGY_PRACTICES = [
         "premium_only": True
     },
     {
+        "id": "91058358",
         "title": "💬 Диалог с внутренним критиком",
         "description": "Ослабьте влияние внутреннего негативного голоса.",
         "content": "Запишите реплики вашего 'критика' и ответьте на них с позиции заботливого друга.",
@@ -168,6 +309,7 @@ PSYCHOLOGY_PRACTICES = [
         "premium_only": True
     },
     {
+        "id": "7e947549",
         "title": "🎯 SMART-цели",
         "description": "Научитесь ставить конкретные, измеримые цели.",
         "content": "Сформулируйте свою ближайшую цель по системе SMART: конкретная, измеримая, достижимая, релевантная, ограниченная во времени.",
@@ -175,6 +317,7 @@ PSYCHOLOGY_PRACTICES = [
         "premium_only": False
     },
     {
+        "id": "a334bda8",
         "title": "🔔 Упражнение «Якорение ресурсов»",
         "description": "Закрепите состояние уверенности для трудных ситуаций.",
         "content": "Вспомните момент силы в жизни, вспомните телесные ощущения. Установите 'якорь' прикосновением к руке, чтобы вызывать это состояние при необходимости.",
@@ -182,6 +325,7 @@ PSYCHOLOGY_PRACTICES = [
         "premium_only": True
     },
     {
+        "id": "95c8b6b1",
         "title": "🌙 Практика вечерней рефлексии",
         "description": "Анализируйте свой день для роста и улучшения.",
         "content": "Перед сном ответьте себе: что сегодня получилось хорошо? Что я могу улучшить завтра?",
@@ -189,6 +333,7 @@ PSYCHOLOGY_PRACTICES = [
         "premium_only": False
     },
     {
+        "id": "a171148f",
         "title": "📖 Письмо самому себе в будущее",
         "description": "Поддержите себя через время.",
         "content": "Напишите письмо своему 'я' через год. Какие советы вы хотите себе дать? Какие цели поставить?",
@@ -196,6 +341,7 @@ PSYCHOLOGY_PRACTICES = [
         "premium_only": True
     },
     {
+        "id": "c07cbc2b",
         "title": "🛠️ Техника 'Контроль круга забот'",
         "description": "Разделяйте, что вы контролируете, а что — нет.",
         "content": "Составьте два списка: что зависит от вас, и что нет. Сосредоточьтесь на действиях в вашей зоне контроля.",
@@ -206,78 +352,91 @@ PSYCHOLOGY_PRACTICES = [
 
 SHOP_ITEMS = [
     {
+        "id": "6d914602",
         "name": "📚 Книга 'Как управлять стрессом'",
         "description": "Электронная книга с техниками управления стрессом.",
         "price": 50,
         "type": "digital"
     },
     {
+        "id": "5dbdd4cb",
         "name": "🎧 Аудиомедитация",
         "description": "30-минутная аудиомедитация для глубокого расслабления.",
         "price": 30,
         "type": "digital"
     },
     {
+        "id": "3e5fc109",
         "name": "💎 1 день премиума",
         "description": "Премиум-доступ на 1 день за сердечки.",
         "price": 20,
         "type": "premium"
     },
     {
+        "id": "b08577d4",
         "name": "🧘 Гайд 'Как быстро расслабляться'",
         "description": "Практическое руководство по снятию стресса за 5 минут.",
         "price": 40,
         "type": "digital"
     },
     {
+        "id": "cf2dba86",
         "name": "📝 Шаблон Колеса Баланса",
         "description": "Готовый pdf для самостоятельной диагностики жизни.",
         "price": 25,
         "type": "digital"
     },
     {
+        "id": "1a67cc3b",
         "name": "🎧 Медитация для сна",
         "description": "Аудиотрек для глубокого расслабления перед сном.",
         "price": 35,
         "type": "digital"
     },
     {
+        "id": "840a289e",
         "name": "📈 Персональный план развития на месяц",
         "description": "Мини-курс по саморазвитию.",
         "price": 50,
         "type": "digital"
     },
     {
+        "id": "d0f62b2f",
         "name": "🎭 Тест 'Ваш архетип личности'",
         "description": "Онлайн-тест с объяснением результата.",
         "price": 30,
         "type": "digital"
     },
     {
+        "id": "64aa1206",
         "name": "💎 7 дней премиума",
         "description": "Премиум-доступ на неделю за сердечки.",
         "price": 100,
         "type": "premium"
     },
     {
+        "id": "d06e87d3",
         "name": "💎 30 дней премиума",
         "description": "Премиум-доступ на месяц за сердечки.",
         "price": 350,
         "type": "premium"
     },
     {
+        "id": "5f86b5a5",
         "name": "🌟 Психологическая поддержка в чате",
         "description": "1 личный мини-ответ от психолога.",
         "price": 60,
         "type": "service"
     },
     {
+        "id": "e0cd0fc1",
         "name": "🛡️ Защита от прокрастинации",
         "description": "Чек-лист техник борьбы с откладыванием.",
         "price": 20,
         "type": "digital"
     },
     {
+        "id": "4f020bba",
         "name": "🔮 Личностный рост: Марафон",
         "description": "7-дневная программа ежедневных заданий для роста.",
         "price": 75,
@@ -360,137 +519,6 @@ DAILY_CHALLENGES = [
     },
 ]
 
-# Таблица пользователей
-users = Table(
-    "users",
-    metadata,
-    Column("id", Integer, primary_key=True),
-    Column("telegram_id", BigInteger, unique=True, nullable=False, index=True),
-    Column("full_name", String(100)),
-    Column("username", String(100)),
-    Column("gender", String(10)),
-    Column("name", String(100)),
-    Column("hearts", Integer, default=10),
-    Column("is_premium", Boolean, default=False),
-    Column("user_type", String(20), default="free"),  # free/trial/premium
-    Column("is_admin", Boolean, default=False),
-    Column("trial_started_at", DateTime(timezone=True)),
-    Column("subscription_expires_at", DateTime(timezone=True)),
-    Column("created_at", DateTime(timezone=True), server_default=func.now()),
-    Column("last_activity_at", DateTime(timezone=True), onupdate=func.now()),
-    Column("daily_requests", Integer, default=0),
-    Column("total_requests", Integer, default=0),
-    Column("request_tokens", Integer, default=0),  # Токены за текущий месяц
-    Column("is_banned", Boolean, default=False),
-    Column("diary_password", String(100)),
-    Column("last_diary_reward", DateTime(timezone=True)),
-    Column("referral_code", String(20), unique=True),
-    Column("referrer_id", BigInteger),
-    Column("referrals_count", Integer, default=0),
-    Column("last_referral_date", DateTime(timezone=True)),
-    Column("level", Integer, default=1),
-    Column("experience", Integer, default=0),
-    Column("premium_purchases", Integer, default=0),
-)
-
-# Таблица платежей
-payments = Table(
-    "payments",
-    metadata,
-    Column("id", Integer, primary_key=True),
-    Column("user_id", BigInteger),
-    Column("amount", Float),
-    Column("currency", String(10)),
-    Column("item_id", String(50)),
-    Column("status", String(20), default="pending"),
-    Column("payment_method", String(20)),
-    Column("transaction_hash", String(100)),
-    Column("created_at", DateTime, default=datetime.utcnow),
-    Column("confirmed_at", DateTime),
-)
-
-# Таблица записей дневника
-diary_entries = Table(
-    "diary_entries",
-    metadata,
-    Column("id", Integer, primary_key=True),
-    Column("user_id", BigInteger),
-    Column("entry_text", Text),
-    Column("mood", String(20)),
-    Column("created_at", DateTime, default=datetime.utcnow),
-)
-
-# Таблица привычек
-habits = Table(
-    "habits",
-    metadata,
-    Column("id", Integer, primary_key=True),
-    Column("user_id", BigInteger),
-    Column("title", String(100)),
-    Column("description", String(500)),
-    Column("reminder_time", String(10)),
-    Column("created_at", DateTime, default=datetime.utcnow),
-    Column("target_date", DateTime),
-    Column("is_completed", Boolean, default=False),
-)
-
-# Таблица выполненных привычек
-habit_completions = Table(
-    "habit_completions",
-    metadata,
-    Column("id", Integer, primary_key=True),
-    Column("habit_id", Integer),
-    Column("proof_text", Text),
-    Column("proof_photo", String(200)),
-    Column("completed_at", DateTime, default=datetime.utcnow),
-)
-
-# Таблица промокодов
-promo_codes = Table(
-    "promo_codes",
-    metadata,
-    Column("id", Integer, primary_key=True),
-    Column("code", String(20), unique=True),
-    Column("discount_percent", Integer),
-    Column("valid_until", DateTime),
-    Column("uses_remaining", Integer),
-    Column("created_at", DateTime, default=datetime.utcnow),
-    Column("description", String(200)),
-)
-
-# Таблица админских заданий
-admin_tasks = Table(
-    "admin_tasks",
-    metadata,
-    Column("id", Integer, primary_key=True),
-    Column("title", String(100)),
-    Column("description", Text),
-    Column("reward", Integer),
-    Column("created_at", DateTime, default=datetime.utcnow),
-    Column("expires_at", DateTime),
-)
-
-# Таблица выполненных заданий
-completed_tasks = Table(
-    "completed_tasks",
-    metadata,
-    Column("id", Integer, primary_key=True),
-    Column("task_id", Integer),
-    Column("user_id", BigInteger),
-    Column("completed_at", DateTime, default=datetime.utcnow),
-)
-
-# Таблица сообщений пользователей
-user_messages = Table(
-    "user_messages",
-    metadata,
-    Column("id", Integer, primary_key=True),
-    Column("user_id", BigInteger),
-    Column("message_text", Text),
-    Column("is_ai_response", Boolean, default=False),
-    Column("created_at", DateTime, default=datetime.utcnow),
-)
-
 # ==========================================
 # 🧠 Состояния FSM (машина состояний пользователя и администратора)
 # ==========================================
@@ -557,28 +585,43 @@ PSYCHOLOGY_FEATURES = [
 
 # 🛒 Товары магазина за сердечки (HEARTS_SHOP_ITEMS)
 HEARTS_SHOP_ITEMS = [
-    {"name": "💎 Премиум на 1 день", "price": 20, "days": 1},
-    {"name": "💎 Премиум на 7 дней", "price": 100, "days": 7},
-    {"name": "💎 Премиум на 30 дней", "price": 350, "days": 30},
+    {"id": "ce6e6bd2", "name": "💎 Премиум на 1 день", "price": 20, "days": 1},
+    {"id": "eb57bdd5", "name": "💎 Премиум на 7 дней", "price": 100, "days": 7},
+    {"id": "d0f3864e", "name": "💎 Премиум на 30 дней", "price": 350, "days": 30},
 ]
 
 # 🛍️ Платные функции за деньги (PAID_SHOP_ITEMS)
 PAID_SHOP_ITEMS = [
-    {"name": "🚨 Экстренная помощь психолога", "price_usd": 5},
-    {"name": "📊 Подробный анализ настроения", "price_usd": 3},
-    {"name": "♌ Индивидуальный гороскоп", "price_usd": 2},
+    {"id": "7dd093b8", "name": "🚨 Экстренная помощь психолога", "price_usd": 5},
+    {"id": "16736d5d", "name": "📊 Подробный анализ настроения", "price_usd": 3},
+    {"id": "902131ae", "name": "♌ Индивидуальный гороскоп", "price_usd": 2},
 ]
 
 # 🌟 Премиум-магазин за реальные деньги (PREMIUM_SHOP_ITEMS)
 PREMIUM_SHOP_ITEMS = [
-    {"name": "💎 Премиум подписка на 30 дней", "price_usd": 10},
-    {"name": "💎 Премиум подписка на 90 дней", "price_usd": 25},
-    {"name": "💎 Премиум подписка на 1 год", "price_usd": 79},
+    {"id": "cac35fdd", "name": "💎 Премиум подписка на 30 дней", "price_usd": 10},
+    {"id": "654d667f", "name": "💎 Премиум подписка на 90 дней", "price_usd": 25},
+    {"id": "4e8a8faa", "name": "💎 Премиум подписка на 1 год", "price_usd": 79},
 ]
 
+# 📦 Каталог со стабильными id (можно переопределить YAML-файлом CATALOG_PATH).
+# id элементов задаются явно и не меняются при переименовании: на них ссылаются уже отправленные кнопки
+CATALOG = Catalog.load(
+    {
+        "psychology_practices": PSYCHOLOGY_PRACTICES,
+        "shop_items": SHOP_ITEMS,
+        "hearts_shop_items": HEARTS_SHOP_ITEMS,
+        "paid_shop_items": PAID_SHOP_ITEMS,
+        "premium_shop_items": PREMIUM_SHOP_ITEMS,
+    },
+    os.getenv("CATALOG_PATH"),
+)
+
 # 🤖 Конфигурация AI GPT
 AI_MODEL = "gpt-3.5-turbo"  # реальная модель
 AI_PUBLIC_MODEL_NAME = "GPT-4o"  # что видит пользователь
+# Не чаще одной правки сообщения с ответом за столько секунд
+AI_STREAM_EDIT_INTERVAL = float(os.getenv("AI_STREAM_EDIT_INTERVAL", "1.0"))
 AI_SYSTEM_PROMPT = (
     "Ты профессиональный психолог-консультант. "
     "Отвечай дружелюбно, позитивно и поддерживающе. "
@@ -590,21 +633,98 @@ AI_SYSTEM_PROMPT = (
 # ==========================================
 
 # Получить пользователя
-async def get_user(telegram_id: int) -> Optional[Dict[str, Any]]:
-    """Получить пользователя по ID"""
+async def get_user(
+    telegram_id: int, columns: Sequence[str] = CONTEXT_COLUMNS
+) -> Optional[UserRecord]:
+    """Получить пользователя по ID (в рамках апдейта — из контекста запроса).
+
+    `columns` — проекция для запросов вне контекста; она должна быть
+    подмножеством CONTEXT_COLUMNS.
+    """
+    ctx = current_user_context(telegram_id)
+    if ctx is not None and ctx.loaded:
+        return ctx.user
+
+    if ctx is not None:
+        columns = CONTEXT_COLUMNS
+    user = await fetch_user(telegram_id, columns)
+    if ctx is not None:
+        ctx.set(user)
+    return user
+
+async def fetch_user(
+    telegram_id: int, columns: Sequence[str] = CONTEXT_COLUMNS
+) -> Optional[UserRecord]:
+    """Прочитать пользователя (из кэша или БД), минуя контекст запроса"""
+    async def load() -> Optional[UserRecord]:
+        cached = user_cache.get(telegram_id)
+        if cached is not None and all(name in cached for name in columns):
+            return cached.copy()
+        # Сброс кэша во время чтения (начисление, сброс буфера) не даст закэшировать старую запись
+        generation = user_cache.generation()
+        async with db_session() as session:
+            user = await fetch_user_record(session, telegram_id, columns)
+        # В кэше — запись из БД без несброшенных дельт буфера
+        if user and set(CONTEXT_COLUMNS).issubset(columns):
+            user_cache.set(telegram_id, user.copy(), generation)
+        return user
+
     try:
-        async with async_session() as session:
-            result = await session.execute(
-                text("SELECT * FROM users WHERE telegram_id = :telegram_id"),
-                {"telegram_id": telegram_id}
-            )
-            user = result.mappings().first()
-            return dict(user) if user else None
+        if not COUNTERS_WRITE_BEHIND:
+            return await load()
+        user = await counters.consistent_read(load)
+        return counters.overlay(user) if user else None
     except Exception as e:
         logger.error(f"Ошибка получения пользователя: {e}")
         return None
 
-async def create_user(telegram_id: int, full_name: str, username: Optional[str] = None) -> Optional[Dict[str, Any]]:
+async def get_users_many(
+    telegram_ids: Sequence[int], columns: Sequence[str] = ADMIN_COLUMNS
+) -> Dict[int, UserRecord]:
+    """Получить пользователей пачкой (`telegram_id = ANY(...)`), ключ — telegram_id"""
+    if "telegram_id" not in columns:
+        columns = ("telegram_id", *columns)
+    try:
+        async def load() -> List[UserRecord]:
+            async with db_session() as session:
+                return await fetch_user_records(session, telegram_ids, columns)
+
+        if COUNTERS_WRITE_BEHIND:
+            records = [counters.overlay(user) for user in await counters.consistent_read(load)]
+        else:
+            records = await load()
+        return {user["telegram_id"]: user for user in records}
+    except Exception as e:
+        logger.error(f"Ошибка пакетного получения пользователей: {e}")
+        return {}
+
+def iter_users(
+    where: str = REACHABLE_WHERE,
+    params: Optional[Dict[str, Any]] = None,
+    columns: Sequence[str] = ("telegram_id",),
+    after: Optional[int] = None,
+):
+    """Обойти пользователей по условию (рассылки, отчёты): записи потоком, страницы читаются с упреждением"""
+    return iter_user_records(async_session, columns, where, params, batch_size=BROADCAST_PAGE_SIZE, after=after)
+
+async def set_unreachable(recipients: Sequence[Tuple[int, str]]) -> int:
+    """Исключить из рассылок пользователей, до которых не дошло сообщение"""
+    try:
+        async with db_session() as session:
+            marked = await mark_unreachable(session, recipients)
+        logger.info(f"Недоступны для рассылок: {marked} из {len(recipients)}")
+        return marked
+    except Exception as e:
+        logger.error(f"Ошибка отметки недоступных пользователей: {e}")
+        return 0
+
+async def broadcast_recipients(job: BroadcastJob):
+    """Получатели запуска с его курсора: корзина доставки или все доступные"""
+    where, params = (BUCKET_WHERE, job.audience) if job.audience else (REACHABLE_WHERE, None)
+    async for user in iter_users(where, params, after=job.last_user_id):
+        yield user["telegram_id"]
+
+async def create_user(telegram_id: int, full_name: str, username: Optional[str] = None) -> Optional[UserRecord]:
     """Создать нового пользователя"""
     try:
         referral_code = hashlib.sha256(
@@ -618,32 +738,53 @@ async def create_user(telegram_id: int, full_name: str, username: Optional[str]
             "telegram_id": telegram_id,
             "full_name": full_name,
             "username": username,
-            "hearts": 10,
-            "level": 1,
-            "experience": 0,
             "trial_started_at": now,
             "subscription_expires_at": trial_expires,
             "user_type": "trial",
             "created_at": now,
-            "last_activity_at": now,
             "referral_code": referral_code,
         }
 
-        async with async_session.begin() as session:
+        async with db_session() as session:
             await session.execute(users.insert().values(**user_data))
+            await session.execute(
+                user_stats.insert().values(
+                    user_id=telegram_id, hearts=10, level=1, experience=0, last_activity_at=now
+                )
+            )
+        invalidate_user(telegram_id)
 
-        return await get_user(telegram_id)
+        user = await fetch_user(telegram_id)
+        ctx = current_user_context(telegram_id)
+        if ctx is not None:
+            ctx.set(user)
+        return user
     except Exception as e:
         logger.error(f"Ошибка создания пользователя: {e}")
         return None
 
 async def update_user(telegram_id: int, **kwargs) -> bool:
-    """Обновить данные пользователя"""
+    """Обновить данные пользователя (счётчики пишутся в user_stats)"""
     try:
-        async with async_session.begin() as session:
-            await session.execute(
-                users.update().where(users.c.telegram_id == telegram_id).values(**kwargs)
-            )
+        profile = {key: value for key, value in kwargs.items() if key not in STATS_FIELDS}
+        stats = {key: value for key, value in kwargs.items() if key in STATS_FIELDS}
+        async with db_session() as session:
+            if profile:
+                await session.execute(
+                    users.update().where(users.c.telegram_id == telegram_id).values(**profile)
+                )
+            if stats:
+                await update_stats(
+                    session,
+                    user_stats.update().where(user_stats.c.user_id == telegram_id).values(**stats)
+                    .returning(user_stats.c.user_id),
+                    None,
+                    telegram_id,
+                )
+        invalidate_user(telegram_id)
+        ctx = current_user_context(telegram_id)
+        if ctx is not None:
+            ctx.patch(**kwargs)
         return True
     except Exception as e:
         logger.error(f"Ошибка обновления пользователя: {e}")
@@ -652,43 +793,63 @@ async def update_user(telegram_id: int, **kwargs) -> bool:
 async def add_hearts(telegram_id: int, amount: int) -> bool:
     """Начислить сердечки пользователю"""
     try:
-        async with async_session.begin() as session:
-            await session.execute(
-                users.update()
-                .where(users.c.telegram_id == telegram_id)
-                .values(hearts=users.c.hearts + amount)
+        # Начисления копятся в буфере, списания пишем сразу — баланс для
+        # проверок покупок всегда берётся из БД плюс несброшенные начисления
+        if COUNTERS_WRITE_BEHIND and amount > 0:
+            # В буфер — только после коммита апдейта, чтобы откат отменял и награду
+            after_commit(lambda: counters.add(telegram_id, hearts=amount))
+            ctx = current_user_context(telegram_id)
+            if ctx is not None:
+                ctx.increment("hearts", amount)
+            return True
+
+        async with db_session() as session:
+            await update_stats(
+                session,
+                user_stats.update()
+                .where(user_stats.c.user_id == telegram_id)
+                .values(hearts=user_stats.c.hearts + amount)
+                .returning(user_stats.c.user_id),
+                None,
+                telegram_id,
             )
+        invalidate_user(telegram_id)
+        ctx = current_user_context(telegram_id)
+        if ctx is not None:
+            ctx.increment("hearts", amount)
         return True
     except Exception as e:
         logger.error(f"Ошибка начисления сердечек: {e}")
         return False
 
-async def add_experience(telegram_id: int, exp: int) -> bool:
-    """Начислить опыт пользователю"""
-    try:
-        user = await get_user(telegram_id)
-        if not user:
-            return False
-
-        new_exp = user.get("experience", 0) + exp
-        new_level = user.get("level", 1)
-
-        while new_exp >= 100:
-            new_exp -= 100
-            new_level += 1
+ADD_EXPERIENCE_SQL = add_experience_sql(LEVEL_CURVE)
 
-        async with async_session.begin() as session:
-            await session.execute(
-                users.update()
-                .where(users.c.telegram_id == telegram_id)
-                .values(level=new_level, experience=new_exp)
+async def add_experience(telegram_id: int, exp: int) -> Optional[LevelProgress]:
+    """Начислить опыт пользователю и вернуть новый уровень/опыт"""
+    try:
+        # Опыт не буферизуется: уровень пересчитывается прямо в UPDATE,
+        # и конкурентные начисления не сообщат об одном level-up дважды
+        async with db_session() as session:
+            rows = await update_stats(
+                session, text(ADD_EXPERIENCE_SQL), {"telegram_id": telegram_id, "exp": exp}, telegram_id
             )
-        return True
+        if not rows:
+            return None
+        row = rows[0]
+        invalidate_user(telegram_id)
+
+        ctx = current_user_context(telegram_id)
+        if ctx is not None:
+            ctx.patch(level=row.level, experience=row.experience)
+        # Уровень до начисления выводим из возвращённой строки, а не из отдельного
+        # подзапроса: его снимок мог устареть, пока UPDATE ждал блокировку строки
+        old_level = LEVEL_CURVE.level_before(row.level, row.experience, exp)
+        return LEVEL_CURVE.progress(row.level, row.experience, old_level)
     except Exception as e:
         logger.error(f"Ошибка начисления опыта: {e}")
-        return False
+        return None
 
-async def check_ai_limits(user: Dict[str, Any]]) -> Tuple[bool, str]:
+async def check_ai_limits(user: UserRecord) -> Tuple[bool, str]:
     """Проверить лимиты запросов к AI"""
     if user["is_banned"]:
         return False, "Ваш аккаунт заблокирован. Обратитесь к администратору."
@@ -697,38 +858,35 @@ async def check_ai_limits(user: Dict[str, Any]]) -> Tuple[bool, str]:
         return False, ("🔒 Эта функция доступна только для пользователей с подпиской.\n"
                      "Вы можете оформить пробный период или премиум-подписку в магазине.")
     
+    # Счётчики из прошедших суток/недели/месяца считаются нулём
+    usage = quota.usage(user)
+    
     if user["user_type"] == "trial":
-        if user["total_requests"] >= 22:
+        if usage.window_requests >= 22:
             return False, ("⚠️ Вы исчерпали лимит запросов на этой неделе (22/22).\n"
                          "Перейдите на премиум-подписку для снятия ограничений.")
-        if user["request_tokens"] >= 11000:  # 22*500
+        if usage.window_tokens >= 11000:  # 22*500
             return False, ("⚠️ Вы исчерпали лимит токенов на этой неделе.\n"
                          "Перейдите на премиум-подписку для увеличения лимитов.")
     
     if user["user_type"] == "premium":
-        if user["daily_requests"] >= 20:
+        if usage.daily_requests >= 20:
             return False, ("⚠️ Вы исчерпали дневной лимит запросов (20/20).\n"
                          "Неиспользованные запросы переносятся на следующий день.")
-        if user["request_tokens"] >= 24000:  # 30*800
+        if usage.window_tokens >= 24000:  # 30*800
             return False, ("⚠️ Вы исчерпали месячный лимит токенов.\n"
                          "Лимит обновится в начале следующего месяца.")
     
     return True, ""
 
 async def get_usd_rate() -> float:
-    """Получить текущий курс USDT к рублю"""
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get("https://api.exchangerate-api.com/v4/latest/USD")
-            data = response.json()
-            return data["rates"]["RUB"]
-    except Exception:
-        return 90.0  # Fallback курс
+    """Получить текущий курс USDT к рублю (из памяти, обновляется в фоне)"""
+    return await usd_rates.get_rate()
 
 async def validate_promo_code(code: str) -> Optional[Dict[str, Any]]:
     """Проверить валидность промокода"""
     try:
-        async with async_session() as session:
+        async with db_session() as session:
             result = await session.execute(
                 text("SELECT * FROM promo_codes WHERE code = :code AND "
                     "(uses_remaining > 0 OR uses_remaining IS NULL) AND "
@@ -744,7 +902,7 @@ async def validate_promo_code(code: str) -> Optional[Dict[str, Any]]:
 async def use_promo_code(code: str) -> bool:
     """Использовать промокод (уменьшить количество использований)"""
     try:
-        async with async_session.begin() as session:
+        async with db_session() as session:
             await session.execute(
                 promo_codes.update()
                 .where(promo_codes.c.code == code)
@@ -755,6 +913,12 @@ async def use_promo_code(code: str) -> bool:
         logger.error(f"Ошибка использования промокода: {e}")
         return False
 
+def format_level_up(progress: Optional[LevelProgress]) -> str:
+    """Строка о новом уровне для сообщений с наградой (пустая, если уровня нет)"""
+    if not progress or not progress.leveled_up:
+        return ""
+    return f"\n\n🏆 Новый уровень: {progress.level}! Следующий — через {progress.next_level_xp} XP."
+
 # Выдать случайное задание
 def get_random_daily_task() -> str:
     return random.choice(DAILY_TASKS)
@@ -763,67 +927,36 @@ def get_random_daily_task() -> str:
 # 🎛️ Клавиатуры (InlineKeyboardMarkup)
 # ==========================================
 
+# Разметка собирается один раз при запуске
+KEYBOARDS = Keyboards(CATALOG)
+
 # Главное меню
 def get_main_menu_keyboard():
-    buttons = [
-        [InlineKeyboardButton(text="🧠 Психология", callback_data="psychology_menu"),
-         InlineKeyboardButton(text="📔 Дневник", callback_data="diary_menu")],
-        [InlineKeyboardButton(text="✅ Привычки", callback_data="habits_menu"),
-         InlineKeyboardButton(text="🛍 Магазин", callback_data="shop_menu")],
-        [InlineKeyboardButton(text="🎯 Челлендж дня", callback_data="daily_challenge"),
-         InlineKeyboardButton(text="💬 Спросить у GPT-4o", callback_data="ask_ai")],
-        [InlineKeyboardButton(text="👥 Рефералы", callback_data="referrals"),
-         InlineKeyboardButton(text="🏆 Уровень", callback_data="level_progress")]
-    ]
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
+    return KEYBOARDS.main_menu
 
-# Меню психологии
-def get_psychology_keyboard():
-    buttons = []
-    for feature in PSYCHOLOGY_FEATURES:
-        buttons.append([InlineKeyboardButton(text=feature["title"], callback_data=f"psy_{feature['title']}")])
-    buttons.append([InlineKeyboardButton(text="🔙 Назад", callback_data="back_to_main")])
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
+# Меню психологических практик (премиум и бесплатный вариант)
+def get_psychology_keyboard(premium: bool = False):
+    return KEYBOARDS.psychology(premium)
 
 # Меню магазина
 def get_shop_keyboard():
-    buttons = [
-        [InlineKeyboardButton(text="💎 Премиум за сердечки", callback_data="hearts_shop")],
-        [InlineKeyboardButton(text="💳 Платные функции", callback_data="paid_shop")],
-        [InlineKeyboardButton(text="💎 Премиум подписка", callback_data="premium_shop")],
-        [InlineKeyboardButton(text="🔙 Назад", callback_data="back_to_main")]
-    ]
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
+    return KEYBOARDS.shop
 
 # Магазин за сердечки
 def get_hearts_shop_keyboard():
-    buttons = []
-    for item in HEARTS_SHOP_ITEMS:
-        buttons.append([InlineKeyboardButton(text=f"{item['name']} - {item['price']}💖", callback_data=f"buy_hearts_{item['days']}")])
-    buttons.append([InlineKeyboardButton(text="🔙 Назад", callback_data="shop_menu")])
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
+    return KEYBOARDS.hearts_shop
 
 # Магазин платных функций
 def get_paid_shop_keyboard():
-    buttons = []
-    for item in PAID_SHOP_ITEMS:
-        buttons.append([InlineKeyboardButton(text=f"{item['name']} - {item['price_usd']}$", callback_data=f"buy_paid_{item['name']}")])
-    buttons.append([InlineKeyboardButton(text="🔙 Назад", callback_data="shop_menu")])
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
+    return KEYBOARDS.paid_shop
 
 # Магазин премиума за реальные деньги
 def get_premium_shop_keyboard():
-    buttons = []
-    for item in PREMIUM_SHOP_ITEMS:
-        buttons.append([InlineKeyboardButton(text=f"{item['name']} - {item['price_usd']}$", callback_data=f"buy_premium_{item['name']}")])
-    buttons.append([InlineKeyboardButton(text="🔙 Назад", callback_data="shop_menu")])
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
+    return KEYBOARDS.premium_shop
 
 # Клавиатура возврата в главное меню
 def get_back_to_main_keyboard():
-    return InlineKeyboardMarkup(
-        inline_keyboard=[[InlineKeyboardButton(text="🏠 Главное меню", callback_data="back_to_main")]]
-    )
+    return KEYBOARDS.back_to_main
 
 # ==========================================
 # 🎯 Основные обработчики (Handlers)
@@ -831,13 +964,12 @@ def get_back_to_main_keyboard():
 
 # Старт бота
 @router.message(CommandStart())
-async def command_start(message: Message, state: FSMContext):
+async def command_start(message: Message, state: FSMContext, user: Optional[UserRecord]):
     # Проверяем реферальную ссылку
     referral_code = None
     if len(message.text.split()) > 1:
         referral_code = message.text.split()[1]
 
-    user = await get_user(message.from_user.id)
 
     if not user:
         # Создаем нового пользователя
@@ -849,7 +981,7 @@ async def command_start(message: Message, state: FSMContext):
 
         # Обрабатываем реферала
         if referral_code:
-            async with async_session() as session:
+            async with db_session() as session:
                 result = await session.execute(
                     text("SELECT telegram_id FROM users WHERE referral_code = :code"),
                     {"code": referral_code}
@@ -857,6 +989,7 @@ async def command_start(message: Message, state: FSMContext):
                 referrer = result.scalar()
                 
                 if referrer and referrer != message.from_user.id:
+                    await update_user(message.from_user.id, referrer_id=referrer)
                     await update_user(
                         referrer,
                         referrals_count=users.c.referrals_count + 1,
@@ -866,6 +999,13 @@ async def command_start(message: Message, state: FSMContext):
                     await add_hearts(referrer, 15)
                     # Продлеваем премиум рефереру на 2 дня
                     await extend_premium(referrer, days=2)
+    else:
+        # /start после блокировки бота — снова получает рассылки
+        async with db_session() as session:
+            await mark_reachable(session, message.from_user.id)
+
+    # Регистрация закончена — отпускаем соединение на время анимации
+    await release_connection()
 
     # Показываем анимацию загрузки
     await show_loading_animation(message.chat.id)
@@ -881,6 +1021,48 @@ async def command_start(message: Message, state: FSMContext):
         # Если данные есть - показываем профиль
         await show_profile(message.from_user.id, message.chat.id)
 
+# Часовой пояс для челленджей: /timezone — выбор кнопками, /timezone Омск — сразу
+@router.message(Command("timezone"))
+async def command_timezone(message: Message, user: Optional[UserRecord]):
+    if not user:
+        await message.answer("Сначала запустите бота командой /start")
+        return
+
+    args = message.text.split(maxsplit=1)
+    if len(args) > 1:
+        name = find_timezone(args[1])
+        if name is None:
+            await message.answer("❌ Не знаю такой часовой пояс. Выберите из списка:", reply_markup=KEYBOARDS.timezones)
+            return
+        await update_user(message.from_user.id, timezone=name)
+        await message.answer(timezone_saved_text(name), reply_markup=get_back_to_main_keyboard())
+        return
+
+    current = user.get("timezone") or DEFAULT_TIMEZONE
+    await message.answer(
+        f"🕘 Ваш часовой пояс: {DELIVERY_TIMEZONES.get(current, current)}\n\n"
+        f"Челленджи приходят в {DELIVERY_SLOTS['morning']}:00 и {DELIVERY_SLOTS['evening']}:00 "
+        f"по вашему времени. Выберите пояс:",
+        reply_markup=KEYBOARDS.timezones,
+    )
+
+@router.callback_query(F.data.startswith("tz_"))
+async def choose_timezone(callback: CallbackQuery):
+    name = callback.data.removeprefix("tz_")
+    if name not in DELIVERY_TIMEZONES:
+        await callback.answer("❌ Неизвестный часовой пояс", show_alert=True)
+        return
+    await update_user(callback.from_user.id, timezone=name)
+    await callback.message.edit_text(timezone_saved_text(name), reply_markup=get_back_to_main_keyboard())
+    await callback.answer()
+
+def timezone_saved_text(name: str) -> str:
+    local_time = datetime.now(pytz.timezone(name)).strftime("%H:%M")
+    return (
+        f"✅ Часовой пояс: {DELIVERY_TIMEZONES[name]} (сейчас у вас {local_time}).\n"
+        f"Челленджи будут приходить в {DELIVERY_SLOTS['morning']}:00 и {DELIVERY_SLOTS['evening']}:00 по вашему времени."
+    )
+
 async def show_loading_animation(chat_id: int):
     """Показать анимацию загрузки"""
     steps = [
@@ -949,7 +1131,7 @@ async def process_gender(message: Message, state: FSMContext):
 
 async def show_profile(user_id: int, chat_id: int):
     """Показать профиль пользователя"""
-    user = await get_user(user_id)
+    user = await get_user(user_id, PROFILE_COLUMNS)
     if not user:
         return
     
@@ -972,14 +1154,15 @@ async def show_profile(user_id: int, chat_id: int):
     if user["user_type"] == "free":
         ai_limits = "🚫 Нет доступа"
     elif user["user_type"] == "trial":
-        remaining = 22 - user["total_requests"]
+        remaining = 22 - quota.usage(user).window_requests
         ai_limits = (
             f"🔹 {remaining}/22 запросов в неделю\n"
             f"🔸 До 500 токенов на запрос"
         )
     else:  # premium
-        remaining = 20 - user["daily_requests"]
-        saved_requests = min(user.get("saved_requests", 0), 150 - user["daily_requests"])
+        daily_requests = quota.usage(user).daily_requests
+        remaining = 20 - daily_requests
+        saved_requests = min(user.get("saved_requests", 0), 150 - daily_requests)
         ai_limits = (
             f"💎 {remaining + saved_requests}/20+{saved_requests} запросов сегодня\n"
             f"✨ До 800 токенов на запрос"
@@ -988,7 +1171,7 @@ async def show_profile(user_id: int, chat_id: int):
     # Формируем текст профиля
     profile_text = (
         f"👤 {html.bold(user['name'])}\n"
-        f"🔹 Уровень: {user['level']} ({user['experience']}/100 XP)\n"
+        f"🔹 Уровень: {user['level']} ({user['experience']}/{LEVEL_CURVE.xp_for(user['level'])} XP)\n"
         f"💖 Сердечки: {user['hearts']}\n\n"
         f"🎟️ Подписка: {subscription_type}\n"
         f"{subscription_status}\n\n"
@@ -1023,9 +1206,8 @@ async def show_profile(user_id: int, chat_id: int):
     
 # Обработчики Админ панели
 @router.callback_query(F.data == "admin_panel")
-async def admin_panel(callback: CallbackQuery):
+async def admin_panel(callback: CallbackQuery, user: Optional[UserRecord]):
     """Показать админ-панель"""
-    user = await get_user(callback.from_user.id)
     if not user or not user["is_admin"]:
         await callback.answer("⛔ У вас нет доступа к этой команде.")
         return
@@ -1054,9 +1236,8 @@ async def admin_panel(callback: CallbackQuery):
     await callback.answer()
 
 @router.callback_query(F.data.startswith("admin_"))
-async def handle_admin_actions(callback: CallbackQuery, state: FSMContext):
+async def handle_admin_actions(callback: CallbackQuery, state: FSMContext, user: Optional[UserRecord]):
     """Обработчик админских действий"""
-    user = await get_user(callback.from_user.id)
     if not user or not user["is_admin"]:
         await callback.answer("⛔ У вас нет доступа к этой команде.")
         return
@@ -1065,7 +1246,7 @@ async def handle_admin_actions(callback: CallbackQuery, state: FSMContext):
     
     if action == "view":
         await callback.message.answer(
-            "Введите username или ID пользователя для просмотра:"
+            "Введите username или ID пользователя для просмотра (можно несколько через пробел):"
         )
         await state.set_state(AdminStates.waiting_for_premium_username)
     elif action == "ban":
@@ -1095,13 +1276,53 @@ async def handle_admin_actions(callback: CallbackQuery, state: FSMContext):
                 "Введите промокод:"
             )
             await state.set_state(AdminStates.waiting_for_promo_code)
+    elif action == "stats":
+        await callback.message.answer(format_bot_stats())
     
     await callback.answer()
 
+def format_bot_stats() -> str:
+    """Технические метрики бота для админ-панели"""
+    pool = pool_snapshot(engine)
+    lines = [
+        "📊 Статистика бота\n",
+        "🗄 Пул соединений БД:",
+        *(f"• {key}: {value}" for key, value in pool.items()),
+        "\n👤 Кэш пользователей:",
+        *(f"• {key}: {value}" for key, value in user_cache.stats().items()),
+        "\n💖 Буфер сердечек:",
+        *(f"• {key}: {value}" for key, value in counters.stats().items()),
+        "\n💱 Курс USD→RUB:",
+        *(f"• {key}: {value}" for key, value in usd_rates.stats().items()),
+        "\n🚦 Очередь запросов к AI:",
+        *(f"• {key}: {value}" for key, value in ai_admission.stats().items()),
+        "\n🤖 Соединения с OpenAI:",
+        *(f"• {key}: {value}" for key, value in openai_client.stats().items()),
+        *(f"• {key}: {value}" for key, value in openai_resilience.stats().items()),
+        *(f"• {key}: {value}" for key, value in ai_single_flight.stats().items()),
+        *(f"• {key}: {value}" for key, value in ai_stream_flight.stats().items()),
+        "\n🗃 Кэш шаблонных ответов AI:",
+        *(f"• {key}: {value}" for key, value in ai_response_cache.stats().items()),
+        "\n💬 История диалогов:",
+        *(f"• {key}: {value}" for key, value in conversations.stats().items()),
+        "\n📣 Рассылки:",
+        *(f"• {key}: {value}" for key, value in broadcaster.stats().items()),
+        *(f"• {key}: {value}" for key, value in broadcasts.stats().items()),
+        "\n🕘 Челленджи по местному времени:",
+        *(f"• {key}: {value}" for key, value in challenge_delivery.stats().items()),
+    ]
+    return "\n".join(lines)
+
 # Обработчики состояний админ-панели
 @router.message(StateFilter(AdminStates.waiting_for_premium_username))
 async def admin_view_user(message: Message, state: FSMContext):
     """Просмотр информации о пользователе"""
+    identifiers = message.text.replace(",", " ").split()
+    if len(identifiers) > 1:
+        await admin_view_users(message, identifiers)
+        await state.clear()
+        return
+    
     identifier = message.text.strip()
     user = await find_user(identifier)
     
@@ -1165,46 +1386,79 @@ async def admin_unban_user(message: Message, state: FSMContext):
     await message.answer(f"Пользователь {user.get('name', '')} успешно разбанен.")
     await state.clear()
 
-async def find_user(identifier: str) -> Optional[Dict[str, Any]]:
+async def admin_view_users(message: Message, identifiers: List[str]):
+    """Краткая сводка по нескольким пользователям"""
+    found = await find_users(identifiers)
+    if not found:
+        await message.answer("Пользователи не найдены.")
+        return
+    
+    lines = [f"👥 Найдено: {len(found)} из {len(identifiers)}\n"]
+    for user in found:
+        lines.append(
+            f"• {html.quote(user.get('name') or 'Без имени')} ({user['telegram_id']}): "
+            f"💖 {user['hearts']}, 🔹 {user['level']}, "
+            f"{'💎' if user['is_premium'] else '🆓'}{' ⛔' if user['is_banned'] else ''}"
+        )
+    await message.answer("\n".join(lines))
+
+async def find_users(identifiers: Sequence[str]) -> List[UserRecord]:
+    """Найти пользователей по списку username/ID двумя запросами"""
+    ids = [int(identifier) for identifier in identifiers if identifier.isdigit()]
+    usernames = [identifier.lstrip("@") for identifier in identifiers if not identifier.isdigit()]
+    try:
+        found = list((await get_users_many(ids, ADMIN_COLUMNS)).values()) if ids else []
+        if usernames:
+            async with db_session() as session:
+                found += await fetch_user_records(session, usernames, ADMIN_COLUMNS, key="username")
+        return list({user["telegram_id"]: user for user in found}.values())
+    except Exception as e:
+        logger.error(f"Ошибка поиска пользователей: {e}")
+        return []
+
+async def find_user(identifier: str) -> Optional[UserRecord]:
     """Найти пользователя по username или ID"""
     try:
-        async with async_session() as session:
+        async with db_session() as session:
             # Пробуем найти по ID
             if identifier.isdigit():
-                result = await session.execute(
-                    text("SELECT * FROM users WHERE telegram_id = :id"),
-                    {"id": int(identifier)}
-                )
-                user = result.mappings().first()
+                user = await fetch_user_record(session, int(identifier), ADMIN_COLUMNS)
                 if user:
-                    return dict(user)
+                    return user
             
             # Удаляем @ если есть
             if identifier.startswith("@"):
                 identifier = identifier[1:]
             
             # Ищем по username
-            result = await session.execute(
-                text("SELECT * FROM users WHERE username = :username"),
-                {"username": identifier}
-            )
-            user = result.mappings().first()
-            return dict(user) if user else None
+            return await fetch_user_record_by_username(session, identifier, ADMIN_COLUMNS)
     except Exception as e:
         logger.error(f"Ошибка поиска пользователя: {e}")
         return None
+
+async def get_diary_password(telegram_id: int) -> Optional[str]:
+    """Получить пароль дневника (в запись пользователя он не загружается)"""
+    async with db_session() as session:
+        return await fetch_diary_password(session, telegram_id)
     
+# После верного пароля записи дневника открыты ненадолго
+DIARY_UNLOCK_TTL = timedelta(minutes=10)
+
+async def diary_unlocked(state: FSMContext) -> bool:
+    """Вводил ли пользователь пароль дневника в последние DIARY_UNLOCK_TTL"""
+    until = (await state.get_data()).get("diary_unlocked_until")
+    return until is not None and until > datetime.now(timezone.utc).timestamp()
+
 # Обработчики для дневника
 @router.callback_query(F.data == "diary_menu")
-async def diary_menu(callback: CallbackQuery, state: FSMContext):
+async def diary_menu(callback: CallbackQuery, state: FSMContext, user: Optional[UserRecord]):
     """Меню дневника"""
-    user = await get_user(callback.from_user.id)
     if not user:
         await callback.answer("Ошибка доступа к дневнику.")
         return
     
     # Проверяем, установлен ли пароль
-    if not user.get("diary_password"):
+    if not await get_diary_password(callback.from_user.id):
         await callback.message.answer(
             "🔒 Для доступа к дневнику установите пароль (от 4 символов):"
         )
@@ -1212,6 +1466,11 @@ async def diary_menu(callback: CallbackQuery, state: FSMContext):
         await callback.answer()
         return
     
+    if await diary_unlocked(state):
+        await show_diary_menu(callback.from_user.id, callback.message.chat.id)
+        await callback.answer()
+        return
+    
     # Запрашиваем пароль для доступа
     await callback.message.answer(
         "🔒 Введите пароль для доступа к дневнику:"
@@ -1220,17 +1479,17 @@ async def diary_menu(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
 
 @router.message(StateFilter(UserStates.waiting_for_diary_password))
-async def process_diary_password(message: Message, state: FSMContext):
+async def process_diary_password(message: Message, state: FSMContext, user: Optional[UserRecord]):
     """Обработка пароля дневника"""
-    user = await get_user(message.from_user.id)
     if not user:
         await state.clear()
         return
     
     password = message.text.strip()
+    diary_password = await get_diary_password(message.from_user.id)
     
     # Если пароль не установлен - сохраняем новый
-    if not user.get("diary_password"):
+    if not diary_password:
         if len(password) < 4:
             await message.answer("Пароль должен содержать минимум 4 символа.")
             return
@@ -1244,12 +1503,15 @@ async def process_diary_password(message: Message, state: FSMContext):
         return
     
     # Проверяем введенный пароль
-    if password != user["diary_password"]:
+    if password != diary_password:
         await message.answer("❌ Неверный пароль. Попробуйте еще раз.")
         return
     
-    # Пароль верный - показываем меню дневника
+    # Пароль верный - открываем дневник и показываем меню
     await state.clear()
+    await state.update_data(
+        diary_unlocked_until=(datetime.now(timezone.utc) + DIARY_UNLOCK_TTL).timestamp()
+    )
     await show_diary_menu(message.from_user.id, message.chat.id)
 
 async def show_diary_menu(user_id: int, chat_id: int):
@@ -1279,14 +1541,13 @@ async def diary_new_entry(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
 
 @router.message(StateFilter(UserStates.waiting_for_diary_entry))
-async def process_diary_entry(message: Message, state: FSMContext):
+async def process_diary_entry(message: Message, state: FSMContext, user: Optional[UserRecord]):
     """Обработка новой записи в дневнике"""
     entry_text = message.text.strip()
     if len(entry_text) < 50:
         await message.answer("Запись должна содержать минимум 50 символов.")
         return
     
-    user = await get_user(message.from_user.id)
     if not user:
         await state.clear()
         return
@@ -1303,7 +1564,7 @@ async def process_diary_entry(message: Message, state: FSMContext):
         await add_hearts(message.from_user.id, reward)
     
     # Сохраняем запись
-    async with async_session.begin() as session:
+    async with db_session() as session:
         await session.execute(
             diary_entries.insert().values(
                 user_id=message.from_user.id,
@@ -1322,24 +1583,89 @@ async def process_diary_entry(message: Message, state: FSMContext):
 
 async def count_diary_entries(user_id: int) -> int:
     """Посчитать количество записей в дневнике"""
-    async with async_session() as session:
+    async with db_session() as session:
         result = await session.execute(
             text("SELECT COUNT(*) FROM diary_entries WHERE user_id = :user_id"),
             {"user_id": user_id}
         )
         return result.scalar()
 
+DIARY_PERIOD_TITLES = {
+    "day": "📆 Записи за сегодня",
+    "week": "📅 Записи за неделю",
+    "month": "🗓️ Записи за месяц",
+}
+DIARY_PAGE_SIZE = 10
+
+async def get_diary_entries(
+    user_id: int, period: str, tz: tzinfo, limit: int = DIARY_PAGE_SIZE
+) -> Tuple[int, List[Dict[str, Any]]]:
+    """Последние записи дневника за период (по местному времени `tz`) и их общее число"""
+    async with db_session() as session:
+        result = await session.execute(
+            text(f"""
+                SELECT entry_text, created_at, COUNT(*) OVER () AS total
+                FROM diary_entries
+                WHERE user_id = :user_id AND {period_sql("created_at")}
+                ORDER BY created_at DESC
+                LIMIT :limit
+            """),
+            {"user_id": user_id, "limit": limit, **period_params(period, tz)}
+        )
+        rows = result.mappings().all()
+    return (rows[0]["total"] if rows else 0), [dict(row) for row in rows]
+
+@router.callback_query(F.data.in_({"diary_view_day", "diary_view_week", "diary_view_month"}))
+async def diary_view_period(callback: CallbackQuery, state: FSMContext, user: Optional[UserRecord]):
+    """Записи дневника за день/неделю/месяц"""
+    if not await diary_unlocked(state):
+        await callback.message.answer(
+            "🔒 Введите пароль для доступа к дневнику:"
+        )
+        await state.set_state(UserStates.waiting_for_diary_password)
+        await callback.answer()
+        return
+    
+    period = callback.data.removeprefix("diary_view_")
+    tz = user_timezone(user.get("timezone") if user else None)
+    total, entries = await get_diary_entries(callback.from_user.id, period, tz)
+    
+    if not entries:
+        text = f"{DIARY_PERIOD_TITLES[period]}\n\nЗаписей пока нет."
+    else:
+        text = f"{DIARY_PERIOD_TITLES[period]} ({total})\n"
+        for entry in entries:
+            created = entry["created_at"]
+            if created.tzinfo is None:
+                created = pytz.utc.localize(created)
+            created = created.astimezone(tz)
+            entry_text = entry["entry_text"]
+            if len(entry_text) > 300:
+                entry_text = entry_text[:300] + "…"
+            text += f"\n🕒 {created.strftime('%d.%m %H:%M')}\n{html.quote(entry_text)}\n"
+        if total > len(entries):
+            text += f"\n…и ещё {total - len(entries)}"
+    
+    await callback.message.answer(
+        text,
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="🔙 Назад", callback_data="diary_menu")]
+        ])
+    )
+    await callback.answer()
+
 # Обработчик для привычек
 @router.callback_query(F.data == "habits_menu")
-async def habits_menu(callback: CallbackQuery):
+async def habits_menu(callback: CallbackQuery, user: Optional[UserRecord]):
     """Меню привычек"""
-    user = await get_user(callback.from_user.id)
     if not user:
         await callback.answer("Ошибка доступа.")
         return
     
     habits_count = await count_habits(callback.from_user.id)
-    completed_today = await count_completed_habits_today(callback.from_user.id)
+    completed_today = await count_completed_habits_today(
+        callback.from_user.id, user_timezone(user.get("timezone"))
+    )
     
     text = (
         "✅ Привычки и цели\n\n"
@@ -1425,7 +1751,7 @@ async def process_habit_time(message: Message, state: FSMContext):
     await state.clear()
     
     # Сохраняем привычку
-    async with async_session.begin() as session:
+    async with db_session() as session:
         await session.execute(
             habits.insert().values(
                 user_id=message.from_user.id,
@@ -1444,7 +1770,7 @@ async def process_habit_time(message: Message, state: FSMContext):
 
 async def show_habits_list(user_id: int, chat_id: int):
     """Показать список привычек пользователя"""
-    async with async_session() as session:
+    async with db_session() as session:
         result = await session.execute(
             text("SELECT * FROM habits WHERE user_id = :user_id ORDER BY created_at DESC"),
             {"user_id": user_id}
@@ -1480,32 +1806,30 @@ async def show_habits_list(user_id: int, chat_id: int):
 
 async def count_habits(user_id: int) -> int:
     """Посчитать количество привычек"""
-    async with async_session() as session:
+    async with db_session() as session:
         result = await session.execute(
             text("SELECT COUNT(*) FROM habits WHERE user_id = :user_id"),
             {"user_id": user_id}
         )
         return result.scalar()
 
-async def count_completed_habits_today(user_id: int) -> int:
-    """Посчитать выполненные сегодня привычки"""
-    today = datetime.now(timezone.utc).date()
-    async with async_session() as session:
+async def count_completed_habits_today(user_id: int, tz: tzinfo) -> int:
+    """Посчитать привычки, выполненные сегодня по местному времени `tz`"""
+    async with db_session() as session:
         result = await session.execute(
-            text("""
+            text(f"""
                 SELECT COUNT(*) FROM habit_completions hc
                 JOIN habits h ON hc.habit_id = h.id
-                WHERE h.user_id = :user_id AND DATE(hc.completed_at) = :today
+                WHERE h.user_id = :user_id AND {period_sql("hc.completed_at")}
             """),
-            {"user_id": user_id, "today": today}
+            {"user_id": user_id, **period_params("day", tz)}
         )
         return result.scalar()
 
 # Обработчик для премиум раздела
 @router.callback_query(F.data == "premium_menu")
-async def premium_menu(callback: CallbackQuery):
+async def premium_menu(callback: CallbackQuery, user: Optional[UserRecord]):
     """Меню премиум-подписки"""
-    user = await get_user(callback.from_user.id)
     if not user:
         await callback.answer("Ошибка доступа.")
         return
@@ -1547,9 +1871,8 @@ async def premium_menu(callback: CallbackQuery):
     await callback.answer()
 
 @router.callback_query(F.data == "premium_buy")
-async def premium_buy(callback: CallbackQuery, state: FSMContext):
+async def premium_buy(callback: CallbackQuery, state: FSMContext, user: Optional[UserRecord]):
     """Покупка премиум-подписки"""
-    user = await get_user(callback.from_user.id)
     if not user:
         await callback.answer("Ошибка доступа.")
         return
@@ -1660,7 +1983,7 @@ async def process_trx_hash(message: Message, state: FSMContext):
     price = data.get("price", 299)
     
     # Сохраняем платеж в базу
-    async with async_session.begin() as session:
+    async with db_session() as session:
         await session.execute(
             payments.insert().values(
                 user_id=message.from_user.id,
@@ -1683,9 +2006,8 @@ async def process_trx_hash(message: Message, state: FSMContext):
     
 # Обработчик для рефералов
 @router.callback_query(F.data == "referrals")
-async def referrals_menu(callback: CallbackQuery):
+async def referrals_menu(callback: CallbackQuery, user: Optional[UserRecord]):
     """Меню рефералов"""
-    user = await get_user(callback.from_user.id)
     if not user:
         await callback.answer("Ошибка доступа.")
         return
@@ -1718,21 +2040,52 @@ async def referrals_menu(callback: CallbackQuery):
     await callback.answer()
 
 @router.callback_query(F.data == "ref_copy")
-async def copy_referral_link(callback: CallbackQuery):
+async def copy_referral_link(callback: CallbackQuery, user: Optional[UserRecord]):
     """Копирование реферальной ссылки"""
-    user = await get_user(callback.from_user.id)
     if not user:
         await callback.answer("Ошибка доступа.")
         return
     
     ref_link = f"https://t.me/{bot._me.username}?start={user['referral_code']}"
     await callback.answer(f"Ссылка скопирована: {ref_link}", show_alert=True)
+
+REFERRALS_PAGE_SIZE = 10
+
+async def get_recent_referrals(referrer_id: int, limit: int = REFERRALS_PAGE_SIZE) -> List[UserRecord]:
+    """Последние приглашённые пользователем (индекс по referrer_id)"""
+    columns = ("telegram_id", "name", "created_at")
+    async with db_session() as session:
+        result = await session.execute(
+            text(select_users_sql(columns, "referrer_id = :referrer_id") + " ORDER BY created_at DESC LIMIT :limit"),
+            {"referrer_id": referrer_id, "limit": limit}
+        )
+        return [UserRecord.from_row(columns, row) for row in result]
+
+@router.callback_query(F.data == "ref_list")
+async def referrals_list(callback: CallbackQuery):
+    """Последние рефералы пользователя"""
+    referrals = await get_recent_referrals(callback.from_user.id)
+    
+    if not referrals:
+        text = "📊 Вы пока никого не пригласили."
+    else:
+        text = "📊 Последние рефералы:\n\n" + "\n".join(
+            f"{i}. {html.quote(ref.get('name') or 'Без имени')} — {ref['created_at'].strftime('%d.%m.%Y')}"
+            for i, ref in enumerate(referrals, 1)
+        )
+    
+    await callback.message.answer(
+        text,
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="🔙 Назад", callback_data="referrals")]
+        ])
+    )
+    await callback.answer()
     
 # Обработчики для психологических практик
 @router.callback_query(F.data == "psychology_menu")
-async def psychology_menu(callback: CallbackQuery):
+async def psychology_menu(callback: CallbackQuery, user: Optional[UserRecord]):
     """Меню психологических практик"""
-    user = await get_user(callback.from_user.id)
     if not user:
         await callback.answer("Ошибка доступа.")
         return
@@ -1742,40 +2095,20 @@ async def psychology_menu(callback: CallbackQuery):
     
     text = "🧠 Психологические практики\n\nВыберите технику для работы:"
     
-    buttons = []
-    for practice in PSYCHOLOGY_PRACTICES:
-        if practice["premium_only"] and not is_premium:
-            continue
-        
-        btn_text = practice["title"]
-        if practice["hearts_cost"] > 0:
-            btn_text += f" ({practice['hearts_cost']}💖)"
-        
-        buttons.append([
-            InlineKeyboardButton(
-                text=btn_text,
-                callback_data=f"psy_{PSYCHOLOGY_PRACTICES.index(practice)}")
-        ])
-    
-    buttons.append([InlineKeyboardButton(text="🔙 Назад", callback_data="back_to_profile")])
-    
     await callback.message.edit_text(
         text,
-        reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons)
+        reply_markup=get_psychology_keyboard(is_premium)
     )
     await callback.answer()
 
 @router.callback_query(F.data.startswith("psy_"))
-async def show_practice(callback: CallbackQuery):
+async def show_practice(callback: CallbackQuery, user: Optional[UserRecord]):
     """Показать психологическую практику"""
-    practice_idx = int(callback.data.split("_")[1])
-    if practice_idx >= len(PSYCHOLOGY_PRACTICES):
+    practice = CATALOG.psychology_practices.get(callback.data.removeprefix("psy_"))
+    if practice is None:
         await callback.answer("Практика не найдена.")
         return
     
-    practice = PSYCHOLOGY_PRACTICES[practice_idx]
-    user = await get_user(callback.from_user.id)
-    
     if not user:
         await callback.answer("Ошибка доступа.")
         return
@@ -1807,17 +2140,65 @@ async def show_practice(callback: CallbackQuery):
         f"🧠 {practice['title']}\n\n{practice['content']}\n\n"
         "Хотите обсудить эту технику с AI-психологом?",
         reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="💬 Обсудить с AI", callback_data=f"psyai_{practice_idx}")],
+            [InlineKeyboardButton(text="💬 Обсудить с AI", callback_data=f"psyai_{practice['id']}")],
             [InlineKeyboardButton(text="🔙 Назад", callback_data="psychology_menu")]
         ])
     )
     await callback.answer()
     
+# Промпт без личных данных — ответ можно кэшировать и делить между пользователями
+PRACTICE_DISCUSSION_PROMPT = (
+    "Расскажи подробнее о психологической технике «{title}»: в чём её смысл, "
+    "как выполнять её шаг за шагом и каких ошибок избегать."
+)
+PRACTICE_DISCUSSION_MAX_TOKENS = 500
+
+@router.callback_query(F.data.startswith("psyai_"))
+async def discuss_practice(callback: CallbackQuery, user: Optional[UserRecord]):
+    """Обсудить практику с AI"""
+    practice = CATALOG.psychology_practices.get(callback.data.removeprefix("psyai_"))
+    if practice is None:
+        await callback.answer("Практика не найдена.")
+        return
+    if not user:
+        await callback.answer("Ошибка доступа.")
+        return
+    allowed, reason = await check_ai_limits(user)
+    if not allowed:
+        await callback.answer(reason, show_alert=True)
+        return
+    tier = user["user_type"]
+    await callback.answer()
+
+    placeholder = await callback.message.answer("🤖 Думаю над ответом...")
+    await release_connection()
+    usage = {}
+    try:
+        async with ai_admission.admit(tier):
+            response_text = await ask_openai(
+                PRACTICE_DISCUSSION_PROMPT.format(title=practice["title"]),
+                max_tokens=min(PRACTICE_DISCUSSION_MAX_TOKENS, request_max_tokens(quota.limits(tier), quota.usage(user))),
+                on_usage=usage.update,
+                cacheable=True,
+            )
+    except AdmissionRejected as e:
+        logger.warning(f"Запрос к AI от {callback.from_user.id} отклонён: {e}")
+        await placeholder.edit_text("⏳ Сейчас слишком много запросов к AI. Попробуйте ещё раз через минуту.")
+        return
+
+    await StreamingMessage(placeholder, header=f"🔮 {practice['title']}\n\n").finish(
+        response_text,
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="🔙 Назад", callback_data="psychology_menu")]
+        ]),
+    )
+    if usage:
+        await record_ai_usage(user, tier, usage)
+
 # Обработчки для магазина
 @router.callback_query(F.data == "shop_menu")
-async def shop_menu(callback: CallbackQuery):
+async def shop_menu(callback: CallbackQuery, user: Optional[UserRecord]):
     """Меню магазина"""
-    user = await get_user(callback.from_user.id)
     if not user:
         await callback.answer("Ошибка доступа.")
         return
@@ -1828,55 +2209,35 @@ async def shop_menu(callback: CallbackQuery):
         "Выберите категорию:"
     )
     
-    buttons = [
-        [InlineKeyboardButton(text="📚 Психологические материалы", callback_data="shop_digital")],
-        [InlineKeyboardButton(text="💎 Премиум за сердечки", callback_data="shop_premium")],
-        [InlineKeyboardButton(text="🔙 Назад", callback_data="back_to_profile")],
-    ]
-    
     await callback.message.edit_text(
         text,
-        reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons)
+        reply_markup=KEYBOARDS.shop_categories
     )
     await callback.answer()
 
 @router.callback_query(F.data == "shop_digital")
-async def shop_digital(callback: CallbackQuery):
+async def shop_digital(callback: CallbackQuery, user: Optional[UserRecord]):
     """Цифровые товары"""
-    user = await get_user(callback.from_user.id)
     if not user:
         await callback.answer("Ошибка доступа.")
         return
     
     text = "📚 Психологические материалы\n\nВыберите товар:"
     
-    buttons = []
-    for item in [i for i in SHOP_ITEMS if i["type"] == "digital"]:
-        buttons.append([
-            InlineKeyboardButton(
-                text=f"{item['name']} - {item['price']}💖",
-                callback_data=f"shop_item_{SHOP_ITEMS.index(item)}")
-        ])
-    
-    buttons.append([InlineKeyboardButton(text="🔙 Назад", callback_data="shop_menu")])
-    
     await callback.message.edit_text(
         text,
-        reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons)
+        reply_markup=KEYBOARDS.shop_digital
     )
     await callback.answer()
 
 @router.callback_query(F.data.startswith("shop_item_"))
-async def shop_item(callback: CallbackQuery):
+async def shop_item(callback: CallbackQuery, user: Optional[UserRecord]):
     """Просмотр товара"""
-    item_idx = int(callback.data.split("_")[2])
-    if item_idx >= len(SHOP_ITEMS):
+    item = CATALOG.shop_items.get(callback.data.removeprefix("shop_item_"))
+    if item is None:
         await callback.answer("Товар не найден.")
         return
     
-    item = SHOP_ITEMS[item_idx]
-    user = await get_user(callback.from_user.id)
-    
     if not user:
         await callback.answer("Ошибка доступа.")
         return
@@ -1893,7 +2254,7 @@ async def shop_item(callback: CallbackQuery):
     )
     
     buttons = [
-        [InlineKeyboardButton(text="🛒 Купить", callback_data=f"buy_item_{item_idx}")],
+        [InlineKeyboardButton(text="🛒 Купить", callback_data=f"buy_item_{item['id']}")],
         [InlineKeyboardButton(text="🔙 Назад", callback_data="shop_digital")],
     ]
     
@@ -1904,16 +2265,13 @@ async def shop_item(callback: CallbackQuery):
     await callback.answer()
 
 @router.callback_query(F.data.startswith("buy_item_"))
-async def buy_item(callback: CallbackQuery):
+async def buy_item(callback: CallbackQuery, user: Optional[UserRecord]):
     """Покупка товара"""
-    item_idx = int(callback.data.split("_")[2])
-    if item_idx >= len(SHOP_ITEMS):
+    item = CATALOG.shop_items.get(callback.data.removeprefix("buy_item_"))
+    if item is None:
         await callback.answer("Товар не найден.")
         return
     
-    item = SHOP_ITEMS[item_idx]
-    user = await get_user(callback.from_user.id)
-    
     if not user:
         await callback.answer("Ошибка доступа.")
         return
@@ -1943,9 +2301,8 @@ async def buy_item(callback: CallbackQuery):
     
 # Обработчки для ежедневных челенджей 
 @router.callback_query(F.data == "daily_challenges")
-async def daily_challenges(callback: CallbackQuery):
+async def daily_challenges(callback: CallbackQuery, user: Optional[UserRecord]):
     """Ежедневные челленджи"""
-    user = await get_user(callback.from_user.id)
     if not user:
         await callback.answer("Ошибка доступа.")
         return
@@ -2014,12 +2371,13 @@ async def finish_challenge(callback: CallbackQuery, state: FSMContext):
     
     # Награждаем пользователя
     await add_hearts(callback.from_user.id, challenge["reward"])
-    await add_experience(callback.from_user.id, 5)
+    progress = await add_experience(callback.from_user.id, 5)
     
     await callback.message.edit_text(
         f"🎉 Поздравляем! Вы выполнили челлендж и получаете {challenge['reward']} 💖\n\n"
         f"{challenge['title']}\n"
-        f"Время выполнения: {elapsed//60} минут",
+        f"Время выполнения: {elapsed//60} минут"
+        f"{format_level_up(progress)}",
         reply_markup=get_back_to_profile_keyboard()
     )
     await state.clear()
@@ -2048,7 +2406,7 @@ async def process_successful_payment(message: Message):
         )
     
     # Сохраняем платеж в базу
-    async with async_session.begin() as session:
+    async with db_session() as session:
         await session.execute(
             payments.insert().values(
                 user_id=user_id,
@@ -2064,7 +2422,7 @@ async def process_successful_payment(message: Message):
 
 async def extend_premium(user_id: int, days: int) -> bool:
     """Продлить премиум-подписку на указанное количество дней"""
-    user = await get_user(user_id)
+    user = await get_user(user_id, ENTITLEMENT_COLUMNS)
     if not user:
         return False
     
@@ -2086,9 +2444,7 @@ async def extend_premium(user_id: int, days: int) -> bool:
 # Вспомагательные функции "Назад в профиль"
 def get_back_to_profile_keyboard():
     """Клавиатура с кнопкой возврата в профиль"""
-    return InlineKeyboardMarkup(
-        inline_keyboard=[[InlineKeyboardButton(text="🔙 Назад в профиль", callback_data="back_to_profile")]]
-    )
+    return KEYBOARDS.back_to_profile
 
 @router.callback_query(F.data == "back_to_profile")
 async def back_to_profile(callback: CallbackQuery):
@@ -2127,24 +2483,25 @@ async def open_shop(callback: CallbackQuery):
 @router.callback_query(F.data == "daily_challenge")
 async def daily_challenge(callback: CallbackQuery):
     task = get_random_daily_task()
+    # Начисляем награду за получение челленджа
+    await add_hearts(callback.from_user.id, 3)
+    progress = await add_experience(callback.from_user.id, 10)
     await callback.message.edit_text(
         f"🎯 Сегодняшний челлендж:\n\n{task}\n\n"
-        "Выполни задание и получи награду! 💖",
+        "Выполни задание и получи награду! 💖"
+        f"{format_level_up(progress)}",
         reply_markup=get_back_to_main_keyboard()
     )
-    # Начисляем награду за получение челленджа
-    await add_hearts(callback.from_user.id, 3)
-    await add_experience(callback.from_user.id, 10)
     await callback.answer()
 
 # Показать уровень и прогресс
 @router.callback_query(F.data == "level_progress")
-async def show_level(callback: CallbackQuery):
-    user = await get_user(callback.from_user.id)
+async def show_level(callback: CallbackQuery, user: Optional[UserRecord]):
+    level = user.get("level") or 1
     text = (
-        f"🏆 Ваш уровень: {user.get('level', 1)}\n"
-        f"🔹 Опыт: {user.get('experience', 0)} / 100\n"
-        "Каждые 100 очков опыта — новый уровень!"
+        f"🏆 Ваш уровень: {level}\n"
+        f"🔹 Опыт: {user.get('experience') or 0} / {LEVEL_CURVE.xp_for(level)}\n"
+        f"Наберите {LEVEL_CURVE.xp_for(level)} очков опыта — и получите новый уровень!"
     )
     await callback.message.edit_text(text, reply_markup=get_back_to_main_keyboard())
     await callback.answer()
@@ -2159,21 +2516,71 @@ async def ask_ai(callback: CallbackQuery, state: FSMContext):
     await state.set_state(UserStates.waiting_for_ai_question)
     await callback.answer()
 
+async def record_ai_usage(user: UserRecord, tier: str, usage: Dict[str, Any]) -> None:
+    """Учесть запрос к AI в квотах пользователя"""
+    user_id = user["telegram_id"]
+    counters_after = await quota.record(
+        user_id, tier, usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0),
+        timezone=user.get("timezone"),
+    )
+    invalidate_user(user_id)
+    ctx = current_user_context(user_id)
+    if ctx is not None and counters_after:
+        ctx.patch(**counters_after)
+
 # Обработка вопроса для AI
 @router.message(StateFilter(UserStates.waiting_for_ai_question))
-async def process_ai_question(message: Message, state: FSMContext):
+async def process_ai_question(message: Message, state: FSMContext, user: Optional[UserRecord]):
     question = message.text
 
-    await message.answer("🤖 Думаю над ответом...")
+    if not user:
+        await message.answer("Ошибка доступа.")
+        await state.clear()
+        return
+    allowed, reason = await check_ai_limits(user)
+    if not allowed:
+        await message.answer(reason, reply_markup=get_main_menu_keyboard())
+        await state.clear()
+        return
+    tier = user["user_type"]
+    limits = quota.limits(tier)
 
-    response_text = await ask_openai(question)
+    placeholder = await message.answer("🤖 Думаю над ответом...")
 
-    await message.answer(
-        f"🔮 Ответ GPT-4o:\n\n{response_text}",
-        reply_markup=get_main_menu_keyboard()
-    )
+    # Не держим соединение с БД, пока ждём очередь и ответ OpenAI
+    await release_connection()
+    try:
+        async with ai_admission.admit(tier):
+            # Ответ появляется в заглушке по мере генерации
+            renderer = StreamingMessage(placeholder, header="🔮 Ответ GPT-4o:\n\n", min_interval=AI_STREAM_EDIT_INTERVAL)
+            usage = {}
+            history = await conversations.context(message.from_user.id)
+            response_text = await ask_openai(
+                question,
+                history=history,
+                on_delta=renderer.feed,
+                max_tokens=request_max_tokens(limits, quota.usage(user)),
+                on_usage=usage.update,
+            )
+    except AdmissionRejected as e:
+        logger.warning(f"Запрос к AI от {message.from_user.id} отклонён: {e}")
+        await placeholder.edit_text(
+            "⏳ Сейчас слишком много запросов к AI. Попробуйте ещё раз через минуту.",
+            reply_markup=get_main_menu_keyboard()
+        )
+        await state.clear()
+        return
+    await renderer.finish(response_text, reply_markup=get_main_menu_keyboard())
+
+    # Учитываем запрос и сохраняем реплики, только если модель ответила
+    if usage:
+        conversations.append(message.from_user.id, question, is_ai_response=False)
+        conversations.append(message.from_user.id, response_text, is_ai_response=True)
+        await record_ai_usage(user, tier, usage)
 
-    await add_experience(message.from_user.id, 20)  # За использование AI добавляем опыт
+    progress = await add_experience(message.from_user.id, 20)  # За использование AI добавляем опыт
+    if progress and progress.leveled_up:
+        await message.answer(format_level_up(progress).strip())
     await state.clear()
 
 # Защита для кризисных ситуаций
@@ -2199,31 +2606,89 @@ async def process_regular_message(message: Message):
     pass
 
 # Функция обращения к OpenAI
-async def ask_openai(prompt: str) -> str:
-    url = "https://api.openai.com/v1/chat/completions"
-
-    headers = {
-        "Authorization": f"Bearer {CRYPTO_API_KEY}",
-        "Content-Type": "application/json"
-    }
-
+async def ask_openai(
+    prompt: str,
+    on_delta: Optional[Callable[[str], Awaitable[None]]] = None,
+    max_tokens: int = 500,
+    on_usage: Optional[Callable[[Dict[str, Any]], None]] = None,
+    history: Sequence[Dict[str, str]] = (),
+    cacheable: bool = False,
+) -> str:
+    """Ответ модели; с `on_delta` ответ запрашивается потоком и отдаётся по кускам.
+
+    `history` — предыдущие реплики диалога в формате messages.
+    Одинаковые одновременные запросы объединяются в один: без потока —
+    всегда, потоковые — если у них нет истории (общий поток для всех);
+    `cacheable=True` (только для шаблонных промптов без личных данных)
+    дополнительно кэширует ответ на AI_RESPONSE_CACHE_TTL секунд.
+
+    `on_usage` получает `usage` ответа (prompt_tokens/completion_tokens) —
+    только если модель ответила.
+    """
     payload = {
         "model": AI_MODEL,
         "messages": [
             {"role": "system", "content": AI_SYSTEM_PROMPT},
+            *history,
             {"role": "user", "content": prompt}
         ],
         "temperature": 0.7,
-        "max_tokens": 500
+        "max_tokens": max_tokens
     }
 
+    parts = []
+
+    async def complete() -> str:
+        key = payload_key(payload)
+        data = ai_response_cache.get(key) if cacheable else None
+        if data is None:
+            data = await ai_single_flight.do(
+                key, lambda: openai_resilience.call(lambda: openai_client.chat_completion(payload))
+            )
+            if cacheable:
+                ai_response_cache.set(key, data)
+        # Расход учитывается каждому пользователю, получившему ответ
+        if on_usage is not None and data.get("usage"):
+            on_usage(data["usage"])
+        return data["choices"][0]["message"]["content"].strip()
+
+    async def upstream(emit: Callable[[str], None]) -> Optional[Dict[str, Any]]:
+        """Один поток от OpenAI; повторять его можно, только пока никто ничего не увидел"""
+        reported = []
+        emitted = []
+
+        async def attempt() -> None:
+            async for delta in openai_client.stream_chat_completion(payload, on_usage=reported.append):
+                emitted.append(delta)
+                emit(delta)
+
+        await openai_resilience.call(attempt, can_retry=lambda: not emitted)
+        return reported[-1] if reported else None
+
+    async def stream() -> str:
+        # Первые вопросы (без истории) с одинаковым payload читают один общий поток
+        shared = ai_stream_flight.stream(None if history else payload_key(payload), upstream)
+        async for delta in shared.follow():
+            parts.append(delta)
+            await on_delta(delta)
+        answer = "".join(parts).strip()
+        if on_usage is not None:
+            on_usage(shared.result or {
+                "prompt_tokens": estimate_tokens(AI_SYSTEM_PROMPT + prompt + "".join(m["content"] for m in history)),
+                "completion_tokens": estimate_tokens(answer),
+            })
+        return answer
+
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(url, json=payload, headers=headers)
-            data = response.json()
-            return data["choices"][0]["message"]["content"].strip()
+        if on_delta is None:
+            return await complete()
+        return await stream()
+    except CircuitOpen:
+        return "😔 AI сейчас перегружен. Попробуйте через пару минут."
     except Exception as e:
         logger.error(f"Ошибка запроса к OpenAI: {e}")
+        if parts:
+            return "".join(parts).strip() + "\n\n⚠️ Ответ прерван. Попробуйте спросить ещё раз."
         return "😔 Произошла ошибка при обращении к AI. Попробуйте позже."
 
 # ==========================================
@@ -2255,11 +2720,16 @@ async def open_paid_shop(callback: CallbackQuery):
     await callback.answer()
 
 @router.callback_query(F.data.startswith("buy_hearts_"))
-async def buy_premium_by_hearts(callback: CallbackQuery):
-    days = int(callback.data.split("_")[-1])
-    cost = next((item["price"] for item in HEARTS_SHOP_ITEMS if item["days"] == days), None)
+async def buy_premium_by_hearts(callback: CallbackQuery, user: Optional[UserRecord]):
+    item = CATALOG.hearts_shop_items.get(callback.data.removeprefix("buy_hearts_"))
+    if item is None:
+        await callback.answer("Товар не найден.")
+        return
+    if not user:
+        await callback.answer("Ошибка доступа.")
+        return
 
-    user = await get_user(callback.from_user.id)
+    days, cost = item["days"], item["price"]
     if user["hearts"] < cost:
         await callback.answer("❗ Недостаточно сердечек.", show_alert=True)
         return
@@ -2267,16 +2737,26 @@ async def buy_premium_by_hearts(callback: CallbackQuery):
     now = datetime.utcnow()
     expires_at = now + timedelta(days=days)
 
-    async with async_session.begin() as session:
+    async with db_session() as session:
         await session.execute(
             users.update()
             .where(users.c.telegram_id == callback.from_user.id)
-            .values(
-                is_premium=True,
-                subscription_expires_at=expires_at,
-                hearts=users.c.hearts - cost
-            )
+            .values(is_premium=True, subscription_expires_at=expires_at)
         )
+        await update_stats(
+            session,
+            user_stats.update()
+            .where(user_stats.c.user_id == callback.from_user.id)
+            .values(hearts=user_stats.c.hearts - cost)
+            .returning(user_stats.c.user_id),
+            None,
+            callback.from_user.id,
+        )
+    invalidate_user(callback.from_user.id)
+    ctx = current_user_context(callback.from_user.id)
+    if ctx is not None:
+        ctx.patch(is_premium=True, subscription_expires_at=expires_at)
+        ctx.increment("hearts", -cost)
 
     await callback.message.edit_text(
         f"🎉 Поздравляем! Вы приобрели премиум на {days} дней!",
@@ -2288,47 +2768,21 @@ async def buy_premium_by_hearts(callback: CallbackQuery):
 # ⏰ Планировщик задач (cron) — ежедневные челленджи
 # ==========================================
 
-@aiocron.crontab('0 9 * * *')  # Каждое утро в 9:00 МСК
-async def send_morning_challenge():
-    logger.info("Утренний челлендж отправляется...")
-    try:
-        async with async_session() as session:
-            result = await session.execute(text("SELECT telegram_id FROM users WHERE is_banned = false"))
-            users_list = result.scalars().all()
+# Слот — час по местному времени пользователя
+DELIVERY_SLOTS = {"morning": 9, "evening": 18}
 
-        task = get_random_daily_task()
+CHALLENGE_TEMPLATES = {
+    "morning": "🌅 Доброе утро!\n\n🎯 Ваш челлендж дня:\n\n{task}\n\nВыполняй и зарабатывай сердечки! 💖",
+    "evening": "🌆 Добрый вечер!\n\n🎯 Челлендж на вечер:\n\n{task}\n\nЗаверши день продуктивно! 💖",
+}
 
-        for user_id in users_list:
-            try:
-                await bot.send_message(
-                    user_id,
-                    f"🌅 Доброе утро!\n\n🎯 Ваш челлендж дня:\n\n{task}\n\nВыполняй и зарабатывай сердечки! 💖"
-                )
-            except Exception as e:
-                logger.warning(f"Не удалось отправить утреннее задание пользователю {user_id}: {e}")
-    except Exception as e:
-        logger.error(f"Ошибка отправки утреннего задания: {e}")
-
-@aiocron.crontab('0 18 * * *')  # Каждый вечер в 18:00 МСК
-async def send_evening_challenge():
-    logger.info("Вечерний челлендж отправляется...")
-    try:
-        async with async_session() as session:
-            result = await session.execute(text("SELECT telegram_id FROM users WHERE is_banned = false"))
-            users_list = result.scalars().all()
+def daily_challenge_text(slot: str, day: date) -> str:
+    """Текст челленджа: задание одно на слот и дату, во всех корзинах и поясах"""
+    task = random.Random(f"{slot}:{day.isoformat()}").choice(DAILY_TASKS)
+    return CHALLENGE_TEMPLATES[slot].format(task=task)
 
-        task = get_random_daily_task()
-
-        for user_id in users_list:
-            try:
-                await bot.send_message(
-                    user_id,
-                    f"🌆 Добрый вечер!\n\n🎯 Челлендж на вечер:\n\n{task}\n\nЗаверши день продуктивно! 💖"
-                )
-            except Exception as e:
-                logger.warning(f"Не удалось отправить вечернее задание пользователю {user_id}: {e}")
-    except Exception as e:
-        logger.error(f"Ошибка отправки вечернего задания: {e}")
+# Каждую минуту — корзины (пояс, минута), у которых наступил слот
+challenge_delivery = DeliveryScheduler(async_session, broadcasts, daily_challenge_text, DELIVERY_SLOTS)
 
 # ==========================================
 # 🚀 Запуск бота, обработка ошибок
@@ -2348,17 +2802,32 @@ async def set_default_commands(bot: Bot):
     await bot.set_my_commands([
         BotCommand(command="start", description="🔵 Перезапустить бота"),
         BotCommand(command="help", description="ℹ️ Помощь и инструкция"),
+        BotCommand(command="timezone", description="🕘 Часовой пояс для челленджей"),
     ])
 
 # Основная функция запуска бота
 async def on_startup(bot: Bot):
     """Действия при запуске бота"""
     await set_default_commands(bot)
+    if COUNTERS_WRITE_BEHIND:
+        counters.start()
+    await usd_rates.start()
+    await openai_client.start()
+    conversations.start()
+    broadcasts.start()
+    challenge_delivery.start()
     logger.info("Бот успешно запущен")
 
 async def on_shutdown(bot: Bot):
     """Действия при остановке бота"""
     logger.info("Выключение бота...")
+    await challenge_delivery.stop()
+    await broadcasts.stop()
+    # Сбрасываем накопленные сердечки, опыт и реплики до закрытия пула соединений
+    await counters.stop()
+    await conversations.stop()
+    await usd_rates.stop()
+    await openai_client.stop()
 
 async def main():
     """Основная функция запуска бота"""
@@ -2368,6 +2837,9 @@ async def main():
             await conn.run_sync(metadata.create_all)
         
         # Установка обработчиков
+        dp.update.outer_middleware(UnitOfWorkMiddleware(async_session))
+        bot.session.middleware(ReleaseConnectionRequestMiddleware())
+        dp.update.outer_middleware(RequestUserMiddleware(fetch_user))
         dp.startup.register(on_startup)
         dp.shutdown.register(on_shutdown)
         
@@ -16,8 +16,8 @@ fileConfig(config.config_file_name)
 # Устанавливаем URL БД из переменной окружения
 config.set_main_option("sqlalchemy.url", os.getenv("DB_URL_SYNC"))
 
-# Импорт моделей из твоего main.py
-from main import Base  # Base = declarative_base(metadata=...)
+# Импорт моделей (схема вынесена из main.py, бот при этом не запускается)
+from models import Base  # Base = declarative_base(metadata=...)
 target_metadata = Base.metadata
 
 def run_migrations_offline():
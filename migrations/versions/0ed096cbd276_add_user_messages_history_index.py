@@ -0,0 +1,37 @@
+"""add user_messages history index
+
+Revision ID: 0ed096cbd276
+Revises: d5ef65aa7172
+Create Date: 2026-10-17 16:25:51.093384
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0ed096cbd276'
+down_revision: Union[str, None] = 'd5ef65aa7172'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Последние N реплик диалога с AI (ORDER BY created_at DESC LIMIT N)
+INDEXES = [
+    ("ix_user_messages_user_id_created_at", "user_messages", "user_id, created_at DESC", None),
+]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.get_context().autocommit_block():
+        for name, table, columns, _where in INDEXES:
+            op.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} ({columns})")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        for name, _table, _columns, _where in reversed(INDEXES):
+            op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
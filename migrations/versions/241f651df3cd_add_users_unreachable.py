@@ -0,0 +1,42 @@
+"""mark users unreachable for broadcasts
+
+Revision ID: 241f651df3cd
+Revises: 2f39bc6f0474
+Create Date: 2026-10-17 19:10:37.204118
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '241f651df3cd'
+down_revision: Union[str, None] = '2f39bc6f0474'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Получатели рассылок: только доступные пользователи, по возрастанию telegram_id
+INDEXES = [
+    ("ix_users_reachable_telegram_id", "users", "telegram_id", "is_banned = false AND unreachable_at IS NULL"),
+]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Когда и почему доставка не удалась (blocked, deactivated, chat_not_found)
+    op.add_column('users', sa.Column('unreachable_at', sa.DateTime(timezone=True), nullable=True))
+    op.add_column('users', sa.Column('unreachable_reason', sa.String(length=30), nullable=True))
+    with op.get_context().autocommit_block():
+        for name, table, columns, where in INDEXES:
+            op.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} ({columns}) WHERE {where}")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        for name, _table, _columns, _where in reversed(INDEXES):
+            op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+    op.drop_column('users', 'unreachable_reason')
+    op.drop_column('users', 'unreachable_at')
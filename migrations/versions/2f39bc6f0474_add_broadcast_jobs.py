@@ -0,0 +1,52 @@
+"""add broadcast jobs and progress
+
+Revision ID: 2f39bc6f0474
+Revises: 0ed096cbd276
+Create Date: 2026-10-17 18:05:12.640217
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '2f39bc6f0474'
+down_revision: Union[str, None] = '0ed096cbd276'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('broadcast_jobs',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.Column('run_key', sa.String(length=100), nullable=False),
+    sa.Column('text', sa.Text(), nullable=False),
+    sa.Column('status', sa.String(length=20), server_default='running', nullable=False),
+    sa.Column('last_user_id', sa.BigInteger(), nullable=True),
+    sa.Column('sent', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('failed', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('blocked', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('finished_at', sa.DateTime(timezone=True), nullable=True),
+    sa.PrimaryKeyConstraint('id', name='broadcast_jobs_pkey'),
+    sa.UniqueConstraint('run_key', name='broadcast_jobs_run_key_key'),
+    )
+    # Кому рассылка уже ушла: ключ (job_id, user_id) не даёт отправить дважды
+    op.create_table('broadcast_progress',
+    sa.Column('job_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.BigInteger(), nullable=False),
+    sa.Column('claimed_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.ForeignKeyConstraint(['job_id'], ['broadcast_jobs.id'], name='broadcast_progress_job_id_fkey', ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('job_id', 'user_id', name='broadcast_progress_pkey'),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('broadcast_progress')
+    op.drop_table('broadcast_jobs')
@@ -0,0 +1,69 @@
+"""split volatile counters into user_stats
+
+Revision ID: 551ce24f7409
+Revises: 7008e6092c8a
+Create Date: 2026-10-17 12:20:44.861203
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '551ce24f7409'
+down_revision: Union[str, None] = '7008e6092c8a'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Часто изменяемые счётчики копируются из широкой строки users. Старые столбцы
+# остаются, пока работают экземпляры бота на прежней версии; удаляет их
+# отдельная ревизия a3c9e07b5d21, которая заодно докопирует отставшие строки.
+
+# Строк users на одну транзакцию переноса
+BATCH_SIZE = 5000
+
+
+def _copy_in_batches(sql: str) -> None:
+    """Выполнить перенос диапазонами users.id, каждый диапазон — своя транзакция"""
+    bind = op.get_bind()
+    max_id = bind.execute(sa.text("SELECT COALESCE(MAX(id), 0) FROM users")).scalar()
+    with op.get_context().autocommit_block():
+        for start in range(0, max_id, BATCH_SIZE):
+            bind.execute(sa.text(sql), {"start": start, "end": start + BATCH_SIZE})
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('user_stats',
+    sa.Column('user_id', sa.BigInteger(), nullable=False),
+    sa.Column('hearts', sa.Integer(), server_default='10', nullable=False),
+    sa.Column('level', sa.Integer(), server_default='1', nullable=False),
+    sa.Column('experience', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('daily_requests', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('total_requests', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('request_tokens', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('last_activity_at', sa.DateTime(timezone=True), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['users.telegram_id'], name='user_stats_user_id_fkey', ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id', name='user_stats_pkey'),
+    )
+    # Свободное место на странице — обновления счётчиков остаются HOT
+    op.execute("ALTER TABLE user_stats SET (fillfactor = 70)")
+
+    _copy_in_batches("""
+        INSERT INTO user_stats (user_id, hearts, level, experience, daily_requests,
+                                total_requests, request_tokens, last_activity_at)
+        SELECT telegram_id, COALESCE(hearts, 10), COALESCE(level, 1), COALESCE(experience, 0),
+               COALESCE(daily_requests, 0), COALESCE(total_requests, 0),
+               COALESCE(request_tokens, 0), last_activity_at
+        FROM users
+        WHERE id > :start AND id <= :end
+        ON CONFLICT (user_id) DO NOTHING
+    """)
+    op.execute("ANALYZE user_stats")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('user_stats')
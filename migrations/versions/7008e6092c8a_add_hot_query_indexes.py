@@ -0,0 +1,57 @@
+"""add hot query indexes
+
+Revision ID: 7008e6092c8a
+Revises: 4d3bfc64ff32
+Create Date: 2026-10-17 10:12:41.518204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7008e6092c8a'
+down_revision: Union[str, None] = '4d3bfc64ff32'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# (имя, таблица, столбцы, условие частичного индекса)
+# Список используется и тестами планов запросов (tests/test_query_plans.py)
+INDEXES = [
+    # Дневник: счётчик записей и выборки за период
+    ("ix_diary_entries_user_id_created_at", "diary_entries", "user_id, created_at", None),
+    # Список привычек пользователя (ORDER BY created_at DESC)
+    ("ix_habits_user_id_created_at", "habits", "user_id, created_at", None),
+    # Выполнения привычки за период
+    ("ix_habit_completions_habit_id_completed_at", "habit_completions", "habit_id, completed_at", None),
+    # Платежи пользователя по статусу
+    ("ix_payments_user_id_status", "payments", "user_id, status", None),
+    # Очередь неподтверждённых платежей — малая доля таблицы
+    ("ix_payments_pending_created_at", "payments", "created_at", "status = 'pending'"),
+    # find_user по username из админки
+    ("ix_users_username", "users", "username", "username IS NOT NULL"),
+    # Рефералы пользователя
+    ("ix_users_referrer_id", "users", "referrer_id", "referrer_id IS NOT NULL"),
+]
+
+
+def create_index_sql(name: str, table: str, columns: str, where: Union[str, None]) -> str:
+    sql = f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} ({columns})"
+    return f"{sql} WHERE {where}" if where else sql
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # CONCURRENTLY нельзя выполнять внутри транзакции
+    with op.get_context().autocommit_block():
+        for name, table, columns, where in INDEXES:
+            op.execute(create_index_sql(name, table, columns, where))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        for name, _table, _columns, _where in reversed(INDEXES):
+            op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
@@ -0,0 +1,45 @@
+"""add user timezone and delivery buckets
+
+Revision ID: 75f541dc9caa
+Revises: 241f651df3cd
+Create Date: 2026-10-17 20:02:49.118305
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '75f541dc9caa'
+down_revision: Union[str, None] = '241f651df3cd'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Корзина доставки челленджей: (часовой пояс, минута = telegram_id % 60), см. services/delivery.py
+INDEXES = [
+    ("ix_users_delivery_bucket", "users", "timezone, (telegram_id % 60), telegram_id",
+     "is_banned = false AND unreachable_at IS NULL"),
+]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Постоянный DEFAULT — столбец добавляется без перезаписи таблицы
+    op.add_column('users', sa.Column('timezone', sa.String(length=50), server_default='Europe/Moscow', nullable=False))
+    # Параметры выборки получателей запуска (например, корзина доставки)
+    op.add_column('broadcast_jobs', sa.Column('audience', postgresql.JSONB(astext_type=sa.Text()), nullable=True))
+    with op.get_context().autocommit_block():
+        for name, table, columns, where in INDEXES:
+            op.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} ({columns}) WHERE {where}")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        for name, _table, _columns, _where in reversed(INDEXES):
+            op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+    op.drop_column('broadcast_jobs', 'audience')
+    op.drop_column('users', 'timezone')
@@ -0,0 +1,72 @@
+"""drop counter columns moved to user_stats
+
+Revision ID: a3c9e07b5d21
+Revises: 75f541dc9caa
+Create Date: 2026-10-17 21:14:05.362817
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a3c9e07b5d21'
+down_revision: Union[str, None] = '75f541dc9caa'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Столбцы users, скопированные в user_stats ревизией 551ce24f7409
+STATS_COLUMNS = (
+    "hearts", "level", "experience", "daily_requests",
+    "total_requests", "request_tokens", "last_activity_at",
+)
+
+# Строк users на одну транзакцию переноса
+BATCH_SIZE = 5000
+
+
+def _copy_in_batches(sql: str) -> None:
+    """Выполнить перенос диапазонами users.id, каждый диапазон — своя транзакция"""
+    bind = op.get_bind()
+    max_id = bind.execute(sa.text("SELECT COALESCE(MAX(id), 0) FROM users")).scalar()
+    with op.get_context().autocommit_block():
+        for start in range(0, max_id, BATCH_SIZE):
+            bind.execute(sa.text(sql), {"start": start, "end": start + BATCH_SIZE})
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Пользователи, созданные прежней версией бота после копирования, ещё без строки счётчиков
+    _copy_in_batches("""
+        INSERT INTO user_stats (user_id, hearts, level, experience, daily_requests,
+                                total_requests, request_tokens, last_activity_at)
+        SELECT telegram_id, COALESCE(hearts, 10), COALESCE(level, 1), COALESCE(experience, 0),
+               COALESCE(daily_requests, 0), COALESCE(total_requests, 0),
+               COALESCE(request_tokens, 0), last_activity_at
+        FROM users
+        WHERE id > :start AND id <= :end
+        ON CONFLICT (user_id) DO NOTHING
+    """)
+
+    for column in STATS_COLUMNS:
+        op.drop_column('users', column)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.add_column('users', sa.Column('hearts', sa.Integer(), nullable=True))
+    op.add_column('users', sa.Column('level', sa.Integer(), nullable=True))
+    op.add_column('users', sa.Column('experience', sa.Integer(), nullable=True))
+    op.add_column('users', sa.Column('daily_requests', sa.Integer(), nullable=True))
+    op.add_column('users', sa.Column('total_requests', sa.Integer(), nullable=True))
+    op.add_column('users', sa.Column('request_tokens', sa.Integer(), nullable=True))
+    op.add_column('users', sa.Column('last_activity_at', sa.DateTime(timezone=True), nullable=True))
+
+    _copy_in_batches(f"""
+        UPDATE users AS u
+        SET ({", ".join(STATS_COLUMNS)}) = ({", ".join("s." + column for column in STATS_COLUMNS)})
+        FROM user_stats AS s
+        WHERE s.user_id = u.telegram_id AND u.id > :start AND u.id <= :end
+    """)
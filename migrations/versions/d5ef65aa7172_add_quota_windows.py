@@ -0,0 +1,31 @@
+"""add quota window starts to user_stats
+
+Revision ID: d5ef65aa7172
+Revises: 551ce24f7409
+Create Date: 2026-10-17 15:42:08.517310
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd5ef65aa7172'
+down_revision: Union[str, None] = '551ce24f7409'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Начало окна, к которому относятся счётчики; NULL — счётчики из прошлого окна
+    op.add_column('user_stats', sa.Column('daily_window_start', sa.DateTime(timezone=True), nullable=True))
+    op.add_column('user_stats', sa.Column('quota_window_start', sa.DateTime(timezone=True), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('user_stats', 'quota_window_start')
+    op.drop_column('user_stats', 'daily_window_start')
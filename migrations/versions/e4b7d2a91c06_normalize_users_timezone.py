@@ -0,0 +1,45 @@
+"""normalize stored user timezones
+
+Revision ID: e4b7d2a91c06
+Revises: a3c9e07b5d21
+Create Date: 2026-10-17 21:40:12.508131
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e4b7d2a91c06'
+down_revision: Union[str, None] = 'a3c9e07b5d21'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+DEFAULT_TIMEZONE = "Europe/Moscow"
+
+# Пояса, доступные в /timezone на момент ревизии (services/delivery.py DELIVERY_TIMEZONES)
+KNOWN_TIMEZONES = (
+    "Europe/Kaliningrad", "Europe/Moscow", "Europe/Samara", "Asia/Yekaterinburg",
+    "Asia/Omsk", "Asia/Novosibirsk", "Asia/Krasnoyarsk", "Asia/Irkutsk",
+    "Asia/Yakutsk", "Asia/Vladivostok", "Asia/Magadan", "Asia/Kamchatka",
+    "Europe/Minsk", "Europe/Kyiv", "Asia/Almaty", "Asia/Tashkent",
+)
+
+# Устаревшее название -> актуальное
+RENAMED = {"Europe/Kiev": "Europe/Kyiv"}
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    for old, new in RENAMED.items():
+        op.execute(f"UPDATE users SET timezone = '{new}' WHERE timezone = '{old}'")
+    # Пояс вне списка не совпадёт ни с одной корзиной доставки челленджей
+    known = ", ".join(f"'{name}'" for name in KNOWN_TIMEZONES)
+    op.execute(f"UPDATE users SET timezone = '{DEFAULT_TIMEZONE}' WHERE timezone NOT IN ({known})")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for old, new in RENAMED.items():
+        op.execute(f"UPDATE users SET timezone = '{old}' WHERE timezone = '{new}'")
@@ -0,0 +1,236 @@
+"""Схема БД: таблицы SQLAlchemy Core и индексы под горячие запросы.
+
+Отдельно от `main.py`, чтобы схему можно было импортировать без запуска
+бота: Alembic (`migrations/env.py`) и регрессия планов запросов
+(`tests/test_query_plans.py`) строят её из того же `metadata`.
+"""
+from datetime import datetime
+
+from sqlalchemy import (
+    BigInteger,
+    Boolean,
+    Column,
+    DateTime,
+    Float,
+    ForeignKey,
+    Index,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    Text,
+    text,
+)
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import declarative_base
+from sqlalchemy.sql import func
+
+from services.delivery import BUCKET_MINUTES, DEFAULT_TIMEZONE
+from services.users import REACHABLE_WHERE
+
+metadata = MetaData()
+Base = declarative_base(metadata=metadata)
+
+# Таблица пользователей
+users = Table(
+    "users",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("telegram_id", BigInteger, unique=True, nullable=False, index=True),
+    Column("full_name", String(100)),
+    Column("username", String(100)),
+    Column("gender", String(10)),
+    Column("name", String(100)),
+    Column("is_premium", Boolean, default=False),
+    Column("user_type", String(20), default="free"),  # free/trial/premium
+    Column("is_admin", Boolean, default=False),
+    Column("trial_started_at", DateTime(timezone=True)),
+    Column("subscription_expires_at", DateTime(timezone=True)),
+    Column("created_at", DateTime(timezone=True), server_default=func.now()),
+    Column("is_banned", Boolean, default=False),
+    Column("diary_password", String(100)),
+    Column("last_diary_reward", DateTime(timezone=True)),
+    Column("referral_code", String(20), unique=True),
+    Column("referrer_id", BigInteger),
+    Column("referrals_count", Integer, default=0),
+    Column("last_referral_date", DateTime(timezone=True)),
+    Column("premium_purchases", Integer, default=0),
+    # Доставка невозможна (blocked/deactivated/chat_not_found): такие не получают рассылки до /start
+    Column("unreachable_at", DateTime(timezone=True)),
+    Column("unreachable_reason", String(30)),
+    # Челленджи приходят в 9:00 и 18:00 по этому поясу (см. services/delivery.py)
+    Column("timezone", String(50), nullable=False, default=DEFAULT_TIMEZONE, server_default=DEFAULT_TIMEZONE),
+)
+
+# Часто изменяемые счётчики — отдельная узкая таблица, чтобы начисления
+# не переписывали широкую строку users (fillfactor=70 задаётся миграцией)
+user_stats = Table(
+    "user_stats",
+    metadata,
+    Column("user_id", BigInteger, ForeignKey("users.telegram_id", ondelete="CASCADE"), primary_key=True),
+    Column("hearts", Integer, nullable=False, default=10, server_default="10"),
+    Column("level", Integer, nullable=False, default=1, server_default="1"),
+    Column("experience", Integer, nullable=False, default=0, server_default="0"),
+    Column("daily_requests", Integer, nullable=False, default=0, server_default="0"),
+    Column("total_requests", Integer, nullable=False, default=0, server_default="0"),
+    Column("request_tokens", Integer, nullable=False, default=0, server_default="0"),  # Токены за окно тарифа
+    # Начало суток / окна тарифа, к которым относятся счётчики запросов (см. services/quota.py)
+    Column("daily_window_start", DateTime(timezone=True)),
+    Column("quota_window_start", DateTime(timezone=True)),
+    Column("last_activity_at", DateTime(timezone=True), onupdate=func.now()),
+)
+
+# Таблица платежей
+payments = Table(
+    "payments",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("user_id", BigInteger),
+    Column("amount", Float),
+    Column("currency", String(10)),
+    Column("item_id", String(50)),
+    Column("status", String(20), default="pending"),
+    Column("payment_method", String(20)),
+    Column("transaction_hash", String(100)),
+    Column("created_at", DateTime, default=datetime.utcnow),
+    Column("confirmed_at", DateTime),
+)
+
+# Таблица записей дневника
+diary_entries = Table(
+    "diary_entries",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("user_id", BigInteger),
+    Column("entry_text", Text),
+    Column("mood", String(20)),
+    Column("created_at", DateTime, default=datetime.utcnow),
+)
+
+# Таблица привычек
+habits = Table(
+    "habits",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("user_id", BigInteger),
+    Column("title", String(100)),
+    Column("description", String(500)),
+    Column("reminder_time", String(10)),
+    Column("created_at", DateTime, default=datetime.utcnow),
+    Column("target_date", DateTime),
+    Column("is_completed", Boolean, default=False),
+)
+
+# Таблица выполненных привычек
+habit_completions = Table(
+    "habit_completions",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("habit_id", Integer),
+    Column("proof_text", Text),
+    Column("proof_photo", String(200)),
+    Column("completed_at", DateTime, default=datetime.utcnow),
+)
+
+# Таблица промокодов
+promo_codes = Table(
+    "promo_codes",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("code", String(20), unique=True),
+    Column("discount_percent", Integer),
+    Column("valid_until", DateTime),
+    Column("uses_remaining", Integer),
+    Column("created_at", DateTime, default=datetime.utcnow),
+    Column("description", String(200)),
+)
+
+# Таблица админских заданий
+admin_tasks = Table(
+    "admin_tasks",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("title", String(100)),
+    Column("description", Text),
+    Column("reward", Integer),
+    Column("created_at", DateTime, default=datetime.utcnow),
+    Column("expires_at", DateTime),
+)
+
+# Таблица выполненных заданий
+completed_tasks = Table(
+    "completed_tasks",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("task_id", Integer),
+    Column("user_id", BigInteger),
+    Column("completed_at", DateTime, default=datetime.utcnow),
+)
+
+# Таблица сообщений пользователей
+user_messages = Table(
+    "user_messages",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("user_id", BigInteger),
+    Column("message_text", Text),
+    Column("is_ai_response", Boolean, default=False),
+    Column("created_at", DateTime, default=datetime.utcnow),
+)
+
+# Индексы под горячие запросы (миграции 7008e6092c8a, 0ed096cbd276, 241f651df3cd, 75f541dc9caa)
+Index("ix_diary_entries_user_id_created_at", diary_entries.c.user_id, diary_entries.c.created_at)
+Index("ix_habits_user_id_created_at", habits.c.user_id, habits.c.created_at)
+Index(
+    "ix_habit_completions_habit_id_completed_at",
+    habit_completions.c.habit_id,
+    habit_completions.c.completed_at,
+)
+Index("ix_payments_user_id_status", payments.c.user_id, payments.c.status)
+Index(
+    "ix_payments_pending_created_at",
+    payments.c.created_at,
+    postgresql_where=payments.c.status == "pending",
+)
+Index("ix_users_username", users.c.username, postgresql_where=users.c.username.isnot(None))
+Index("ix_users_referrer_id", users.c.referrer_id, postgresql_where=users.c.referrer_id.isnot(None))
+Index("ix_user_messages_user_id_created_at", user_messages.c.user_id, user_messages.c.created_at.desc())
+Index(
+    "ix_users_reachable_telegram_id",
+    users.c.telegram_id,
+    postgresql_where=text(REACHABLE_WHERE),
+)
+Index(
+    "ix_users_delivery_bucket",
+    users.c.timezone,
+    users.c.telegram_id % BUCKET_MINUTES,
+    users.c.telegram_id,
+    postgresql_where=text(REACHABLE_WHERE),
+)
+
+# Запуски рассылок и отметки о доставке (см. services/broadcast_jobs.py)
+broadcast_jobs = Table(
+    "broadcast_jobs",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("name", String(50), nullable=False),
+    Column("run_key", String(100), nullable=False, unique=True),  # например, evening:2026-10-17
+    Column("text", Text, nullable=False),
+    Column("status", String(20), nullable=False, default="running", server_default="running"),
+    Column("last_user_id", BigInteger),  # курсор: получатели до него включительно уже заняты
+    Column("sent", Integer, nullable=False, default=0, server_default="0"),
+    Column("failed", Integer, nullable=False, default=0, server_default="0"),
+    Column("blocked", Integer, nullable=False, default=0, server_default="0"),
+    Column("created_at", DateTime(timezone=True), nullable=False, server_default=func.now()),
+    Column("updated_at", DateTime(timezone=True)),
+    Column("finished_at", DateTime(timezone=True)),
+    Column("audience", JSONB),  # выборка получателей, например корзина доставки; NULL — все
+)
+
+broadcast_progress = Table(
+    "broadcast_progress",
+    metadata,
+    Column("job_id", Integer, ForeignKey("broadcast_jobs.id", ondelete="CASCADE"), primary_key=True),
+    Column("user_id", BigInteger, primary_key=True),
+    Column("claimed_at", DateTime(timezone=True), nullable=False, server_default=func.now()),
+)
@@ -0,0 +1 @@
+"""Сервисный слой бота: кэши, пулы, фоновые задачи и прочая инфраструктура."""
@@ -0,0 +1,163 @@
+"""Допуск запросов к AI с приоритетом по тарифу.
+
+Одновременно выполняется не больше `max_concurrent` запросов, остальные
+ждут в очереди, откуда первыми выходят запросы с более высоким
+приоритетом (премиум раньше пробного периода), а внутри тарифа — по
+порядку прихода. Очередь ограничена `max_queue`: при переполнении новый
+запрос сразу отклоняется, а если он приоритетнее кого-то из ждущих —
+отклоняется самый низкоприоритетный ждущий. Ожидание дольше
+`max_wait` секунд тоже заканчивается отказом.
+"""
+import asyncio
+from contextlib import asynccontextmanager
+import heapq
+import itertools
+import time
+from typing import Any, AsyncIterator, Callable, Dict, List, Mapping, Optional, Tuple
+
+# Меньше — раньше; неизвестный тариф получает самый низкий приоритет
+TIER_PRIORITIES: Dict[str, int] = {"premium": 0, "trial": 1}
+
+
+class AdmissionRejected(Exception):
+    """Запрос не допущен: очередь переполнена или ожидание слишком долгое"""
+
+
+def _granted(future: asyncio.Future) -> bool:
+    return future.done() and not future.cancelled() and future.exception() is None
+
+
+class _TierStats:
+    __slots__ = ("admitted", "rejected", "wait_total", "wait_max")
+
+    def __init__(self) -> None:
+        self.admitted = 0
+        self.rejected = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "wait_avg_ms": round(self.wait_total / self.admitted * 1000) if self.admitted else 0,
+            "wait_max_ms": round(self.wait_max * 1000),
+        }
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        max_concurrent: int = 8,
+        max_queue: int = 50,
+        max_wait: Optional[float] = 30.0,
+        priorities: Mapping[str, int] = TIER_PRIORITIES,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.priorities = dict(priorities)
+        self._clock = clock
+        self._active = 0
+        self._queue: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._stats: Dict[str, _TierStats] = {}
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    @property
+    def queued(self) -> int:
+        return sum(1 for _, _, future in self._queue if not future.done())
+
+    def _priority(self, tier: str) -> int:
+        return self.priorities.get(tier, max(self.priorities.values(), default=0) + 1)
+
+    def _tier_stats(self, tier: str) -> _TierStats:
+        return self._stats.setdefault(tier, _TierStats())
+
+    @asynccontextmanager
+    async def admit(self, tier: str) -> AsyncIterator[None]:
+        """Занять слот на время блока; AdmissionRejected, если допуск невозможен"""
+        await self.acquire(tier)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire(self, tier: str) -> None:
+        stats = self._tier_stats(tier)
+        started = self._clock()
+        self._prune()
+        if self._active < self.max_concurrent and not self._queue:
+            self._active += 1
+            stats.admitted += 1
+            return
+
+        priority = self._priority(tier)
+        if len(self._queue) >= self.max_queue and not self._displace(priority):
+            stats.rejected += 1
+            raise AdmissionRejected("очередь запросов переполнена")
+
+        future = asyncio.get_running_loop().create_future()
+        entry = (priority, next(self._seq), future)
+        heapq.heappush(self._queue, entry)
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.max_wait)
+        except asyncio.TimeoutError:
+            # Слот могли выдать в момент таймаута — тогда пользуемся им
+            if not _granted(future):
+                future.cancel()
+                stats.rejected += 1
+                raise AdmissionRejected("слишком долгое ожидание в очереди") from None
+        except asyncio.CancelledError:
+            if _granted(future):
+                self.release()
+            else:
+                future.cancel()
+            raise
+        except AdmissionRejected:
+            stats.rejected += 1
+            raise
+
+        waited = self._clock() - started
+        stats.admitted += 1
+        stats.wait_total += waited
+        stats.wait_max = max(stats.wait_max, waited)
+
+    def release(self) -> None:
+        """Освободить слот и сразу передать его следующему в очереди"""
+        while self._queue:
+            _, _, future = heapq.heappop(self._queue)
+            if not future.done():
+                future.set_result(None)
+                return
+        self._active -= 1
+
+    def _prune(self) -> None:
+        if any(future.done() for _, _, future in self._queue):
+            self._queue = [entry for entry in self._queue if not entry[2].done()]
+            heapq.heapify(self._queue)
+
+    def _displace(self, priority: int) -> bool:
+        """Отказать самому низкоприоритетному ждущему, если новый запрос важнее"""
+        if not self._queue:
+            return False
+        worst = max(self._queue, key=lambda entry: (entry[0], entry[1]))
+        if worst[0] <= priority:
+            return False
+        self._queue.remove(worst)
+        heapq.heapify(self._queue)
+        worst[2].set_exception(AdmissionRejected("вытеснен более приоритетным запросом"))
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active": self._active,
+            "max_concurrent": self.max_concurrent,
+            "queued": self.queued,
+            "max_queue": self.max_queue,
+            **{tier: stats.as_dict() for tier, stats in self._stats.items()},
+        }
@@ -0,0 +1,206 @@
+"""Массовые рассылки с ограничением скорости.
+
+Получатели читаются из асинхронного итератора в ограниченную очередь,
+которую разбирают `workers` воркеров. Перед каждой отправкой воркер
+берёт токен из общего `TokenBucket` (по умолчанию ~28 сообщений в
+секунду — чуть ниже лимита Telegram в 30). `TelegramRetryAfter`
+ставит на паузу весь конвейер: бакет не выдаёт токены, пока не пройдёт
+`retry_after`, а сообщение отправляется повторно. Получатели, которым
+доставка невозможна (бот заблокирован, аккаунт удалён, чат не найден),
+передаются пачками в `on_unreachable`, чтобы исключить их из следующих рассылок.
+"""
+import asyncio
+from datetime import datetime, timezone
+import logging
+import time
+from typing import Any, AsyncIterable, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+
+logger = logging.getLogger(__name__)
+
+
+def unreachable_reason(error: Exception) -> Optional[str]:
+    """Почему пользователю не стоит больше слать рассылки; None — ошибка не про получателя"""
+    message = str(error).lower()
+    if isinstance(error, TelegramForbiddenError):
+        if "deactivated" in message:
+            return "deactivated"
+        if "blocked" in message:
+            return "blocked"
+        return "forbidden"
+    if isinstance(error, TelegramBadRequest) and "chat not found" in message:
+        return "chat_not_found"
+    return None
+
+
+UnreachableHandler = Callable[[List[Tuple[int, str]]], Awaitable[Any]]
+
+
+class TokenBucket:
+    """Не больше `rate` операций в секунду со всплеском до `capacity`"""
+
+    def __init__(
+        self,
+        rate: float = 28.0,
+        capacity: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], Awaitable[Any]] = asyncio.sleep,
+    ) -> None:
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = self.capacity
+        self._updated = clock()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float) -> None:
+        """Не выдавать токены `seconds` секунд (например, по RetryAfter)"""
+        until = self._clock() + seconds
+        if until > self._paused_until:
+            self._paused_until = until
+            # За время паузы токены не копятся: после неё не будет всплеска
+            self._tokens = min(self._tokens, 0.0)
+            self._updated = until
+
+    async def acquire(self) -> None:
+        # Токены выдаются по очереди, иначе ждущие воркеры разберут один и тот же токен
+        async with self._lock:
+            now = self._clock()
+            if now < self._paused_until:
+                await self._sleep(self._paused_until - now)
+                now = self._clock()
+            self._tokens = min(self.capacity, self._tokens + max(now - self._updated, 0.0) * self.rate)
+            self._updated = max(now, self._updated)
+            # Токен берём сразу, недостачу отсыпаем один раз: повторная проверка
+            # после сна могла бы зациклиться на погрешности float
+            self._tokens -= 1
+            if self._tokens < 0:
+                await self._sleep(-self._tokens / self.rate)
+
+
+class BroadcastResult:
+    __slots__ = ("name", "sent", "failed", "blocked", "retries", "started_at", "duration")
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.sent = 0
+        self.failed = 0
+        self.blocked = 0
+        self.retries = 0
+        self.started_at = datetime.now(timezone.utc)
+        self.duration = 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "sent": self.sent,
+            "failed": self.failed,
+            "blocked": self.blocked,
+            "retries": self.retries,
+            "started_at": self.started_at.isoformat(timespec="seconds"),
+            "duration_s": round(self.duration, 1),
+        }
+
+
+class Broadcaster:
+    def __init__(
+        self,
+        bot: Bot,
+        workers: int = 20,
+        rate: float = 28.0,
+        max_retries: int = 3,
+        bucket: Optional[TokenBucket] = None,
+        on_unreachable: Optional[UnreachableHandler] = None,
+        unreachable_batch: int = 100,
+    ) -> None:
+        self.bot = bot
+        self.workers = workers
+        self.max_retries = max_retries
+        self.on_unreachable = on_unreachable
+        self.unreachable_batch = unreachable_batch
+        # Один бакет на все рассылки: лимит Telegram общий для бота
+        self.bucket = bucket or TokenBucket(rate)
+        self.last_runs: Dict[str, BroadcastResult] = {}
+
+    async def run(self, name: str, recipients: AsyncIterable[int], text: str, **send_kwargs: Any) -> BroadcastResult:
+        """Отправить `text` всем chat_id из `recipients`"""
+        result = BroadcastResult(name)
+        self.last_runs[name] = result
+        started = time.monotonic()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.workers * 2)
+        unreachable: List[Tuple[int, str]] = []
+
+        async def worker() -> None:
+            nonlocal unreachable
+            while True:
+                chat_id = await queue.get()
+                try:
+                    if chat_id is None:
+                        return
+                    reason = await self._deliver(result, chat_id, text, send_kwargs)
+                    if reason is not None:
+                        unreachable.append((chat_id, reason))
+                        if len(unreachable) >= self.unreachable_batch:
+                            batch, unreachable = unreachable, []
+                            await self._report(result, batch)
+                finally:
+                    queue.task_done()
+
+        tasks = [asyncio.create_task(worker()) for _ in range(self.workers)]
+        try:
+            async for chat_id in recipients:
+                await queue.put(chat_id)
+            for _ in tasks:
+                await queue.put(None)
+            await asyncio.gather(*tasks)
+            if unreachable:
+                await self._report(result, unreachable)
+        finally:
+            for task in tasks:
+                task.cancel()
+            result.duration = time.monotonic() - started
+        logger.info(f"Рассылка {name} завершена: {result.as_dict()}")
+        return result
+
+    async def _deliver(
+        self, result: BroadcastResult, chat_id: int, text: str, send_kwargs: Dict[str, Any]
+    ) -> Optional[str]:
+        """Отправить одно сообщение; вернуть причину, если получатель недоступен"""
+        for attempt in range(self.max_retries + 1):
+            await self.bucket.acquire()
+            try:
+                await self.bot.send_message(chat_id, text, **send_kwargs)
+            except TelegramRetryAfter as e:
+                self.bucket.pause(e.retry_after)
+                if attempt < self.max_retries:
+                    result.retries += 1
+                    continue
+                result.failed += 1
+            except (TelegramForbiddenError, TelegramBadRequest) as e:
+                reason = unreachable_reason(e)
+                if reason is not None:
+                    result.blocked += 1
+                    return reason
+                result.failed += 1
+                logger.warning(f"Рассылка {result.name}: не удалось отправить {chat_id}: {e}")
+            except Exception as e:
+                result.failed += 1
+                logger.warning(f"Рассылка {result.name}: не удалось отправить {chat_id}: {e}")
+            else:
+                result.sent += 1
+            return None
+        return None
+
+    async def _report(self, result: BroadcastResult, batch: List[Tuple[int, str]]) -> None:
+        if self.on_unreachable is None:
+            return
+        try:
+            await self.on_unreachable(batch)
+        except Exception as e:
+            logger.error(f"Рассылка {result.name}: не удалось отметить недоступных получателей: {e}")
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {name: run.as_dict() for name, run in self.last_runs.items()}
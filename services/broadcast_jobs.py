@@ -0,0 +1,262 @@
+"""Сохраняемые и возобновляемые рассылки.
+
+Запуск рассылки — строка `broadcast_jobs` с ключом (`evening:2026-10-17`),
+текстом и курсором `last_user_id`. Получатели читаются от курсора,
+и каждая порция перед отправкой «занимается» в `broadcast_progress`
+(`INSERT ... ON CONFLICT DO NOTHING RETURNING user_id`) в той же
+транзакции, что сдвигает курсор. Отправляются только занятые id, поэтому
+повторный запуск после падения или деплоя, как и второй процесс с той же
+рассылкой, никому не пришлёт сообщение дважды. Цена — at-most-once: при
+падении теряются сообщения порций, занятых, но ещё не отправленных.
+"""
+import asyncio
+from datetime import datetime, timedelta, timezone
+import json
+import logging
+from typing import Any, AsyncIterable, AsyncIterator, Callable, Dict, List, NamedTuple, Optional, Set
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from services.broadcast import BroadcastResult, Broadcaster
+from services.uow import session_scope
+
+logger = logging.getLogger(__name__)
+
+JOB_COLUMNS = "id, name, run_key, text, status, last_user_id, created_at, audience"
+
+OPEN_JOB_SQL = """
+    INSERT INTO broadcast_jobs (name, run_key, text, audience)
+    VALUES (:name, :run_key, :text, CAST(:audience AS JSONB))
+    ON CONFLICT (run_key) DO NOTHING
+"""
+
+CLAIM_SQL = """
+    WITH claimed AS (
+        INSERT INTO broadcast_progress (job_id, user_id)
+        SELECT :job_id, user_id FROM unnest(CAST(:user_ids AS BIGINT[])) AS user_id
+        ON CONFLICT DO NOTHING
+        RETURNING user_id
+    ), checkpoint AS (
+        UPDATE broadcast_jobs SET last_user_id = GREATEST(COALESCE(last_user_id, :last_user_id), :last_user_id),
+                                  updated_at = NOW()
+        WHERE id = :job_id
+    )
+    SELECT user_id FROM claimed
+"""
+
+FINISH_SQL = """
+    UPDATE broadcast_jobs SET status = 'done', sent = sent + :sent, failed = failed + :failed,
+                              blocked = blocked + :blocked, updated_at = NOW(), finished_at = NOW()
+    WHERE id = :job_id
+"""
+
+# Отметки о доставке нужны, только пока рассылку можно перезапустить
+PURGE_PROGRESS_SQL = """
+    DELETE FROM broadcast_progress
+    WHERE job_id IN (SELECT id FROM broadcast_jobs WHERE status <> 'running' AND updated_at < :before)
+"""
+
+
+class BroadcastJob(NamedTuple):
+    id: int
+    name: str
+    run_key: str
+    text: str
+    status: str
+    last_user_id: Optional[int]
+    created_at: datetime
+    audience: Optional[Dict[str, Any]] = None  # параметры выборки получателей; None — все
+
+    @classmethod
+    def from_row(cls, row: Any) -> "BroadcastJob":
+        job = cls(*row)
+        if isinstance(job.audience, str):
+            job = job._replace(audience=json.loads(job.audience))
+        return job
+
+
+# Источник получателей задания: telegram_id по возрастанию строго после job.last_user_id
+RecipientSource = Callable[[BroadcastJob], AsyncIterable[int]]
+
+
+class BroadcastJobs:
+    def __init__(
+        self,
+        session_factory: async_sessionmaker[AsyncSession],
+        broadcaster: Broadcaster,
+        recipients: RecipientSource,
+        claim_size: int = 100,
+        resume_window: timedelta = timedelta(hours=3),
+        purge_interval: timedelta = timedelta(minutes=30),
+    ) -> None:
+        self._session_factory = session_factory
+        self.broadcaster = broadcaster
+        self._recipients = recipients
+        self.claim_size = claim_size
+        self.resume_window = resume_window
+        # Отметки о доставке чистятся по завершении рассылок не чаще раза в purge_interval
+        self.purge_interval = purge_interval
+        self._last_purge: Optional[datetime] = None
+        self._task: Optional[asyncio.Task] = None
+        # run_key, которые этот процесс уже выполняет или продолжит (resume)
+        self._active: Set[str] = set()
+        self.resumed = 0
+        self.skipped = 0
+        self.purged = 0
+
+    async def run(
+        self, name: str, run_key: str, text_: str, audience: Optional[Dict[str, Any]] = None
+    ) -> Optional[BroadcastResult]:
+        """Запустить рассылку `run_key` или продолжить незавершённую; завершённую — пропустить"""
+        if run_key in self._active:
+            # Например, её уже продолжает resume() после рестарта
+            self.skipped += 1
+            logger.info(f"Рассылка {run_key} уже выполняется, пропускаем")
+            return None
+        self._active.add(run_key)
+        try:
+            job = await self.open(name, run_key, text_, audience)
+            if job is None:
+                return None
+            if job.status != "running":
+                self.skipped += 1
+                logger.info(f"Рассылка {run_key} уже завершена, пропускаем")
+                return None
+            return await self._run(job)
+        finally:
+            self._active.discard(run_key)
+
+    async def _run(self, job: BroadcastJob) -> BroadcastResult:
+        if job.last_user_id is not None:
+            logger.info(f"Рассылка {job.run_key} продолжается после {job.last_user_id}")
+        recipients = self.claimed(job, self._recipients(job))
+        # Текст берём из задания: после перезапуска уходит то же сообщение
+        result = await self.broadcaster.run(job.name, recipients, job.text)
+        await self.finish(job, result)
+        await self.purge_if_due()
+        return result
+
+    async def open(
+        self, name: str, run_key: str, text_: str, audience: Optional[Dict[str, Any]] = None
+    ) -> Optional[BroadcastJob]:
+        try:
+            async with session_scope(self._session_factory) as session:
+                await session.execute(text(OPEN_JOB_SQL), {
+                    "name": name, "run_key": run_key, "text": text_,
+                    "audience": json.dumps(audience) if audience is not None else None,
+                })
+                row = (await session.execute(
+                    text(f"SELECT {JOB_COLUMNS} FROM broadcast_jobs WHERE run_key = :run_key"),
+                    {"run_key": run_key},
+                )).first()
+        except Exception as e:
+            logger.error(f"Ошибка создания рассылки {run_key}: {e}")
+            return None
+        return BroadcastJob.from_row(row) if row else None
+
+    async def claim(self, job: BroadcastJob, user_ids: List[int]) -> List[int]:
+        """Занять порцию получателей и сдвинуть курсор; вернуть тех, кому ещё не отправляли"""
+        async with session_scope(self._session_factory) as session:
+            result = await session.execute(
+                text(CLAIM_SQL),
+                {"job_id": job.id, "user_ids": user_ids, "last_user_id": user_ids[-1]},
+            )
+            claimed = set(result.scalars())
+        return [user_id for user_id in user_ids if user_id in claimed]
+
+    async def claimed(self, job: BroadcastJob, source: AsyncIterable[int]) -> AsyncIterator[int]:
+        """Получатели из `source`, прошедшие `claim` порциями по `claim_size`"""
+        chunk: List[int] = []
+        async for user_id in source:
+            chunk.append(user_id)
+            if len(chunk) >= self.claim_size:
+                for claimed in await self.claim(job, chunk):
+                    yield claimed
+                chunk = []
+        if chunk:
+            for claimed in await self.claim(job, chunk):
+                yield claimed
+
+    async def finish(self, job: BroadcastJob, result: BroadcastResult) -> None:
+        try:
+            async with session_scope(self._session_factory) as session:
+                await session.execute(text(FINISH_SQL), {
+                    "job_id": job.id, "sent": result.sent, "failed": result.failed, "blocked": result.blocked,
+                })
+        except Exception as e:
+            logger.error(f"Ошибка завершения рассылки {job.run_key}: {e}")
+
+    async def resume(self, now: Optional[datetime] = None) -> int:
+        """Продолжить прерванные рассылки; слишком старые — закрыть без отправки"""
+        cutoff = (now or datetime.now(timezone.utc)) - self.resume_window
+        try:
+            async with session_scope(self._session_factory) as session:
+                await session.execute(
+                    text("UPDATE broadcast_jobs SET status = 'expired', updated_at = NOW() "
+                         "WHERE status = 'running' AND created_at < :cutoff"),
+                    {"cutoff": cutoff},
+                )
+                rows = (await session.execute(
+                    text(f"SELECT {JOB_COLUMNS} FROM broadcast_jobs WHERE status = 'running' ORDER BY id")
+                )).all()
+        except Exception as e:
+            logger.error(f"Ошибка чтения прерванных рассылок: {e}")
+            return 0
+        await self.purge(now)
+        # Запуски, начатые run() раньше resume, не трогаем; остальные занимаем сразу,
+        # чтобы run() из планировщика не выполнил их второй раз
+        jobs = [job for job in map(BroadcastJob.from_row, rows) if job.run_key not in self._active]
+        self._active.update(job.run_key for job in jobs)
+        try:
+            for job in jobs:
+                self.resumed += 1
+                try:
+                    await self._run(job)
+                except Exception as e:
+                    logger.error(f"Ошибка продолжения рассылки {job.run_key}: {e}")
+        finally:
+            self._active.difference_update(job.run_key for job in jobs)
+        return len(jobs)
+
+    async def purge(self, now: Optional[datetime] = None) -> int:
+        """Удалить отметки о доставке рассылок, которые уже нельзя продолжить"""
+        now = now or datetime.now(timezone.utc)
+        self._last_purge = now
+        try:
+            async with session_scope(self._session_factory) as session:
+                result = await session.execute(text(PURGE_PROGRESS_SQL), {"before": now - self.resume_window})
+        except Exception as e:
+            logger.error(f"Ошибка очистки отметок о доставке: {e}")
+            return 0
+        self.purged += result.rowcount
+        return result.rowcount
+
+    async def purge_if_due(self, now: Optional[datetime] = None) -> int:
+        """`purge`, если с прошлой очистки прошло не меньше `purge_interval`"""
+        now = now or datetime.now(timezone.utc)
+        if self._last_purge is not None and now - self._last_purge < self.purge_interval:
+            return 0
+        return await self.purge(now)
+
+    def start(self) -> None:
+        """Продолжить прерванные рассылки в фоне"""
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.resume())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active": len(self._active),
+            "resumed": self.resumed,
+            "skipped": self.skipped,
+            "purged": self.purged,
+        }
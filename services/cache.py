@@ -0,0 +1,139 @@
+"""In-process кэш с ограничением размера, TTL и вытеснением LRU.
+
+`user_cache` — общий кэш записей пользователей по telegram_id: его
+заполняет `fetch_user`, а все пути записи (обновление профиля, начисления,
+продление подписки, сброс буфера счётчиков, вебхук оплаты) сбрасывают
+запись через `invalidate_user`.
+
+Читатель берёт `generation()` до запроса в БД и передаёт его в `set`:
+если ключ успели сбросить после этого, значение прочитано до изменения
+и в кэш не попадает.
+"""
+from collections import OrderedDict
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, Iterable, Optional
+
+from services.uow import after_commit, current_unit_of_work
+
+
+class TTLCache:
+    """Не больше `maxsize` записей, каждая живёт `ttl` секунд"""
+
+    def __init__(
+        self,
+        maxsize: int = 10000,
+        ttl: float = 60.0,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Поколение последнего сброса по ключу; самые старые забываются
+        self._generation = 0
+        self._invalidated: "OrderedDict[Hashable, int]" = OrderedDict()
+        self._forgotten = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.stale_sets = 0
+
+    def configure(self, maxsize: int, ttl: float) -> None:
+        with self._lock:
+            self.maxsize = maxsize
+            self.ttl = ttl
+            while len(self._data) > max(maxsize, 0):
+                self._data.popitem(last=False)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            expires_at, value = item
+            if expires_at <= self._clock():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def generation(self) -> int:
+        """Текущее поколение сбросов — брать до чтения значения из источника"""
+        with self._lock:
+            return self._generation
+
+    def set(self, key: Hashable, value: Any, generation: Optional[int] = None) -> None:
+        """Положить значение; с `generation` — только если ключ с тех пор не сбрасывали"""
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            if generation is not None and (
+                generation < self._forgotten or self._invalidated.get(key, 0) > generation
+            ):
+                self.stale_sets += 1
+                return
+            self._data[key] = (self._clock() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            self._generation += 1
+            self._invalidated[key] = self._generation
+            self._invalidated.move_to_end(key)
+            while len(self._invalidated) > max(self.maxsize, 1):
+                _, self._forgotten = self._invalidated.popitem(last=False)
+            if self._data.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def invalidate_many(self, keys: Iterable[Hashable]) -> None:
+        for key in keys:
+            self.invalidate(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+            "stale_sets": self.stale_sets,
+        }
+
+
+# Размер и TTL задаёт main.py из USER_CACHE_SIZE / USER_CACHE_TTL
+user_cache = TTLCache()
+
+
+def invalidate_user(telegram_id: int) -> None:
+    """Сбросить пользователя сейчас и повторно после коммита или отката апдейта.
+
+    Повторный сброс убирает значение, которое параллельный запрос мог
+    закэшировать до коммита, и незакоммиченные данные после отката.
+    """
+    user_cache.invalidate(telegram_id)
+    after_commit(lambda: user_cache.invalidate(telegram_id))
+    uow = current_unit_of_work()
+    if uow is not None:
+        uow.after_rollback(lambda: user_cache.invalidate(telegram_id))
@@ -0,0 +1,73 @@
+"""Каталог практик и товаров со стабильными id.
+
+Разделы каталога берутся из констант `main.py` или из YAML-файла
+(`CATALOG_PATH`) с теми же ключами верхнего уровня. У каждого элемента
+обязателен явный `id`: callback_data не зависит ни от порядка элементов,
+ни от их названий (переименование не ломает отправленные кнопки) и
+укладывается в лимит Telegram в 64 байта.
+"""
+from typing import Any, Dict, Iterator, Mapping, Optional, Sequence, Tuple
+
+import yaml
+
+Item = Dict[str, Any]
+
+# Раздел -> поле с названием элемента (для сообщений об ошибках)
+SECTIONS: Dict[str, str] = {
+    "psychology_practices": "title",
+    "shop_items": "name",
+    "hearts_shop_items": "name",
+    "paid_shop_items": "name",
+    "premium_shop_items": "name",
+}
+
+
+class CatalogSection:
+    """Элементы раздела в исходном порядке и индекс id -> элемент"""
+
+    __slots__ = ("items", "by_id")
+
+    def __init__(self, items: Sequence[Mapping[str, Any]], name_field: str) -> None:
+        for item in items:
+            if not item.get("id"):
+                raise ValueError(f"У элемента каталога нет id ({item.get(name_field)})")
+        self.items: Tuple[Item, ...] = tuple({**item, "id": str(item["id"])} for item in items)
+        self.by_id: Dict[str, Item] = {}
+        for item in self.items:
+            if item["id"] in self.by_id:
+                raise ValueError(f"Повторяющийся id {item['id']!r} ({item[name_field]})")
+            self.by_id[item["id"]] = item
+
+    def get(self, item_id: str) -> Optional[Item]:
+        return self.by_id.get(item_id)
+
+    def __iter__(self) -> Iterator[Item]:
+        return iter(self.items)
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+
+class Catalog:
+    __slots__ = tuple(SECTIONS)
+
+    def __init__(self, sections: Mapping[str, Sequence[Mapping[str, Any]]]) -> None:
+        for name, name_field in SECTIONS.items():
+            setattr(self, name, CatalogSection(sections.get(name) or (), name_field))
+
+    @classmethod
+    def load(
+        cls,
+        defaults: Mapping[str, Sequence[Mapping[str, Any]]],
+        path: Optional[str] = None,
+    ) -> "Catalog":
+        """Каталог из YAML `path`; разделы, которых нет в файле, берутся из `defaults`"""
+        sections = dict(defaults)
+        if path:
+            with open(path, encoding="utf-8") as f:
+                data = yaml.safe_load(f) or {}
+            unknown = set(data) - set(SECTIONS)
+            if unknown:
+                raise ValueError(f"Неизвестные разделы каталога: {', '.join(sorted(unknown))}")
+            sections.update(data)
+        return cls(sections)
@@ -0,0 +1,137 @@
+"""Объединение одинаковых одновременных запросов к AI.
+
+Ключ запроса — хеш (модель, системный промпт и сообщения, temperature,
+max_tokens). Пока запрос с таким ключом выполняется, остальные вызовы
+ждут его результата вместо отдельного обращения к OpenAI (single-flight).
+Отмена одного из ожидающих не отменяет общий запрос.
+
+Потоковые ответы объединяет `StreamFlight`: один поток от OpenAI на ключ,
+подключившийся позже сначала получает уже пришедшие куски, затем — новые
+вместе с остальными.
+"""
+import asyncio
+import hashlib
+import json
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Generic, List, Mapping, Optional, TypeVar
+
+T = TypeVar("T")
+
+KEY_FIELDS = ("model", "messages", "temperature", "max_tokens")
+
+
+def payload_key(payload: Mapping[str, Any]) -> str:
+    data = json.dumps({field: payload.get(field) for field in KEY_FIELDS}, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+class SingleFlight:
+    def __init__(self) -> None:
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.leaders = 0
+        self.followers = 0
+
+    async def do(self, key: str, operation: Callable[[], Awaitable[T]]) -> T:
+        task = self._inflight.get(key)
+        if task is None:
+            self.leaders += 1
+            task = asyncio.get_running_loop().create_task(operation())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._finished(key, done))
+        else:
+            self.followers += 1
+        return await asyncio.shield(task)
+
+    def _finished(self, key: str, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Ошибку получают ожидающие; если их не осталось — не шумим в лог
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> Dict[str, int]:
+        return {"in_flight": len(self._inflight), "leaders": self.leaders, "coalesced": self.followers}
+
+
+class SharedStream(Generic[T]):
+    """Куски одного потока ответа; `result` — итог производителя (например, usage)"""
+
+    def __init__(self) -> None:
+        self.parts: List[str] = []
+        self.result: Optional[T] = None
+        self.error: Optional[BaseException] = None
+        self.done = False
+        self._changed = asyncio.Event()
+
+    def emit(self, part: str) -> None:
+        self.parts.append(part)
+        self._wake()
+
+    def close(self) -> None:
+        self.done = True
+        self._wake()
+
+    def _wake(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def follow(self) -> AsyncIterator[str]:
+        """Все куски с начала потока; ошибка производителя поднимается в конце"""
+        sent = 0
+        while True:
+            changed = self._changed
+            while sent < len(self.parts):
+                yield self.parts[sent]
+                sent += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await changed.wait()
+
+
+class StreamFlight:
+    def __init__(self) -> None:
+        self._inflight: Dict[str, SharedStream] = {}
+        self.leaders = 0
+        self.followers = 0
+
+    def stream(
+        self,
+        key: Optional[str],
+        produce: Callable[[Callable[[str], None]], Awaitable[T]],
+    ) -> SharedStream[T]:
+        """Подключиться к потоку `key` или запустить его: `produce(emit)` отдаёт куски через `emit`.
+
+        `key=None` — поток только для этого вызова. Производитель работает в
+        своей задаче: отмена одного из читателей не обрывает поток остальным.
+        """
+        shared = self._inflight.get(key) if key is not None else None
+        if shared is not None:
+            self.followers += 1
+            return shared
+        self.leaders += 1
+        shared = SharedStream()
+        if key is not None:
+            self._inflight[key] = shared
+        asyncio.get_running_loop().create_task(self._pump(key, shared, produce))
+        return shared
+
+    async def _pump(
+        self,
+        key: Optional[str],
+        shared: SharedStream[T],
+        produce: Callable[[Callable[[str], None]], Awaitable[T]],
+    ) -> None:
+        try:
+            shared.result = await produce(shared.emit)
+        except BaseException as e:
+            shared.error = e
+            if isinstance(e, asyncio.CancelledError):
+                raise
+        finally:
+            if key is not None and self._inflight.get(key) is shared:
+                del self._inflight[key]
+            shared.close()
+
+    def stats(self) -> Dict[str, int]:
+        return {"streams_in_flight": len(self._inflight), "stream_leaders": self.leaders, "streams_coalesced": self.followers}
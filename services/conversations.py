@@ -0,0 +1,184 @@
+"""Память диалога с AI-психологом поверх таблицы `user_messages`.
+
+Последние `max_turns` реплик пользователя держатся в памяти (кольцевой
+буфер на `deque`, не больше `max_users` пользователей с вытеснением LRU).
+При промахе история читается одним запросом по индексу
+`(user_id, created_at DESC) LIMIT max_turns`, без просмотра всей истории.
+Новые реплики попадают в буфер сразу, а в БД пишутся в фоне пачками раз
+в `flush_interval` секунд; ещё не записанные реплики подмешиваются
+к прочитанной из БД истории.
+"""
+import asyncio
+from collections import OrderedDict, deque
+from datetime import datetime
+import logging
+from typing import Callable, Deque, Dict, List, NamedTuple, Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from services.quota import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Служебные токены на одно сообщение в формате chat completions
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+class Turn(NamedTuple):
+    user_id: int
+    is_ai_response: bool
+    text: str
+    created_at: datetime
+
+    def as_message(self) -> Dict[str, str]:
+        return {"role": "assistant" if self.is_ai_response else "user", "content": self.text}
+
+
+class ConversationStore:
+    def __init__(
+        self,
+        session_factory: async_sessionmaker[AsyncSession],
+        max_turns: int = 10,
+        token_budget: int = 1500,
+        max_users: int = 5000,
+        flush_interval: float = 1.0,
+        max_pending: int = 200,
+        estimate: Callable[[str], int] = estimate_tokens,
+    ) -> None:
+        self._session_factory = session_factory
+        self.max_turns = max_turns
+        self.token_budget = token_budget
+        self.max_users = max_users
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._estimate = estimate
+        self._buffers: "OrderedDict[int, Deque[Turn]]" = OrderedDict()
+        self._pending: List[Turn] = []
+        self._in_flight: List[Turn] = []
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.misses = 0
+        self.written = 0
+
+    def append(self, user_id: int, text_: str, is_ai_response: bool) -> None:
+        """Добавить реплику: в буфер сразу, в БД — при ближайшем сбросе"""
+        turn = Turn(user_id, is_ai_response, text_, datetime.utcnow())
+        self._pending.append(turn)
+        buffer = self._buffers.get(user_id)
+        if buffer is not None:
+            buffer.append(turn)
+        if len(self._pending) >= self.max_pending:
+            asyncio.get_running_loop().create_task(self.flush())
+
+    async def history(self, user_id: int) -> List[Turn]:
+        """Последние `max_turns` реплик, от старых к новым"""
+        buffer = self._buffers.get(user_id)
+        if buffer is not None:
+            self._buffers.move_to_end(user_id)
+            self.hits += 1
+            return list(buffer)
+
+        self.misses += 1
+        unsaved_before = self._unsaved(user_id)
+        turns = await self._load(user_id)
+        # Незаписанные реплики в выборку не попали; сброс мог завершиться во
+        # время чтения, поэтому берём снимки до и после и убираем повторы
+        loaded = set(turns)
+        for turn in dict.fromkeys(unsaved_before + self._unsaved(user_id)):
+            if turn not in loaded:
+                turns.append(turn)
+        buffer = deque(turns, maxlen=self.max_turns)
+        self._buffers[user_id] = buffer
+        while len(self._buffers) > self.max_users:
+            self._buffers.popitem(last=False)
+        return list(buffer)
+
+    def _unsaved(self, user_id: int) -> List[Turn]:
+        return [turn for turn in self._in_flight + self._pending if turn.user_id == user_id]
+
+    async def context(self, user_id: int, token_budget: Optional[int] = None) -> List[Dict[str, str]]:
+        """Сообщения для промпта: самые свежие реплики, укладывающиеся в бюджет токенов"""
+        budget = self.token_budget if token_budget is None else token_budget
+        messages: List[Dict[str, str]] = []
+        for turn in reversed(await self.history(user_id)):
+            cost = self._estimate(turn.text) + MESSAGE_OVERHEAD_TOKENS
+            if cost > budget:
+                break
+            budget -= cost
+            messages.append(turn.as_message())
+        messages.reverse()
+        return messages
+
+    async def _load(self, user_id: int) -> List[Turn]:
+        try:
+            async with self._session_factory() as session:
+                result = await session.execute(
+                    text("SELECT message_text, is_ai_response, created_at FROM user_messages "
+                         "WHERE user_id = :user_id ORDER BY created_at DESC LIMIT :limit"),
+                    {"user_id": user_id, "limit": self.max_turns},
+                )
+                rows = result.all()
+        except Exception as e:
+            logger.error(f"Ошибка загрузки истории диалога {user_id}: {e}")
+            return []
+        return [Turn(user_id, bool(is_ai), message or "", created_at) for message, is_ai, created_at in reversed(rows)]
+
+    async def flush(self) -> int:
+        """Записать накопленные реплики одной пачкой"""
+        async with self._flush_lock:
+            if not self._pending:
+                return 0
+            batch, self._pending = self._pending, []
+            self._in_flight = batch
+            try:
+                async with self._session_factory.begin() as session:
+                    await session.execute(
+                        text("INSERT INTO user_messages (user_id, message_text, is_ai_response, created_at) "
+                             "VALUES (:user_id, :message_text, :is_ai_response, :created_at)"),
+                        [
+                            {"user_id": turn.user_id, "message_text": turn.text,
+                             "is_ai_response": turn.is_ai_response, "created_at": turn.created_at}
+                            for turn in batch
+                        ],
+                    )
+            except Exception as e:
+                logger.error(f"Ошибка записи истории диалогов ({len(batch)} реплик): {e}")
+                # Вернём реплики в очередь до следующей попытки
+                self._pending[:0] = batch
+                return 0
+            finally:
+                self._in_flight = []
+            self.written += len(batch)
+            return len(batch)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def start(self) -> None:
+        """Запустить фоновую запись"""
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        """Остановить фоновую запись и дописать остаток"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "users": len(self._buffers),
+            "hits": self.hits,
+            "misses": self.misses,
+            "pending": len(self._pending),
+            "written": self.written,
+        }
@@ -0,0 +1,179 @@
+"""Write-behind агрегатор начислений сердечек.
+
+Начисления копятся в памяти по `telegram_id` и сбрасываются в БД одним
+set-based `UPDATE ... FROM (VALUES ...)` раз в `flush_interval` секунд
+или при накоплении `max_pending` пользователей. Несброшенные дельты
+подмешиваются к прочитанным из БД записям (`overlay`), поэтому баланс,
+который видит пользователь, всегда актуален.
+
+Чтение, пересёкшееся со сбросом, неоднозначно: неизвестно, успел ли
+коммит сброса попасть в прочитанную строку. Поэтому записи для `overlay`
+читаются через `consistent_read`, который такое чтение повторяет.
+
+Окно возможной потери данных при падении процесса — `flush_interval`;
+при штатной остановке `stop()` сбрасывает всё накопленное.
+"""
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple, TypeVar
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from services.users import UserRecord, ensure_stats
+
+logger = logging.getLogger(__name__)
+
+FLUSH_CHUNK_SIZE = 1000  # 2 параметра на строку — далеко от лимита asyncpg
+
+T = TypeVar("T")
+
+
+def flush_sql(rows: int) -> str:
+    """UPDATE порции из `rows` строк с параметрами `:id_i`, `:h_i`"""
+    values = ", ".join(f"(CAST(:id_{i} AS BIGINT), CAST(:h_{i} AS INTEGER))" for i in range(rows))
+    return f"""
+        UPDATE user_stats AS s
+        SET hearts = COALESCE(s.hearts, 0) + v.hearts
+        FROM (VALUES {values}) AS v(telegram_id, hearts)
+        WHERE s.user_id = v.telegram_id
+        RETURNING s.user_id
+    """
+
+
+class CounterAggregator:
+    """Буфер дельт сердечек со сбросом пачками"""
+
+    def __init__(
+        self,
+        session_factory: async_sessionmaker[AsyncSession],
+        flush_interval: float = 2.0,
+        max_pending: int = 500,
+        on_flush: Optional[Callable[[Iterable[int]], None]] = None,
+    ) -> None:
+        self._session_factory = session_factory
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        # Вызывается с telegram_id сброшенных пользователей сразу после коммита
+        self.on_flush = on_flush
+        self._pending: Dict[int, int] = {}  # telegram_id -> hearts
+        self._flush_lock = asyncio.Lock()
+        self._idle = asyncio.Event()  # Установлен, пока сброс не идёт
+        self._idle.set()
+        self._flush_epoch = 0  # Растёт при начале каждого сброса
+        self._task: Optional[asyncio.Task] = None
+        self.flushes = 0
+        self.flushed_rows = 0
+        self.reread = 0
+
+    def add(self, telegram_id: int, hearts: int) -> None:
+        """Добавить дельту; при переполнении буфера запланировать сброс"""
+        self._pending[telegram_id] = self._pending.get(telegram_id, 0) + hearts
+        if len(self._pending) >= self.max_pending:
+            asyncio.get_running_loop().create_task(self.flush())
+
+    def pending(self, telegram_id: int) -> int:
+        """Несброшенные сердечки пользователя"""
+        return self._pending.get(telegram_id, 0)
+
+    def overlay(self, user: UserRecord) -> UserRecord:
+        """Подмешать несброшенные дельты к записи из `consistent_read` (read-your-writes)"""
+        hearts = self.pending(user["telegram_id"])
+        if hearts:
+            user["hearts"] = (user.get("hearts") or 0) + hearts
+        return user
+
+    async def consistent_read(self, read: Callable[[], Awaitable[T]]) -> T:
+        """Выполнить чтение, не пересёкшееся ни с одним сбросом.
+
+        Дельты идущего сброса уже не в буфере, но могут быть ещё не видны
+        в БД: такое чтение ждёт конца сброса и выполняется заново, чтобы
+        `overlay` не посчитал дельту ни дважды, ни ноль раз.
+        """
+        while True:
+            await self._idle.wait()
+            epoch = self._flush_epoch
+            result = await read()
+            if self._flush_epoch == epoch and self._idle.is_set():
+                return result
+            self.reread += 1
+
+    async def flush(self) -> int:
+        """Сбросить накопленные дельты в БД, вернуть число обновлённых пользователей"""
+        async with self._flush_lock:
+            if not self._pending:
+                return 0
+            batch, self._pending = self._pending, {}
+            rows = [(tid, hearts) for tid, hearts in batch.items() if hearts]
+            self._flush_epoch += 1
+            self._idle.clear()
+            try:
+                async with self._session_factory.begin() as session:
+                    for start in range(0, len(rows), FLUSH_CHUNK_SIZE):
+                        await self._flush_chunk(session, rows[start:start + FLUSH_CHUNK_SIZE])
+                # Дельты уже в БД: сбрасываем кэши читателей до того, как их разбудить
+                self._notify_flushed(batch)
+            except Exception as e:
+                logger.error(f"Ошибка сброса счётчиков ({len(rows)} польз.): {e}")
+                # Возвращаем дельты в буфер, чтобы не потерять их до следующей попытки
+                for tid, hearts in batch.items():
+                    self._pending[tid] = self._pending.get(tid, 0) + hearts
+                return 0
+            finally:
+                self._idle.set()
+
+            self.flushes += 1
+            self.flushed_rows += len(rows)
+            return len(rows)
+
+    def _notify_flushed(self, batch: Dict[int, int]) -> None:
+        if self.on_flush is None:
+            return
+        try:
+            self.on_flush(batch.keys())
+        except Exception as e:
+            logger.error(f"Ошибка обработчика сброса счётчиков: {e}")
+
+    async def _flush_chunk(self, session: AsyncSession, rows: List[Tuple[int, int]]) -> None:
+        updated = await self._update_chunk(session, rows)
+        missing = [row for row in rows if row[0] not in updated]
+        if missing:
+            # Пользователям без строки счётчиков создаём её и повторяем UPDATE только для них
+            await ensure_stats(session, [tid for tid, _ in missing])
+            await self._update_chunk(session, missing)
+
+    async def _update_chunk(self, session: AsyncSession, rows: List[Tuple[int, int]]) -> Set[int]:
+        params: Dict[str, int] = {}
+        for i, (tid, hearts) in enumerate(rows):
+            params.update({f"id_{i}": tid, f"h_{i}": hearts})
+        result = await session.execute(text(flush_sql(len(rows))), params)
+        return {row[0] for row in result}
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def start(self) -> None:
+        """Запустить периодический сброс"""
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        """Остановить периодический сброс и сбросить остаток"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "pending": len(self._pending),
+            "flushes": self.flushes,
+            "flushed_rows": self.flushed_rows,
+            "reread": self.reread,
+        }
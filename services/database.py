@@ -0,0 +1,146 @@
+"""Async-движок БД с настройкой пула из окружения и метриками пула.
+
+Переменные окружения:
+    DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE,
+    DB_POOL_PRE_PING — параметры QueuePool;
+    DB_STATEMENT_CACHE_SIZE — кэш prepared statements asyncpg на соединение;
+    DB_PGBOUNCER=1 — режим совместимости с PgBouncer (transaction pooling):
+    prepared statements не кэшируются и получают уникальные имена.
+"""
+from dataclasses import dataclass
+import os
+import time
+from typing import Any, Dict
+from uuid import uuid4
+
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, ConnectionPoolEntry, QueuePool
+
+
+@dataclass
+class PoolSettings:
+    pool_size: int = 10
+    max_overflow: int = 10
+    pool_timeout: float = 30.0
+    pool_recycle: int = 1800
+    pool_pre_ping: bool = True
+    statement_cache_size: int = 100
+    pgbouncer: bool = False
+
+    @classmethod
+    def from_env(cls) -> "PoolSettings":
+        return cls(
+            pool_size=int(os.getenv("DB_POOL_SIZE", cls.pool_size)),
+            max_overflow=int(os.getenv("DB_MAX_OVERFLOW", cls.max_overflow)),
+            pool_timeout=float(os.getenv("DB_POOL_TIMEOUT", cls.pool_timeout)),
+            pool_recycle=int(os.getenv("DB_POOL_RECYCLE", cls.pool_recycle)),
+            pool_pre_ping=os.getenv("DB_POOL_PRE_PING", "1") == "1",
+            statement_cache_size=int(os.getenv("DB_STATEMENT_CACHE_SIZE", cls.statement_cache_size)),
+            pgbouncer=os.getenv("DB_PGBOUNCER", "0") == "1",
+        )
+
+
+class PoolWaitStats:
+    """Сколько и как долго ждали свободное соединение"""
+
+    __slots__ = ("checkouts", "waits", "total_wait", "max_wait", "timeouts")
+
+    # Получение быстрее этого порога считаем взятием без ожидания
+    WAIT_THRESHOLD = 0.001
+
+    def __init__(self) -> None:
+        self.checkouts = 0
+        self.waits = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.timeouts = 0
+
+    def record(self, seconds: float) -> None:
+        self.checkouts += 1
+        if seconds >= self.WAIT_THRESHOLD:
+            self.waits += 1
+            self.total_wait += seconds
+            self.max_wait = max(self.max_wait, seconds)
+
+
+class InstrumentedAsyncQueuePool(AsyncAdaptedQueuePool):
+    """AsyncAdaptedQueuePool, замеряющий время ожидания соединения.
+
+    В ожидание входит и установка нового соединения, если пул его создаёт.
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.wait_stats = PoolWaitStats()
+
+    def _do_get(self) -> ConnectionPoolEntry:
+        started = time.monotonic()
+        try:
+            entry = super()._do_get()
+        except Exception:
+            self.wait_stats.timeouts += 1
+            raise
+        self.wait_stats.record(time.monotonic() - started)
+        return entry
+
+    def recreate(self) -> "InstrumentedAsyncQueuePool":
+        pool = super().recreate()
+        pool.wait_stats = self.wait_stats  # type: ignore[attr-defined]
+        return pool  # type: ignore[return-value]
+
+
+def build_engine(url: str, settings: PoolSettings) -> AsyncEngine:
+    """Создать async-движок с настроенным пулом"""
+    parsed = make_url(url)
+    if parsed.get_backend_name() == "sqlite":
+        # SQLite (локальная разработка) — пул по умолчанию
+        return create_async_engine(url, echo=False)
+
+    kwargs: Dict[str, Any] = {
+        "echo": False,
+        "poolclass": InstrumentedAsyncQueuePool,
+        "pool_size": settings.pool_size,
+        "max_overflow": settings.max_overflow,
+        "pool_timeout": settings.pool_timeout,
+        "pool_recycle": settings.pool_recycle,
+        "pool_pre_ping": settings.pool_pre_ping,
+    }
+
+    if parsed.get_driver_name() == "asyncpg":
+        if settings.pgbouncer:
+            kwargs["connect_args"] = {
+                "statement_cache_size": 0,
+                "prepared_statement_cache_size": 0,
+                "prepared_statement_name_func": lambda: f"__asyncpg_{uuid4()}__",
+            }
+        else:
+            kwargs["connect_args"] = {
+                "statement_cache_size": settings.statement_cache_size,
+                "prepared_statement_cache_size": settings.statement_cache_size,
+            }
+
+    return create_async_engine(url, **kwargs)
+
+
+def pool_snapshot(engine: AsyncEngine) -> Dict[str, Any]:
+    """Текущее состояние пула: занятые/свободные соединения и ожидания"""
+    pool = engine.pool
+    snapshot: Dict[str, Any] = {"pool": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        snapshot.update(
+            size=pool.size(),
+            checked_out=pool.checkedout(),
+            idle=pool.checkedin(),
+            overflow=max(pool.overflow(), 0),
+        )
+    stats = getattr(pool, "wait_stats", None)
+    if stats is not None:
+        snapshot.update(
+            checkouts=stats.checkouts,
+            waits=stats.waits,
+            avg_wait_ms=round(stats.total_wait / stats.waits * 1000, 1) if stats.waits else 0.0,
+            max_wait_ms=round(stats.max_wait * 1000, 1),
+            timeouts=stats.timeouts,
+        )
+    return snapshot
@@ -0,0 +1,195 @@
+"""Доставка ежедневных челленджей по местному времени пользователя.
+
+Вместо двух cron-задач на всех сразу (9:00 и 18:00 МСК) планировщик
+просыпается каждую минуту. Пользователи разложены по корзинам
+(часовой пояс, минута), где минута — `telegram_id % 60`: утренний
+челлендж приходит в 9:00–9:59 по местному времени, и рассылка
+растягивается на час в каждом поясе вместо двух пиков в сутки.
+Корзина читается частичным индексом `ix_users_delivery_bucket`.
+
+Каждая корзина — отдельный запуск `BroadcastJobs` с ключом
+`morning:2026-10-17:Asia/Omsk:07`, поэтому повторный проход по той же
+минуте (догон после рестарта) ничего не отправит дважды.
+"""
+import asyncio
+from datetime import date, datetime, timedelta, timezone, tzinfo
+import logging
+from typing import Any, Callable, Dict, Iterable, List, Mapping, NamedTuple, Optional, Set
+
+import pytz
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from services.broadcast_jobs import BroadcastJobs
+from services.uow import session_scope
+from services.users import REACHABLE_WHERE
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEZONE = "Europe/Moscow"
+
+# Пояса, доступные в /timezone: название — подпись на кнопке
+DELIVERY_TIMEZONES: Dict[str, str] = {
+    "Europe/Kaliningrad": "Калининград",
+    "Europe/Moscow": "Москва",
+    "Europe/Samara": "Самара",
+    "Asia/Yekaterinburg": "Екатеринбург",
+    "Asia/Omsk": "Омск",
+    "Asia/Novosibirsk": "Новосибирск",
+    "Asia/Krasnoyarsk": "Красноярск",
+    "Asia/Irkutsk": "Иркутск",
+    "Asia/Yakutsk": "Якутск",
+    "Asia/Vladivostok": "Владивосток",
+    "Asia/Magadan": "Магадан",
+    "Asia/Kamchatka": "Камчатка",
+    "Europe/Minsk": "Минск",
+    "Europe/Kyiv": "Киев",
+    "Asia/Almaty": "Алматы",
+    "Asia/Tashkent": "Ташкент",
+}
+
+BUCKET_MINUTES = 60
+
+# Условие совпадает с частичным индексом ix_users_delivery_bucket
+BUCKET_WHERE = f"({REACHABLE_WHERE}) AND timezone = :timezone AND telegram_id % {BUCKET_MINUTES} = :minute"
+
+# Есть ли в корзине хоть один получатель
+BUCKET_PROBE_SQL = f"SELECT 1 FROM users WHERE {BUCKET_WHERE} LIMIT 1"
+
+
+def user_timezone(name: Optional[str]) -> tzinfo:
+    """Пояс пользователя для локальных дат; вне DELIVERY_TIMEZONES — пояс по умолчанию"""
+    return pytz.timezone(name if name in DELIVERY_TIMEZONES else DEFAULT_TIMEZONE)
+
+
+def find_timezone(query: str) -> Optional[str]:
+    """Пояс из DELIVERY_TIMEZONES по названию (`Asia/Omsk`) или подписи (`омск`)"""
+    query = query.strip().lower()
+    for name, label in DELIVERY_TIMEZONES.items():
+        if query in (name.lower(), label.lower()):
+            return name
+    return None
+
+
+class DueBucket(NamedTuple):
+    slot: str
+    timezone: str
+    local_date: date
+    minute: int
+
+    @property
+    def run_key(self) -> str:
+        return f"{self.slot}:{self.local_date.isoformat()}:{self.timezone}:{self.minute:02d}"
+
+    @property
+    def audience(self) -> Dict[str, Any]:
+        return {"timezone": self.timezone, "minute": self.minute}
+
+
+def due_buckets(slots: Mapping[str, int], timezones: Iterable[str], now: datetime) -> List[DueBucket]:
+    """Корзины, чья минута доставки совпадает с `now` (aware): слот — час по местному времени"""
+    due = []
+    for name in timezones:
+        local = now.astimezone(pytz.timezone(name))
+        for slot, hour in slots.items():
+            if local.hour == hour:
+                due.append(DueBucket(slot, name, local.date(), local.minute))
+    return due
+
+
+class DeliveryScheduler:
+    def __init__(
+        self,
+        session_factory: async_sessionmaker[AsyncSession],
+        jobs: BroadcastJobs,
+        render: Callable[[str, date], str],
+        slots: Mapping[str, int],
+        timezones: Iterable[str] = DELIVERY_TIMEZONES,
+        catch_up: timedelta = timedelta(minutes=10),
+    ) -> None:
+        self._session_factory = session_factory
+        self.jobs = jobs
+        self._render = render
+        self.slots = dict(slots)
+        self.timezones = tuple(timezones)
+        self.catch_up = catch_up
+        self._last_tick: Optional[datetime] = None
+        self._task: Optional[asyncio.Task] = None
+        self._running: Set[asyncio.Task] = set()
+        self.buckets = 0
+        self.sent = 0
+        self.blocked = 0
+        self.failed = 0
+
+    async def tick(self, now: Optional[datetime] = None) -> int:
+        """Запустить корзины всех минут после предыдущего срабатывания по `now` включительно"""
+        now = (now or datetime.now(timezone.utc)).replace(second=0, microsecond=0)
+        # После рестарта догоняем пропущенные минуты; завершённые корзины пропустит BroadcastJobs
+        minute = max(self._last_tick or now - self.catch_up, now - self.catch_up) + timedelta(minutes=1)
+        started = 0
+        while minute <= now:
+            for bucket in due_buckets(self.slots, self.timezones, minute):
+                if await self._has_recipients(bucket):
+                    task = asyncio.get_running_loop().create_task(self._deliver(bucket))
+                    self._running.add(task)
+                    task.add_done_callback(self._running.discard)
+                    started += 1
+            minute += timedelta(minutes=1)
+        self._last_tick = now
+        return started
+
+    async def _has_recipients(self, bucket: DueBucket) -> bool:
+        # Пустые корзины не заводят запусков в broadcast_jobs
+        try:
+            async with session_scope(self._session_factory) as session:
+                result = await session.execute(text(BUCKET_PROBE_SQL), bucket.audience)
+                return result.first() is not None
+        except Exception as e:
+            logger.error(f"Ошибка проверки корзины {bucket.run_key}: {e}")
+            return False
+
+    async def _deliver(self, bucket: DueBucket) -> None:
+        try:
+            result = await self.jobs.run(
+                bucket.slot, bucket.run_key, self._render(bucket.slot, bucket.local_date), bucket.audience
+            )
+        except Exception as e:
+            logger.error(f"Ошибка доставки корзины {bucket.run_key}: {e}")
+            return
+        if result is None:
+            return
+        self.buckets += 1
+        self.sent += result.sent
+        self.blocked += result.blocked
+        self.failed += result.failed
+
+    async def _run(self) -> None:
+        while True:
+            now = datetime.now(timezone.utc)
+            await asyncio.sleep(60 - now.second - now.microsecond / 1_000_000)
+            try:
+                await self.tick()
+            except Exception as e:
+                logger.error(f"Ошибка планировщика челленджей: {e}")
+
+    def start(self) -> None:
+        """Проверять корзины в начале каждой минуты"""
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        tasks = [task for task in (self._task, *self._running) if task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
+        self._running.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "running": len(self._running),
+            "buckets": self.buckets,
+            "sent": self.sent,
+            "blocked": self.blocked,
+            "failed": self.failed,
+        }
@@ -0,0 +1,151 @@
+"""Общий HTTP-клиент для запросов к OpenAI.
+
+Один `httpx.AsyncClient` живёт всё время работы бота (создаётся в
+`on_startup`, закрывается в `on_shutdown`), поэтому соединения с API
+переиспользуются через keep-alive вместо TCP+TLS на каждый вопрос.
+Ответ можно получать потоком (SSE) — см. `stream_chat_completion`.
+HTTP/2 включается, если установлен пакет `h2`. Новые соединения
+считаются через trace-расширение httpcore — по ним видно, как часто
+запросы идут по уже открытому соединению.
+"""
+import importlib.util
+import json
+import logging
+from typing import Any, AsyncIterator, Callable, Dict, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+OPENAI_BASE_URL = "https://api.openai.com/v1"
+
+
+def http2_available() -> bool:
+    return importlib.util.find_spec("h2") is not None
+
+
+class OpenAIClient:
+    """Пул соединений к OpenAI с явными таймаутами и лимитами"""
+
+    def __init__(
+        self,
+        api_key: Optional[str],
+        base_url: str = OPENAI_BASE_URL,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 60.0,
+        pool_timeout: float = 10.0,
+        max_connections: int = 20,
+        max_keepalive_connections: int = 10,
+        keepalive_expiry: float = 60.0,
+        http2: Optional[bool] = None,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ) -> None:
+        self.api_key = api_key
+        self.base_url = base_url
+        self.timeout = httpx.Timeout(
+            connect=connect_timeout, read=read_timeout, write=connect_timeout, pool=pool_timeout,
+        )
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.http2 = http2_available() if http2 is None else http2
+        self._transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+        self.requests = 0
+        self.new_connections = 0
+        self.http2_responses = 0
+        self.errors = 0
+
+    async def start(self) -> None:
+        self._get_client()
+        logger.info(f"HTTP-клиент OpenAI готов (http2={self.http2}, max_connections={self.limits.max_connections})")
+
+    async def stop(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers={"Authorization": f"Bearer {self.api_key}"},
+                timeout=self.timeout,
+                limits=self.limits,
+                http2=self.http2,
+                transport=self._transport,
+            )
+        return self._client
+
+    async def _trace(self, event_name: str, info: Dict[str, Any]) -> None:
+        # Событие приходит только когда пул открывает новое соединение
+        if event_name == "connection.connect_tcp.complete":
+            self.new_connections += 1
+
+    async def post(self, path: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """POST в API; ошибки HTTP и сети пробрасываются вызывающему"""
+        self.requests += 1
+        try:
+            response = await self._get_client().post(
+                path, json=payload, extensions={"trace": self._trace},
+            )
+            response.raise_for_status()
+        except Exception:
+            self.errors += 1
+            raise
+        if response.http_version == "HTTP/2":
+            self.http2_responses += 1
+        return response.json()
+
+    async def chat_completion(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        return await self.post("/chat/completions", payload)
+
+    async def stream_chat_completion(
+        self,
+        payload: Dict[str, Any],
+        on_usage: Optional[Callable[[Dict[str, Any]], None]] = None,
+    ) -> AsyncIterator[str]:
+        """Ответ модели по частям (SSE, `stream: true`) — куски текста по мере генерации.
+
+        Расход токенов приходит последним событием и передаётся в `on_usage`.
+        """
+        self.requests += 1
+        try:
+            async with self._get_client().stream(
+                "POST", "/chat/completions",
+                json={**payload, "stream": True, "stream_options": {"include_usage": True}},
+                extensions={"trace": self._trace},
+            ) as response:
+                response.raise_for_status()
+                if response.http_version == "HTTP/2":
+                    self.http2_responses += 1
+                async for line in response.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        break
+                    event = json.loads(data)
+                    if event.get("usage") and on_usage is not None:
+                        on_usage(event["usage"])
+                    for choice in event.get("choices") or ():
+                        content = (choice.get("delta") or {}).get("content")
+                        if content:
+                            yield content
+        except Exception:
+            self.errors += 1
+            raise
+
+    def stats(self) -> Dict[str, Any]:
+        reused = max(self.requests - self.new_connections, 0)
+        return {
+            "http2": self.http2,
+            "requests": self.requests,
+            "new_connections": self.new_connections,
+            "reused": reused,
+            "reuse_rate": round(reused / self.requests, 3) if self.requests else 0.0,
+            "http2_responses": self.http2_responses,
+            "errors": self.errors,
+        }
@@ -0,0 +1,60 @@
+"""Календарные периоды (день/неделя/месяц) как полуоткрытые диапазоны времени.
+
+Вместо `DATE(col) = :today` фильтруем `col >= :period_start AND col < :period_end`:
+условие по самому столбцу использует индексы `(user_id, created_at)` и
+подобные. Границы считаются в часовом поясе пользователя и переводятся
+в наивный UTC — так хранятся `created_at`/`completed_at` в таблицах.
+"""
+from datetime import datetime, timedelta
+from typing import Dict, NamedTuple, Optional
+
+import pytz
+
+PERIODS = ("day", "week", "month")
+
+
+class PeriodRange(NamedTuple):
+    start: datetime
+    end: datetime
+
+
+def _local_start(period: str, local_now: datetime) -> datetime:
+    day = local_now.replace(hour=0, minute=0, second=0, microsecond=0, tzinfo=None)
+    if period == "day":
+        return day
+    if period == "week":
+        return day - timedelta(days=day.weekday())
+    if period == "month":
+        return day.replace(day=1)
+    raise ValueError(f"Неизвестный период: {period}")
+
+
+def _local_next(period: str, start: datetime) -> datetime:
+    if period == "day":
+        return start + timedelta(days=1)
+    if period == "week":
+        return start + timedelta(weeks=1)
+    return (start + timedelta(days=32)).replace(day=1)
+
+
+def _to_naive_utc(tz: pytz.BaseTzInfo, local: datetime) -> datetime:
+    return tz.localize(local).astimezone(pytz.utc).replace(tzinfo=None)
+
+
+def period_bounds(period: str, tz: pytz.BaseTzInfo, now: Optional[datetime] = None) -> PeriodRange:
+    """Границы [start, end) текущего дня/недели/месяца в поясе `tz`, в наивном UTC"""
+    now = now or datetime.now(pytz.utc)
+    if now.tzinfo is None:
+        now = pytz.utc.localize(now)
+    start = _local_start(period, now.astimezone(tz))
+    return PeriodRange(_to_naive_utc(tz, start), _to_naive_utc(tz, _local_next(period, start)))
+
+
+def period_sql(column: str) -> str:
+    """Условие на полуоткрытый диапазон для параметров из `period_params`"""
+    return f"{column} >= :period_start AND {column} < :period_end"
+
+
+def period_params(period: str, tz: pytz.BaseTzInfo, now: Optional[datetime] = None) -> Dict[str, datetime]:
+    start, end = period_bounds(period, tz, now)
+    return {"period_start": start, "period_end": end}
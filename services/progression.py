@@ -0,0 +1,99 @@
+"""Уровни и опыт: настраиваемая кривая и атомарный level-up в SQL.
+
+Кривая задаётся списком «сколько XP нужно, чтобы пройти уровень N»;
+последний шаг повторяется до `max_level`. Та же кривая используется и в
+Python (`apply`, для read-your-writes), и в SQL (`progress_sql`), чтобы
+уровень пересчитывался внутри одного `UPDATE ... RETURNING`.
+"""
+from itertools import accumulate
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+DEFAULT_LEVEL_CURVE = (100,)
+DEFAULT_MAX_LEVEL = 100
+
+
+class LevelProgress(NamedTuple):
+    level: int
+    experience: int
+    next_level_xp: int  # Сколько XP нужно для перехода на следующий уровень
+    leveled_up: bool
+
+
+class LevelCurve:
+    """Таблица порогов опыта по уровням"""
+
+    def __init__(self, steps: Sequence[int] = DEFAULT_LEVEL_CURVE, max_level: int = DEFAULT_MAX_LEVEL) -> None:
+        if not steps or any(step <= 0 for step in steps):
+            raise ValueError("Шаги кривой уровней должны быть положительными")
+        if max_level < 1:
+            raise ValueError("Максимальный уровень должен быть не меньше 1")
+        self.steps = tuple(steps)
+        self.max_level = max_level
+        # thresholds[i] — суммарный опыт, с которого начинается уровень i + 1
+        self.thresholds: List[int] = [0, *accumulate(self.xp_for(lvl) for lvl in range(1, max_level))]
+
+    @classmethod
+    def from_string(cls, value: Optional[str], max_level: int = DEFAULT_MAX_LEVEL) -> "LevelCurve":
+        """Разобрать кривую вида "100,150,200" (пустая строка — 100 XP на уровень)"""
+        steps = [int(part) for part in (value or "").split(",") if part.strip()]
+        return cls(steps or DEFAULT_LEVEL_CURVE, max_level=max_level)
+
+    def xp_for(self, level: Optional[int]) -> int:
+        """Сколько опыта нужно, чтобы пройти уровень `level`"""
+        return self.steps[min(max(level or 1, 1), len(self.steps)) - 1]
+
+    def apply(self, level: int, experience: int, delta: int) -> Tuple[int, int]:
+        """Начислить опыт и пересчитать уровень (зеркало `progress_sql`)"""
+        level = min(max(level or 1, 1), self.max_level)
+        total = self.thresholds[level - 1] + (experience or 0) + delta
+        while level < self.max_level and total >= self.thresholds[level]:
+            level += 1
+        while level > 1 and total < self.thresholds[level - 1]:
+            level -= 1
+        return level, total - self.thresholds[level - 1]
+
+    def level_before(self, level: int, experience: int, delta: int) -> int:
+        """Уровень до начисления `delta`, восстановленный по результату `apply`"""
+        total = self.thresholds[min(max(level or 1, 1), self.max_level) - 1] + (experience or 0) - delta
+        return max(lvl for lvl, cum in enumerate(self.thresholds, start=1) if cum <= max(total, 0))
+
+    def progress(self, level: int, experience: int, old_level: Optional[int] = None) -> LevelProgress:
+        return LevelProgress(
+            level=level,
+            experience=experience,
+            next_level_xp=self.xp_for(level),
+            leveled_up=old_level is not None and level > old_level,
+        )
+
+    def cte_sql(self) -> str:
+        """CTE `level_curve(level, cum)` с порогами кривой"""
+        rows = ", ".join(f"({lvl}, {cum})" for lvl, cum in enumerate(self.thresholds, start=1))
+        return f"level_curve(level, cum) AS (VALUES {rows})"
+
+    def progress_sql(self, level_expr: str, experience_expr: str, delta_expr: str) -> str:
+        """Подзапрос, возвращающий новые (level, experience).
+
+        Ссылается на столбцы обновляемой строки, поэтому при конкурентных
+        обновлениях Postgres пересчитает его по свежей версии строки.
+        """
+        base_level = f"LEAST(GREATEST(COALESCE({level_expr}, 1), 1), {self.max_level})"
+        total = (
+            f"(SELECT b.cum FROM level_curve b WHERE b.level = {base_level})"
+            f" + COALESCE({experience_expr}, 0) + {delta_expr}"
+        )
+        return (
+            f"(SELECT c.level, {total} - c.cum FROM level_curve c"
+            f" WHERE c.cum <= GREATEST({total}, 0)"
+            f" ORDER BY c.level DESC LIMIT 1)"
+        )
+
+
+def add_experience_sql(curve: LevelCurve) -> str:
+    """Начислить `:exp` пользователю `:telegram_id` и вернуть новые (level, experience)"""
+    return f"""
+    WITH {curve.cte_sql()}
+    UPDATE user_stats AS s
+    SET (level, experience) = {curve.progress_sql("s.level", "s.experience", ":exp")}
+    WHERE s.user_id = :telegram_id
+    RETURNING s.level, s.experience
+"""
@@ -0,0 +1,123 @@
+"""Квоты на запросы к AI по фактическому расходу токенов.
+
+Счётчики лежат в `user_stats`: `daily_requests` считается в пределах
+суток, `total_requests` и `request_tokens` — в пределах окна тарифа
+(неделя для пробного периода, месяц для премиума). Рядом хранится начало
+окна, к которому относится значение; окна сбрасываются лениво: счётчик
+из прошлого окна читается как ноль, а при записи расхода обнуляется
+тем же атомарным UPDATE, который прибавляет новые значения. Отдельная
+задача сброса не нужна. Сутки и окна считаются в часовом поясе
+пользователя (`users.timezone`).
+"""
+from datetime import datetime
+from typing import Any, Mapping, NamedTuple, Optional, Tuple
+
+import pytz
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from services.delivery import user_timezone
+from services.periods import period_bounds
+from services.uow import session_scope
+from services.users import update_stats
+
+
+class QuotaLimits(NamedTuple):
+    window: str  # период services.periods для total_requests / request_tokens
+    window_requests: Optional[int]
+    daily_requests: Optional[int]
+    window_tokens: int
+    max_tokens: int  # потолок max_tokens в запросе к модели
+
+
+TIER_LIMITS = {
+    "trial": QuotaLimits(window="week", window_requests=22, daily_requests=None, window_tokens=11000, max_tokens=500),
+    "premium": QuotaLimits(window="month", window_requests=None, daily_requests=20, window_tokens=24000, max_tokens=800),
+}
+
+
+class Usage(NamedTuple):
+    daily_requests: int
+    window_requests: int
+    window_tokens: int
+
+
+def quota_windows(limits: QuotaLimits, tz: Any, now: Optional[datetime] = None) -> Tuple[datetime, datetime]:
+    """Начало текущих суток и текущего окна тарифа (aware UTC)"""
+    day_start = period_bounds("day", tz, now).start
+    window_start = period_bounds(limits.window, tz, now).start
+    return pytz.utc.localize(day_start), pytz.utc.localize(window_start)
+
+
+def current_usage(user: Mapping[str, Any], limits: QuotaLimits, tz: Any, now: Optional[datetime] = None) -> Usage:
+    """Расход в текущих окнах: значения из прошлых окон считаются нулём"""
+    day_start, window_start = quota_windows(limits, tz, now)
+    same_day = user.get("daily_window_start") == day_start
+    same_window = user.get("quota_window_start") == window_start
+    return Usage(
+        daily_requests=(user.get("daily_requests") or 0) if same_day else 0,
+        window_requests=(user.get("total_requests") or 0) if same_window else 0,
+        window_tokens=(user.get("request_tokens") or 0) if same_window else 0,
+    )
+
+
+def estimate_tokens(text: str) -> int:
+    """Грубая оценка токенов, если API не вернул usage (кириллица — ~3 символа на токен)"""
+    return (len(text) + 2) // 3
+
+
+def request_max_tokens(limits: QuotaLimits, usage: Usage) -> int:
+    """max_tokens для очередного запроса: потолок тарифа, но не больше остатка окна"""
+    return max(min(limits.max_tokens, limits.window_tokens - usage.window_tokens), 1)
+
+
+RECORD_USAGE_SQL = """
+    UPDATE user_stats SET
+        daily_requests = CASE WHEN daily_window_start IS DISTINCT FROM :day_start
+                              THEN 1 ELSE daily_requests + 1 END,
+        total_requests = CASE WHEN quota_window_start IS DISTINCT FROM :window_start
+                              THEN 1 ELSE total_requests + 1 END,
+        request_tokens = CASE WHEN quota_window_start IS DISTINCT FROM :window_start
+                              THEN :tokens ELSE request_tokens + :tokens END,
+        daily_window_start = :day_start,
+        quota_window_start = :window_start,
+        last_activity_at = NOW()
+    WHERE user_id = :user_id
+    RETURNING daily_requests, total_requests, request_tokens, daily_window_start, quota_window_start
+"""
+
+
+class QuotaService:
+    def __init__(self, session_factory: async_sessionmaker[AsyncSession]) -> None:
+        self._session_factory = session_factory
+
+    def limits(self, tier: str) -> QuotaLimits:
+        """Лимиты тарифа; без тарифа — самые строгие (пробный период)"""
+        return TIER_LIMITS.get(tier, TIER_LIMITS["trial"])
+
+    def usage(self, user: Mapping[str, Any], now: Optional[datetime] = None) -> Usage:
+        return current_usage(user, self.limits(user.get("user_type")), user_timezone(user.get("timezone")), now)
+
+    async def record(
+        self,
+        user_id: int,
+        tier: str,
+        prompt_tokens: int,
+        completion_tokens: int,
+        timezone: Optional[str] = None,
+        now: Optional[datetime] = None,
+    ) -> Optional[dict]:
+        """Учесть один запрос и его токены одним UPDATE; вернуть новые счётчики.
+
+        `timezone` — пояс пользователя (`users.timezone`), по нему считаются сутки и окно.
+        """
+        limits = self.limits(tier)
+        day_start, window_start = quota_windows(limits, user_timezone(timezone), now)
+        async with session_scope(self._session_factory) as session:
+            rows = await update_stats(session, text(RECORD_USAGE_SQL), {
+                "user_id": user_id,
+                "tokens": max(prompt_tokens, 0) + max(completion_tokens, 0),
+                "day_start": day_start,
+                "window_start": window_start,
+            }, user_id)
+        return dict(rows[0]._mapping) if rows else None
@@ -0,0 +1,146 @@
+"""Курс USD→RUB для оплаты криптовалютой.
+
+Курс обновляется в фоне раз в `refresh_interval` секунд через один общий
+`httpx.AsyncClient`, а обработчики читают его из памяти. Устаревший курс
+(старше `refresh_interval`) отдаётся сразу, а обновление запускается в
+фоне (stale-while-revalidate). Курс старше `max_age` не используется:
+делается одна попытка обновить его, иначе берётся запасной курс, и это
+фиксируется в статистике.
+"""
+import asyncio
+from datetime import datetime, timezone
+import logging
+import time
+from typing import Any, Callable, Dict, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+RATES_URL = "https://api.exchangerate-api.com/v4/latest/USD"
+
+
+class RateProvider:
+    """Кэшированный курс валюты с фоновым обновлением"""
+
+    def __init__(
+        self,
+        url: str = RATES_URL,
+        currency: str = "RUB",
+        fallback: float = 90.0,
+        refresh_interval: float = 600.0,
+        max_age: float = 3600.0,
+        timeout: float = 5.0,
+        client: Optional[httpx.AsyncClient] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.url = url
+        self.currency = currency
+        self.fallback = fallback
+        self.refresh_interval = refresh_interval
+        self.max_age = max_age
+        self.timeout = timeout
+        self._client = client
+        self._owns_client = client is None
+        self._clock = clock
+        self._rate: Optional[float] = None
+        self._fetched_at: Optional[float] = None
+        self._refreshing: Optional[asyncio.Task] = None
+        self._task: Optional[asyncio.Task] = None
+        self.refreshes = 0
+        self.failures = 0
+        self.fallbacks = 0
+        self.last_error: Optional[str] = None
+        self.last_fallback_at: Optional[datetime] = None
+
+    @property
+    def age(self) -> Optional[float]:
+        return None if self._fetched_at is None else self._clock() - self._fetched_at
+
+    async def start(self) -> None:
+        """Получить первый курс и запустить фоновое обновление"""
+        await self.refresh()
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        for task in (self._task, self._refreshing):
+            if task is not None and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._task = self._refreshing = None
+        if self._client is not None and self._owns_client:
+            await self._client.aclose()
+            self._client = None
+
+    async def get_rate(self) -> float:
+        """Курс без ожидания сети, пока он не старше `max_age`"""
+        age = self.age
+        if age is not None and age < self.max_age:
+            if age >= self.refresh_interval:
+                self._refresh_in_background()
+            return self._rate  # type: ignore[return-value]
+
+        # Курса нет или он слишком старый — одна попытка обновить
+        if await self.refresh():
+            return self._rate  # type: ignore[return-value]
+        self.fallbacks += 1
+        self.last_fallback_at = datetime.now(timezone.utc)
+        logger.warning(f"Курс {self.currency} недоступен, используется запасной {self.fallback}")
+        return self.fallback
+
+    async def refresh(self) -> bool:
+        """Обновить курс; параллельные вызовы ждут один и тот же запрос"""
+        return await asyncio.shield(self._refresh_in_background())
+
+    def _refresh_in_background(self) -> asyncio.Task:
+        if self._refreshing is None or self._refreshing.done():
+            self._refreshing = asyncio.get_running_loop().create_task(self._fetch())
+        return self._refreshing
+
+    def _get_client(self) -> httpx.AsyncClient:
+        """Один клиент с keep-alive на все запросы курса"""
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=2, max_keepalive_connections=1),
+            )
+            self._owns_client = True
+        return self._client
+
+    async def _fetch(self) -> bool:
+        try:
+            response = await self._get_client().get(self.url)
+            response.raise_for_status()
+            rate = float(response.json()["rates"][self.currency])
+            if rate <= 0:
+                raise ValueError(f"некорректный курс {rate}")
+        except Exception as e:
+            self.failures += 1
+            self.last_error = f"{type(e).__name__}: {e}"
+            logger.error(f"Ошибка обновления курса {self.currency}: {e}")
+            return False
+        self._rate = rate
+        self._fetched_at = self._clock()
+        self.refreshes += 1
+        return True
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            await self.refresh()
+
+    def stats(self) -> Dict[str, Any]:
+        age = self.age
+        return {
+            "rate": self._rate,
+            "age_s": None if age is None else round(age),
+            "refreshes": self.refreshes,
+            "failures": self.failures,
+            "fallbacks": self.fallbacks,
+            "last_fallback_at": self.last_fallback_at.isoformat() if self.last_fallback_at else None,
+            "last_error": self.last_error,
+        }
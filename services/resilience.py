@@ -0,0 +1,194 @@
+"""Повторы с экспоненциальной задержкой и автоматический выключатель.
+
+`Resilient.call` выполняет операцию, повторяя её при временных ошибках
+(429, 5xx, таймауты, обрывы соединения) с задержкой «full jitter» и с
+учётом заголовка `Retry-After`. Выключатель (`CircuitBreaker`) после
+`failure_threshold` подряд неудачных попыток размыкается и `reset_timeout`
+секунд сразу отказывает, не нагружая деградировавший сервис; затем
+пропускает одну пробную попытку и по её итогу замыкается или снова
+размыкается.
+"""
+import asyncio
+from collections import Counter
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+import logging
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, TypeVar
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+RETRYABLE_STATUSES = frozenset({408, 429, 500, 502, 503, 504})
+
+
+class CircuitOpen(Exception):
+    """Выключатель разомкнут — запрос не отправлялся"""
+
+
+def error_kind(exc: BaseException) -> str:
+    if isinstance(exc, httpx.HTTPStatusError):
+        status = exc.response.status_code
+        return "http_5xx" if status >= 500 else f"http_{status}"
+    if isinstance(exc, httpx.TimeoutException):
+        return "timeout"
+    if isinstance(exc, httpx.TransportError):
+        return "network"
+    return "other"
+
+
+def is_transient(exc: BaseException) -> bool:
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code in RETRYABLE_STATUSES
+    return isinstance(exc, (httpx.TimeoutException, httpx.TransportError))
+
+
+def retry_after(exc: BaseException) -> Optional[float]:
+    """Задержка из заголовка Retry-After (секунды или HTTP-дата)"""
+    if not isinstance(exc, httpx.HTTPStatusError):
+        return None
+    value = exc.response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max((parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker:
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self.trips = 0
+
+    @property
+    def state(self) -> str:
+        if self._state == self.OPEN and self._clock() - self._opened_at >= self.reset_timeout:
+            self._state = self.HALF_OPEN
+        return self._state
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.HALF_OPEN and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self._state = self.CLOSED
+        self._failures = 0
+        self._probe_in_flight = False
+
+    def record_ignored(self) -> None:
+        self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+            if self._state != self.OPEN:
+                self.trips += 1
+                logger.warning(f"Выключатель разомкнут на {self.reset_timeout:.0f} с после {self._failures} ошибок подряд")
+            self._state = self.OPEN
+            self._opened_at = self._clock()
+        self._probe_in_flight = False
+
+
+class Resilient:
+    """Повторы и выключатель вокруг одного внешнего сервиса"""
+
+    def __init__(
+        self,
+        breaker: Optional[CircuitBreaker] = None,
+        attempts: int = 3,
+        base_delay: float = 0.5,
+        max_delay: float = 8.0,
+        max_retry_after: float = 20.0,
+        sleep: Callable[[float], Awaitable[Any]] = asyncio.sleep,
+    ) -> None:
+        self.breaker = breaker or CircuitBreaker()
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+        self._sleep = sleep
+        self.outcomes: Counter = Counter()
+
+    def backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    async def call(
+        self,
+        operation: Callable[[], Awaitable[T]],
+        can_retry: Callable[[], bool] = lambda: True,
+    ) -> T:
+        """Выполнить `operation`; `can_retry` запрещает повтор (например, после начала потока)"""
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                self.outcomes["short_circuited"] += 1
+                raise CircuitOpen("сервис временно недоступен")
+            try:
+                result = await operation()
+            except asyncio.CancelledError:
+                self.breaker.record_ignored()
+                raise
+            except Exception as e:
+                transient = is_transient(e)
+                self.outcomes[error_kind(e)] += 1
+                if transient:
+                    self.breaker.record_failure()
+                else:
+                    # Ошибка запроса, а не сервиса — на выключатель не влияет
+                    self.breaker.record_ignored()
+                delay = self._retry_delay(e, attempt)
+                if not transient or delay is None or attempt + 1 >= self.attempts or not can_retry():
+                    self.outcomes["failure"] += 1
+                    raise
+                self.outcomes["retry"] += 1
+                logger.warning(f"Временная ошибка ({error_kind(e)}), повтор через {delay:.1f} с")
+                await self._sleep(delay)
+                attempt += 1
+                continue
+            self.breaker.record_success()
+            self.outcomes["success" if attempt == 0 else "success_after_retry"] += 1
+            return result
+
+    def _retry_delay(self, exc: BaseException, attempt: int) -> Optional[float]:
+        """Задержка перед повтором; None — ждать дольше допустимого нет смысла"""
+        delay = self.backoff(attempt)
+        server_delay = retry_after(exc)
+        if server_delay is not None:
+            if server_delay > self.max_retry_after:
+                return None
+            delay = max(delay, server_delay)
+        return delay
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "breaker": self.breaker.state,
+            "trips": self.breaker.trips,
+            **dict(sorted(self.outcomes.items())),
+        }
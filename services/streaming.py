@@ -0,0 +1,105 @@
+"""Постепенный вывод ответа AI правкой сообщения-заглушки.
+
+`StreamingMessage` получает куски текста по мере генерации и правит
+сообщение не чаще раза в `min_interval` секунд (лимит Telegram на правки
+в одном чате). Первый кусок показывается сразу. Текст длиннее 4096
+символов продолжается в новых сообщениях; точка разреза выбирается по
+уже пришедшему тексту и не сдвигается по мере роста ответа.
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Callable, List, Optional
+
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.types import Message
+
+logger = logging.getLogger(__name__)
+
+MAX_MESSAGE_LENGTH = 4096
+
+
+def split_message(text: str, limit: int = MAX_MESSAGE_LENGTH) -> List[str]:
+    """Части не длиннее `limit`, разрез по переводу строки или пробелу, если он есть"""
+    chunks = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit + 1)
+        if cut <= 0:
+            cut = text.rfind(" ", 0, limit + 1)
+        if cut <= 0:
+            cut = limit
+        chunks.append(text[:cut])
+        text = text[cut:].lstrip("\n ")
+    chunks.append(text)
+    return chunks
+
+
+class StreamingMessage:
+    """Рендерер потокового ответа поверх сообщения `placeholder`"""
+
+    def __init__(
+        self,
+        placeholder: Message,
+        header: str = "",
+        min_interval: float = 1.0,
+        limit: int = MAX_MESSAGE_LENGTH,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.header = header
+        self.min_interval = min_interval
+        self.limit = limit
+        self._clock = clock
+        self._messages: List[Message] = [placeholder]
+        self._rendered: List[Optional[str]] = [None]
+        self._text = ""
+        self._next_edit_at = 0.0
+        self.edits = 0
+
+    @property
+    def text(self) -> str:
+        return self._text
+
+    async def feed(self, delta: str) -> None:
+        """Добавить кусок ответа; сообщение обновится, если прошёл интервал"""
+        self._text += delta
+        if self._clock() >= self._next_edit_at:
+            await self._render()
+
+    async def finish(self, text: Optional[str] = None, reply_markup: Any = None) -> None:
+        """Показать окончательный текст, дождавшись лимита Telegram при необходимости"""
+        if text is not None:
+            self._text = text
+        for _ in range(3):
+            try:
+                await self._render(reply_markup=reply_markup, final=True)
+                return
+            except TelegramRetryAfter as e:
+                await asyncio.sleep(e.retry_after)
+
+    async def _render(self, reply_markup: Any = None, final: bool = False) -> None:
+        chunks = split_message(self.header + self._text, self.limit)
+        try:
+            for i, chunk in enumerate(chunks):
+                markup = reply_markup if final and i == len(chunks) - 1 else None
+                if i < len(self._messages):
+                    if chunk != self._rendered[i] or markup is not None:
+                        await self._edit(i, chunk, markup)
+                else:
+                    self._messages.append(await self._messages[-1].answer(chunk, parse_mode=None, reply_markup=markup))
+                    self._rendered.append(chunk)
+        except TelegramRetryAfter as e:
+            self._next_edit_at = self._clock() + e.retry_after
+            if final:
+                raise
+            return
+        self._next_edit_at = self._clock() + self.min_interval
+
+    async def _edit(self, index: int, chunk: str, reply_markup: Any) -> None:
+        try:
+            await self._messages[index].edit_text(chunk, parse_mode=None, reply_markup=reply_markup)
+        except TelegramBadRequest as e:
+            # Текст не изменился — не ошибка; остальное логируем и продолжаем
+            if "message is not modified" not in str(e):
+                logger.error(f"Ошибка правки сообщения с ответом AI: {e}")
+        self._rendered[index] = chunk
+        self.edits += 1
@@ -0,0 +1,192 @@
+"""Unit of work: одна сессия и одна транзакция на апдейт Telegram.
+
+`UnitOfWorkMiddleware` открывает `UnitOfWork` на время обработки апдейта,
+а хелперы берут сессию через `session_scope()`: внутри апдейта все они
+работают в одной транзакции на одном соединении, которая коммитится
+в конце (или откатывается целиком при ошибке). Вне апдейта (cron,
+фоновые задачи) `session_scope()` открывает отдельную транзакцию.
+
+Ошибка в хелпере откатывает транзакцию и помечает `UnitOfWork` сбойным:
+даже если хелпер проглотил исключение, следующие запросы апдейта падают
+с `UnitOfWorkFailed`, а не коммитят половину сценария в новой транзакции.
+
+Соединение берётся из пула лениво — при первом запросе — и отпускается
+коммитом. `ReleaseConnectionRequestMiddleware` коммитит перед каждым
+запросом к Bot API, чтобы не держать соединение idle in transaction
+на время сетевого ожидания; атомарен шаг между двумя запросами к Telegram.
+Перед другими долгими ожиданиями (OpenAI) обработчик вызывает
+`release_connection()` сам.
+"""
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+import logging
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import Response, TelegramMethod
+from aiogram.types import TelegramObject
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+logger = logging.getLogger(__name__)
+
+Hook = Callable[[], None]
+
+
+class UnitOfWorkFailed(RuntimeError):
+    """Транзакция апдейта уже откатана ошибкой — продолжать работу с БД нельзя"""
+
+
+class UnitOfWork:
+    """Ленивая сессия апдейта с хуками после коммита и отката"""
+
+    def __init__(self, session_factory: async_sessionmaker[AsyncSession]) -> None:
+        self._session_factory = session_factory
+        self._session: Optional[AsyncSession] = None
+        self._after_commit: List[Hook] = []
+        self._after_rollback: List[Hook] = []
+        self.transactions = 0
+        self.failed = False
+
+    @property
+    def active(self) -> bool:
+        return self._session is not None
+
+    def session(self) -> AsyncSession:
+        if self.failed:
+            raise UnitOfWorkFailed("Транзакция апдейта откатана после ошибки")
+        if self._session is None:
+            self._session = self._session_factory()
+            self.transactions += 1
+        return self._session
+
+    def after_commit(self, hook: Hook) -> None:
+        if not self.failed:
+            self._after_commit.append(hook)
+
+    def after_rollback(self, hook: Hook) -> None:
+        """Хук на любой откат в рамках апдейта (не снимается после коммита)"""
+        self._after_rollback.append(hook)
+
+    async def commit(self) -> None:
+        """Закоммитить и вернуть соединение в пул (сессия переоткроется лениво)"""
+        if self.failed:
+            raise UnitOfWorkFailed("Транзакция апдейта откатана после ошибки")
+        session, self._session = self._session, None
+        if session is not None:
+            try:
+                await session.commit()
+            except BaseException:
+                self._after_commit.clear()
+                self._run(self._after_rollback)
+                raise
+            finally:
+                await session.close()
+        hooks, self._after_commit = self._after_commit, []
+        self._run(hooks)
+
+    async def rollback(self) -> None:
+        """Откатить транзакцию; после этого UnitOfWork считается сбойным"""
+        self.failed = True
+        session, self._session = self._session, None
+        if session is not None:
+            try:
+                await session.rollback()
+            finally:
+                await session.close()
+        self._after_commit.clear()
+        self._run(self._after_rollback)
+
+    @staticmethod
+    def _run(hooks: List[Hook]) -> None:
+        for hook in list(hooks):
+            try:
+                hook()
+            except Exception as e:
+                logger.error(f"Ошибка в хуке unit of work: {e}")
+
+
+_current_uow: ContextVar[Optional[UnitOfWork]] = ContextVar("unit_of_work", default=None)
+
+
+def current_unit_of_work() -> Optional[UnitOfWork]:
+    return _current_uow.get()
+
+
+@asynccontextmanager
+async def session_scope(session_factory: async_sessionmaker[AsyncSession]) -> AsyncIterator[AsyncSession]:
+    """Сессия текущего апдейта или отдельная транзакция вне апдейта.
+
+    Ошибка внутри общей транзакции откатывает её целиком, и до конца
+    апдейта БД недоступна (`UnitOfWorkFailed`): многошаговый сценарий
+    либо применяется полностью, либо не применяется.
+    """
+    uow = _current_uow.get()
+    if uow is None:
+        async with session_factory.begin() as session:
+            yield session
+        return
+
+    try:
+        yield uow.session()
+    except BaseException:
+        await uow.rollback()
+        raise
+
+
+def after_commit(hook: Hook) -> None:
+    """Выполнить `hook` после коммита транзакции апдейта (вне апдейта — сразу)"""
+    uow = _current_uow.get()
+    if uow is None:
+        hook()
+    else:
+        uow.after_commit(hook)
+
+
+async def release_connection() -> None:
+    """Закоммитить сделанное и отпустить соединение перед долгим ожиданием"""
+    uow = _current_uow.get()
+    if uow is not None and uow.active:
+        await uow.commit()
+
+
+class ReleaseConnectionRequestMiddleware(BaseRequestMiddleware):
+    """Request-middleware бота: коммит транзакции апдейта перед запросом к Bot API"""
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[Any],
+        bot: Bot,
+        method: TelegramMethod[Any],
+    ) -> Response[Any]:
+        await release_connection()
+        return await make_request(bot, method)
+
+
+class UnitOfWorkMiddleware(BaseMiddleware):
+    """Outer-middleware: транзакция на апдейт, коммит после обработчика"""
+
+    def __init__(self, session_factory: async_sessionmaker[AsyncSession]) -> None:
+        self._session_factory = session_factory
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        uow = UnitOfWork(self._session_factory)
+        token = _current_uow.set(uow)
+        try:
+            result = await handler(event, data)
+        except BaseException:
+            await uow.rollback()
+            raise
+        else:
+            if uow.failed:
+                # Ошибку хелпер уже обработал; откатывать больше нечего
+                return result
+            await uow.commit()
+            return result
+        finally:
+            _current_uow.reset(token)
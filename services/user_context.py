@@ -0,0 +1,115 @@
+"""Контекст пользователя в рамках одного апдейта Telegram.
+
+Middleware загружает строку `users` один раз на апдейт и кладёт её в
+`data["user"]`, а хелперы (`get_user`, `update_user`, `add_hearts`, ...)
+через `current_user_context()` переиспользуют и патчат ту же запись
+вместо повторного `SELECT * FROM users`.
+"""
+from contextvars import ContextVar
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+from sqlalchemy.sql.expression import ClauseElement
+
+from services.uow import current_unit_of_work
+from services.users import UserRecord
+
+logger = logging.getLogger(__name__)
+
+UserLoader = Callable[[int], Awaitable[Optional[UserRecord]]]
+
+
+class RequestUserContext:
+    """Запись пользователя, загруженная в рамках текущего апдейта"""
+
+    __slots__ = ("telegram_id", "user", "loaded", "queries")
+
+    def __init__(self, telegram_id: int) -> None:
+        self.telegram_id = telegram_id
+        self.user: Optional[UserRecord] = None
+        self.loaded = False
+        self.queries = 0  # Сколько раз строка читалась из БД за апдейт
+
+    def set(self, user: Optional[UserRecord]) -> None:
+        """Запомнить свежепрочитанную запись"""
+        self.user = user
+        self.loaded = True
+        self.queries += 1
+
+    def patch(self, **values: Any) -> None:
+        """Применить изменения, уже записанные в БД"""
+        if self.user is None:
+            return
+        # SQL-выражения (например, `users.c.hearts + 1`) посчитать локально
+        # нельзя — в этом случае просто перечитаем строку при следующем запросе
+        if any(isinstance(value, ClauseElement) for value in values.values()):
+            self.invalidate()
+            return
+        self.user.update(values)
+
+    def increment(self, field: str, amount: int) -> None:
+        """Увеличить числовое поле записи на `amount`"""
+        if self.user is None:
+            return
+        self.user[field] = (self.user.get(field) or 0) + amount
+
+    def invalidate(self) -> None:
+        """Сбросить запись — следующий `get_user` пойдёт в БД"""
+        self.user = None
+        self.loaded = False
+
+
+_current_context: ContextVar[Optional[RequestUserContext]] = ContextVar(
+    "request_user_context", default=None
+)
+
+
+def current_user_context(telegram_id: Optional[int] = None) -> Optional[RequestUserContext]:
+    """Вернуть контекст текущего апдейта (только если он про `telegram_id`)"""
+    ctx = _current_context.get()
+    if ctx is None:
+        return None
+    if telegram_id is not None and ctx.telegram_id != telegram_id:
+        return None
+    return ctx
+
+
+class RequestUserMiddleware(BaseMiddleware):
+    """Outer-middleware: одна загрузка пользователя на апдейт.
+
+    Регистрируется на `dp.update` после встроенного middleware aiogram,
+    который кладёт в `data["event_from_user"]` автора апдейта.
+    """
+
+    def __init__(self, loader: UserLoader) -> None:
+        self._loader = loader
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        from_user = data.get("event_from_user")
+        if from_user is None:
+            return await handler(event, data)
+
+        ctx = RequestUserContext(from_user.id)
+        uow = current_unit_of_work()
+        if uow is not None:
+            # Откат транзакции апдейта отменяет и локальные патчи записи
+            uow.after_rollback(ctx.invalidate)
+        token = _current_context.set(ctx)
+        try:
+            ctx.set(await self._loader(from_user.id))
+            data["user_ctx"] = ctx
+            data["user"] = ctx.user
+            return await handler(event, data)
+        finally:
+            _current_context.reset(token)
+            if ctx.queries > 1:
+                logger.debug(
+                    f"Пользователь {ctx.telegram_id} прочитан {ctx.queries} раз(а) за апдейт"
+                )
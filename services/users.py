@@ -0,0 +1,376 @@
+"""Компактная запись пользователя и проекции столбцов `users`.
+
+Вместо `SELECT *` (28+ столбцов, включая `diary_password`) и `dict(mapping)`
+на каждый запрос читаем только нужный набор столбцов и собираем
+`UserRecord` со `__slots__`. Запись поддерживает словарный доступ
+(`user["hearts"]`, `user.get(...)`), поэтому обработчики не меняются.
+"""
+import asyncio
+from typing import Any, AsyncIterator, Dict, Iterator, List, Mapping, Optional, Sequence, Tuple
+
+from sqlalchemy import Row, text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy.sql import Executable
+
+# Все столбцы, которые может нести запись (пароль дневника — никогда)
+USER_FIELDS: Tuple[str, ...] = (
+    "id",
+    "telegram_id",
+    "full_name",
+    "username",
+    "gender",
+    "name",
+    "hearts",
+    "is_premium",
+    "user_type",
+    "is_admin",
+    "trial_started_at",
+    "subscription_expires_at",
+    "created_at",
+    "last_activity_at",
+    "daily_requests",
+    "total_requests",
+    "request_tokens",
+    "daily_window_start",
+    "quota_window_start",
+    "is_banned",
+    "last_diary_reward",
+    "referral_code",
+    "referrer_id",
+    "referrals_count",
+    "last_referral_date",
+    "level",
+    "experience",
+    "premium_purchases",
+    "timezone",
+)
+
+# Часто изменяемые счётчики живут в узкой таблице `user_stats`
+# (ключ `user_id` = users.telegram_id), остальное — в `users`
+STATS_FIELDS: Tuple[str, ...] = (
+    "hearts",
+    "level",
+    "experience",
+    "daily_requests",
+    "total_requests",
+    "request_tokens",
+    "daily_window_start",
+    "quota_window_start",
+    "last_activity_at",
+)
+
+# Значения счётчиков, если строки user_stats ещё нет (совпадают с DEFAULT столбцов)
+STATS_DEFAULTS: Dict[str, str] = {
+    "hearts": "10",
+    "level": "1",
+    "experience": "0",
+    "daily_requests": "0",
+    "total_requests": "0",
+    "request_tokens": "0",
+}
+
+_MISSING = object()
+
+# Размер порции для `= ANY(:values)` и постраничного обхода
+FETCH_CHUNK = 1000
+
+# Получатели рассылок; условие совпадает с частичным индексом ix_users_reachable_telegram_id
+REACHABLE_WHERE = "is_banned = false AND unreachable_at IS NULL"
+
+MARK_UNREACHABLE_SQL = """
+    UPDATE users AS u SET unreachable_at = NOW(), unreachable_reason = v.reason
+    FROM unnest(CAST(:telegram_ids AS BIGINT[]), CAST(:reasons AS VARCHAR[])) AS v(telegram_id, reason)
+    WHERE u.telegram_id = v.telegram_id AND u.unreachable_at IS NULL
+"""
+
+# Строка счётчиков создаётся лениво, при первой записи (см. update_stats)
+ENSURE_STATS_SQL = """
+    INSERT INTO user_stats (user_id)
+    SELECT telegram_id FROM users WHERE telegram_id = ANY(CAST(:user_ids AS BIGINT[]))
+    ON CONFLICT (user_id) DO NOTHING
+"""
+
+MARK_REACHABLE_SQL = """
+    UPDATE users SET unreachable_at = NULL, unreachable_reason = NULL
+    WHERE telegram_id = :telegram_id AND unreachable_at IS NOT NULL
+"""
+
+
+class UserRecord:
+    """Запись пользователя: только прочитанные столбцы, без словаря на экземпляр"""
+
+    __slots__ = USER_FIELDS
+
+    def __init__(self, **values: Any) -> None:
+        for name, value in values.items():
+            setattr(self, name, value)
+
+    @classmethod
+    def from_row(cls, columns: Sequence[str], row: Sequence[Any]) -> "UserRecord":
+        record = cls.__new__(cls)
+        for name, value in zip(columns, row):
+            setattr(record, name, value)
+        return record
+
+    def __getitem__(self, key: str) -> Any:
+        value = getattr(self, key, _MISSING) if key in USER_FIELDS else _MISSING
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        setattr(self, key, value)
+
+    def __contains__(self, key: object) -> bool:
+        return key in USER_FIELDS and hasattr(self, key)  # type: ignore[arg-type]
+
+    def get(self, key: str, default: Any = None) -> Any:
+        if key not in USER_FIELDS:
+            return default
+        return getattr(self, key, default)
+
+    def update(self, values: Mapping[str, Any]) -> None:
+        """Применить изменения; столбцы вне записи (например, пароль) пропускаются"""
+        for key, value in values.items():
+            if key in USER_FIELDS:
+                setattr(self, key, value)
+
+    def keys(self) -> Iterator[str]:
+        return (name for name in USER_FIELDS if hasattr(self, name))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.keys()}
+
+    def copy(self) -> "UserRecord":
+        return UserRecord(**self.to_dict())
+
+    def __repr__(self) -> str:
+        return f"UserRecord({self.to_dict()!r})"
+
+
+# Проекции под сценарии. CONTEXT грузится middleware один раз на апдейт
+# и покрывает все обработчики; остальные — для точечных запросов.
+PROFILE_COLUMNS = (
+    "telegram_id", "name", "level", "experience", "hearts", "user_type",
+    "subscription_expires_at", "daily_requests", "total_requests",
+    "request_tokens", "daily_window_start", "quota_window_start",
+    "created_at", "is_admin", "timezone",
+)
+ENTITLEMENT_COLUMNS = (
+    "telegram_id", "is_banned", "is_admin", "is_premium", "user_type",
+    "trial_started_at", "subscription_expires_at", "daily_requests",
+    "total_requests", "request_tokens", "daily_window_start", "quota_window_start",
+    "timezone",
+)
+BALANCE_COLUMNS = ("telegram_id", "hearts", "level", "experience")
+ADMIN_COLUMNS = (
+    "telegram_id", "name", "username", "created_at", "hearts", "is_premium",
+    "level", "last_activity_at", "is_banned",
+)
+CONTEXT_COLUMNS = tuple(
+    dict.fromkeys(PROFILE_COLUMNS + ENTITLEMENT_COLUMNS + BALANCE_COLUMNS + (
+        "gender", "last_diary_reward", "referral_code", "referrals_count",
+    ))
+)
+
+
+def select_users_sql(columns: Sequence[str], where: str) -> str:
+    """SELECT нужных столбцов пользователя с условием `where`.
+
+    Счётчики подтягиваются из `user_stats` только если они запрошены.
+    LEFT JOIN: пользователь без строки счётчиков не пропадает из выборки,
+    а получает значения по умолчанию. В `where` доступны столбцы `users`
+    без префикса.
+    """
+    select = ", ".join(_select_column(name) for name in columns)
+    source = "users u"
+    if any(name in STATS_FIELDS for name in columns):
+        source += " LEFT JOIN user_stats s ON s.user_id = u.telegram_id"
+    return f"SELECT {select} FROM {source} WHERE {where}"
+
+
+def _select_column(name: str) -> str:
+    if name not in STATS_FIELDS:
+        return f"u.{name}"
+    if name in STATS_DEFAULTS:
+        return f"COALESCE(s.{name}, {STATS_DEFAULTS[name]}) AS {name}"
+    return f"s.{name}"
+
+
+async def fetch_user_record(
+    session: AsyncSession,
+    telegram_id: int,
+    columns: Sequence[str] = CONTEXT_COLUMNS,
+) -> Optional[UserRecord]:
+    """Прочитать проекцию пользователя по telegram_id"""
+    result = await session.execute(
+        text(select_users_sql(columns, "telegram_id = :telegram_id")),
+        {"telegram_id": telegram_id},
+    )
+    row = result.first()
+    return UserRecord.from_row(columns, row) if row else None
+
+
+async def ensure_stats(session: AsyncSession, user_ids: Sequence[int]) -> None:
+    """Создать строки `user_stats` со значениями по умолчанию тем, у кого их нет"""
+    await session.execute(text(ENSURE_STATS_SQL), {"user_ids": list(user_ids)})
+
+
+async def update_stats(
+    session: AsyncSession,
+    statement: Executable,
+    params: Optional[Mapping[str, Any]],
+    user_id: int,
+) -> List[Row]:
+    """UPDATE счётчиков одного пользователя с RETURNING, вернуть строки результата.
+
+    Если строки `user_stats` ещё нет и UPDATE ничего не нашёл, она
+    создаётся со значениями по умолчанию, и UPDATE повторяется.
+    """
+    rows = (await session.execute(statement, params)).all()
+    if not rows:
+        await ensure_stats(session, [user_id])
+        rows = (await session.execute(statement, params)).all()
+    return rows
+
+
+async def fetch_diary_password(session: AsyncSession, telegram_id: int) -> Optional[str]:
+    """Пароль дневника читается отдельно и никогда не попадает в запись"""
+    result = await session.execute(
+        text("SELECT diary_password FROM users WHERE telegram_id = :telegram_id"),
+        {"telegram_id": telegram_id},
+    )
+    return result.scalar()
+
+
+async def mark_unreachable(session: AsyncSession, recipients: Sequence[Tuple[int, str]]) -> int:
+    """Исключить из рассылок пользователей, которым доставка невозможна (пары telegram_id, причина)"""
+    if not recipients:
+        return 0
+    telegram_ids, reasons = zip(*recipients)
+    result = await session.execute(
+        text(MARK_UNREACHABLE_SQL), {"telegram_ids": list(telegram_ids), "reasons": list(reasons)}
+    )
+    return result.rowcount
+
+
+async def mark_reachable(session: AsyncSession, telegram_id: int) -> bool:
+    """Вернуть пользователя в рассылки; без записи, если он и так доступен"""
+    result = await session.execute(text(MARK_REACHABLE_SQL), {"telegram_id": telegram_id})
+    return result.rowcount > 0
+
+
+async def fetch_user_record_by_username(
+    session: AsyncSession,
+    username: str,
+    columns: Sequence[str] = CONTEXT_COLUMNS,
+) -> Optional[UserRecord]:
+    """Прочитать проекцию пользователя по username"""
+    result = await session.execute(
+        text(select_users_sql(columns, "username = :username")),
+        {"username": username},
+    )
+    row = result.first()
+    return UserRecord.from_row(columns, row) if row else None
+
+
+async def fetch_user_records(
+    session: AsyncSession,
+    values: Sequence[Any],
+    columns: Sequence[str] = CONTEXT_COLUMNS,
+    key: str = "telegram_id",
+    chunk_size: int = FETCH_CHUNK,
+) -> List[UserRecord]:
+    """Пачка записей по списку значений `key`: один запрос `= ANY(:values)` на порцию"""
+    values = list(dict.fromkeys(values))
+    sql = text(select_users_sql(columns, f"{key} = ANY(:values)"))
+    records: List[UserRecord] = []
+    for i in range(0, len(values), chunk_size):
+        result = await session.execute(sql, {"values": values[i:i + chunk_size]})
+        records.extend(UserRecord.from_row(columns, row) for row in result)
+    return records
+
+
+def keyset_page_sql(columns: Sequence[str], where: str) -> str:
+    """Страница пользователей по условию после `:after` по telegram_id, не больше `:limit`"""
+    return select_users_sql(columns, f"({where}) AND telegram_id > :after") + " ORDER BY telegram_id LIMIT :limit"
+
+
+async def _keyset_pages(
+    session_factory: async_sessionmaker[AsyncSession],
+    columns: Sequence[str],
+    where: str,
+    params: Optional[Mapping[str, Any]],
+    batch_size: int,
+    after: Optional[int] = None,
+) -> AsyncIterator[list]:
+    """Строки пользователей страницами по telegram_id (первый столбец `columns`).
+
+    Каждая страница — в своей транзакции даже внутри апдейта: страницы
+    читает фоновая задача параллельно с обработчиком.
+    """
+    sql = text(keyset_page_sql(columns, where))
+    if after is None:
+        after = -(2 ** 63)
+    while True:
+        async with session_factory.begin() as session:
+            result = await session.execute(sql, {**(params or {}), "after": after, "limit": batch_size})
+            batch = result.all()
+        if batch:
+            yield batch
+        if len(batch) < batch_size:
+            return
+        after = batch[-1][0]
+
+
+async def _prefetch(pages: AsyncIterator[list], prefetch: int) -> AsyncIterator[list]:
+    """Страницы из `pages`; следующая читается в фоне, пока разбирают текущую.
+
+    В памяти не больше `prefetch` готовых страниц: если потребитель
+    отстаёт, чтение ждёт.
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=max(prefetch, 1))
+
+    async def produce() -> None:
+        try:
+            async for page in pages:
+                await queue.put(page)
+        except Exception as e:
+            await queue.put(e)
+        else:
+            await queue.put(None)
+
+    producer = asyncio.get_running_loop().create_task(produce())
+    try:
+        while True:
+            page = await queue.get()
+            if page is None:
+                return
+            if isinstance(page, Exception):
+                raise page
+            yield page
+    finally:
+        # Потребитель мог остановиться раньше — не оставляем чтение висеть
+        producer.cancel()
+
+
+async def iter_user_records(
+    session_factory: async_sessionmaker[AsyncSession],
+    columns: Sequence[str] = ("telegram_id",),
+    where: str = REACHABLE_WHERE,
+    params: Optional[Mapping[str, Any]] = None,
+    batch_size: int = FETCH_CHUNK,
+    prefetch: int = 2,
+    after: Optional[int] = None,
+) -> AsyncIterator[UserRecord]:
+    """Записи пользователей по условию потоком, страницами по telegram_id (keyset).
+
+    Каждая страница читается отдельным коротким запросом, следующая — в фоне,
+    пока потребитель (рассылка) разбирает текущую, так что на границе страниц
+    отправка не стоит. `after` — продолжить с telegram_id больше данного.
+    """
+    columns = ("telegram_id", *(name for name in columns if name != "telegram_id"))
+    pages = _keyset_pages(session_factory, columns, where, params, batch_size, after=after)
+    async for page in _prefetch(pages, prefetch):
+        for row in page:
+            yield UserRecord.from_row(columns, row)
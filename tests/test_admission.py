@@ -0,0 +1,67 @@
+import asyncio
+
+import pytest
+
+from services.admission import AdmissionController, AdmissionRejected
+
+
+def test_premium_waiters_are_admitted_before_trial():
+    async def scenario():
+        controller = AdmissionController(max_concurrent=1, max_queue=10)
+        order = []
+
+        async def request(tier, name):
+            async with controller.admit(tier):
+                order.append(name)
+                await asyncio.sleep(0)
+
+        await controller.acquire("trial")
+        tasks = [
+            asyncio.create_task(request("trial", "trial-1")),
+            asyncio.create_task(request("trial", "trial-2")),
+            asyncio.create_task(request("premium", "premium")),
+        ]
+        await asyncio.sleep(0)
+        assert controller.queued == 3
+        controller.release()
+        await asyncio.gather(*tasks)
+        assert order == ["premium", "trial-1", "trial-2"]
+        assert controller.active == 0
+
+    asyncio.run(scenario())
+
+
+def test_full_queue_rejects_fast_and_premium_displaces_trial():
+    async def scenario():
+        controller = AdmissionController(max_concurrent=1, max_queue=1)
+        await controller.acquire("premium")
+        waiting_trial = asyncio.create_task(controller.acquire("trial"))
+        await asyncio.sleep(0)
+
+        with pytest.raises(AdmissionRejected):
+            await controller.acquire("trial")
+
+        waiting_premium = asyncio.create_task(controller.acquire("premium"))
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected):
+            await waiting_trial
+
+        controller.release()
+        await waiting_premium
+        stats = controller.stats()
+        assert stats["trial"]["rejected"] == 2
+        assert stats["premium"]["admitted"] == 2
+
+    asyncio.run(scenario())
+
+
+def test_queue_wait_is_bounded():
+    async def scenario():
+        controller = AdmissionController(max_concurrent=1, max_wait=0.01)
+        await controller.acquire("premium")
+        with pytest.raises(AdmissionRejected):
+            await controller.acquire("trial")
+        controller.release()
+        assert controller.active == 0
+
+    asyncio.run(scenario())
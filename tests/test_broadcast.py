@@ -0,0 +1,93 @@
+import asyncio
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+from services.broadcast import Broadcaster, TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    async def sleep(self, seconds):
+        self.now += seconds
+        await asyncio.sleep(0)
+
+
+class FakeBot:
+    def __init__(self, clock, blocked=(), flood_at=None):
+        self.clock = clock
+        self.blocked = set(blocked)
+        self.flood_at = flood_at
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        method = SendMessage(chat_id=chat_id, text=text)
+        if chat_id in self.blocked:
+            raise TelegramForbiddenError(method, "Forbidden: bot was blocked by the user")
+        if chat_id == self.flood_at:
+            self.flood_at = None
+            raise TelegramRetryAfter(method, "Flood control exceeded", 5)
+        self.sent.append((self.clock(), chat_id))
+
+
+async def recipients(count):
+    for chat_id in range(count):
+        yield chat_id
+
+
+def test_broadcast_respects_rate_limit_and_counts_outcomes():
+    async def scenario():
+        clock = FakeClock()
+        bot = FakeBot(clock, blocked={3, 7}, flood_at=50)
+        bucket = TokenBucket(rate=10, clock=clock, sleep=clock.sleep)
+        broadcaster = Broadcaster(bot, workers=5, bucket=bucket)
+
+        result = await broadcaster.run("test", recipients(100), "привет")
+        assert (result.sent, result.blocked, result.failed, result.retries) == (98, 2, 0, 1)
+        assert sorted(chat_id for _, chat_id in bot.sent) == [i for i in range(100) if i not in (3, 7)]
+
+        # Не больше rate сообщений в секунду (плюс стартовый всплеск) и пауза по RetryAfter
+        times = [t for t, _ in bot.sent]
+        assert times[-1] >= (100 - 10) / 10 + 5
+        assert broadcaster.stats()["test"]["sent"] == 98
+
+    asyncio.run(scenario())
+
+
+def test_unreachable_recipients_are_reported_in_batches():
+    async def scenario():
+        method = SendMessage(chat_id=1, text="привет")
+        errors = {
+            2: TelegramForbiddenError(method, "Forbidden: bot was blocked by the user"),
+            4: TelegramForbiddenError(method, "Forbidden: user is deactivated"),
+            6: TelegramBadRequest(method, "Bad Request: chat not found"),
+            8: TelegramBadRequest(method, "Bad Request: message is too long"),
+        }
+
+        class Bot:
+            async def send_message(self, chat_id, text, **kwargs):
+                if chat_id in errors:
+                    raise errors[chat_id]
+
+        batches = []
+
+        async def on_unreachable(batch):
+            batches.append(batch)
+
+        broadcaster = Broadcaster(
+            Bot(), workers=2, bucket=TokenBucket(rate=1e6), on_unreachable=on_unreachable, unreachable_batch=2
+        )
+        result = await broadcaster.run("test", recipients(10), "привет")
+
+        assert (result.sent, result.blocked, result.failed) == (6, 3, 1)
+        assert sorted(pair for batch in batches for pair in batch) == [
+            (2, "blocked"), (4, "deactivated"), (6, "chat_not_found"),
+        ]
+        assert [len(batch) for batch in batches] == [2, 1]
+
+    asyncio.run(scenario())
@@ -0,0 +1,120 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from services.broadcast import Broadcaster, TokenBucket
+from services.broadcast_jobs import BroadcastJob, BroadcastJobs
+
+
+class MemoryJobs(BroadcastJobs):
+    """Задания и отметки о доставке в памяти вместо БД"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.jobs = {}
+        self.progress = set()
+
+    async def open(self, name, run_key, text_, audience=None):
+        if run_key not in self.jobs:
+            self.jobs[run_key] = BroadcastJob(len(self.jobs) + 1, name, run_key, text_, "running", None, datetime.now())
+        return self.jobs[run_key]
+
+    async def claim(self, job, user_ids):
+        fresh = [user_id for user_id in user_ids if (job.id, user_id) not in self.progress]
+        self.progress.update((job.id, user_id) for user_id in fresh)
+        self.jobs[job.run_key] = job._replace(last_user_id=user_ids[-1])
+        return fresh
+
+    async def finish(self, job, result):
+        self.jobs[job.run_key] = self.jobs[job.run_key]._replace(status="done")
+
+    async def purge(self, now=None):
+        self._last_purge = now or datetime.now(timezone.utc)
+        done = {job.id for job in self.jobs.values() if job.status != "running"}
+        stale = {mark for mark in self.progress if mark[0] in done}
+        self.progress -= stale
+        self.purged += len(stale)
+        return len(stale)
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append((chat_id, text))
+
+
+def test_job_sends_each_recipient_once_and_resumes_from_cursor():
+    async def scenario():
+        bot = FakeBot()
+        cursors = []
+
+        async def recipients(job):
+            cursors.append(job.last_user_id)
+            for user_id in range(1, 251):
+                if job.last_user_id is None or user_id > job.last_user_id:
+                    yield user_id
+
+        jobs = MemoryJobs(None, Broadcaster(bot, workers=3, bucket=TokenBucket(rate=1e6)), recipients, claim_size=40)
+        # Часть получателей уже занята прерванным запуском
+        job = await jobs.open("evening", "evening:2026-10-17", "первый текст")
+        await jobs.claim(job, list(range(1, 81)))
+
+        result = await jobs.run("evening", "evening:2026-10-17", "другой текст")
+        assert result.sent == 170
+        assert cursors == [80]
+        assert sorted(chat_id for chat_id, _ in bot.sent) == list(range(81, 251))
+        assert {text for _, text in bot.sent} == {"первый текст"}
+
+        # Завершённая рассылка повторно не отправляется
+        assert await jobs.run("evening", "evening:2026-10-17", "первый текст") is None
+        assert len(bot.sent) == 170
+
+    asyncio.run(scenario())
+
+
+def test_run_key_in_progress_is_not_started_twice():
+    async def scenario():
+        bot = FakeBot()
+        release = asyncio.Event()
+
+        async def recipients(job):
+            await release.wait()
+            for user_id in range(1, 11):
+                yield user_id
+
+        jobs = MemoryJobs(None, Broadcaster(bot, workers=2, bucket=TokenBucket(rate=1e6)), recipients)
+        # Первый запуск (например, resume после рестарта) ещё идёт, когда приходит тик планировщика
+        first = asyncio.get_running_loop().create_task(jobs.run("morning", "morning:2026-10-17", "текст"))
+        await asyncio.sleep(0)
+        assert await jobs.run("morning", "morning:2026-10-17", "текст") is None
+
+        release.set()
+        assert (await first).sent == 10
+        assert len(bot.sent) == 10
+        assert jobs.stats() == {"active": 0, "resumed": 0, "skipped": 1, "purged": 10}
+
+    asyncio.run(scenario())
+
+
+def test_finished_jobs_are_purged_on_schedule():
+    async def scenario():
+        async def recipients(job):
+            for user_id in range(1, 6):
+                yield user_id
+
+        broadcaster = Broadcaster(FakeBot(), workers=2, bucket=TokenBucket(rate=1e6))
+        jobs = MemoryJobs(None, broadcaster, recipients, purge_interval=timedelta(hours=1))
+
+        # Долгоживущий процесс: первая завершённая рассылка чистит отметки сразу
+        await jobs.run("morning", "morning:Europe/Moscow:2026-10-17", "текст")
+        assert jobs.progress == set()
+
+        # Следующие — не чаще раза в purge_interval
+        await jobs.run("evening", "evening:Europe/Moscow:2026-10-17", "текст")
+        assert len(jobs.progress) == 5
+        assert await jobs.purge_if_due(datetime.now(timezone.utc) + timedelta(hours=2)) == 5
+        assert jobs.progress == set()
+        assert jobs.stats()["purged"] == 10
+
+    asyncio.run(scenario())
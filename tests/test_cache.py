@@ -0,0 +1,41 @@
+from services.cache import TTLCache
+
+
+def test_ttl_cache_expires_and_evicts_least_recently_used():
+    now = [0.0]
+    cache = TTLCache(maxsize=2, ttl=10, clock=lambda: now[0])
+
+    cache.set(1, "a")
+    cache.set(2, "b")
+    assert cache.get(1) == "a"  # 1 теперь свежее 2
+    cache.set(3, "c")
+    assert cache.get(2) is None
+    assert cache.get(1) == "a"
+
+    now[0] = 10.0
+    assert cache.get(3) is None
+    assert cache.stats() == {
+        "size": 1, "maxsize": 2, "hits": 2, "misses": 2, "hit_rate": 0.5,
+        "evictions": 1, "expirations": 1, "invalidations": 0, "stale_sets": 0,
+    }
+
+
+def test_set_skips_value_read_before_invalidation():
+    cache = TTLCache(maxsize=2, ttl=10)
+
+    generation = cache.generation()
+    cache.invalidate(1)  # например, сброс буфера счётчиков во время чтения
+    cache.set(1, "stale", generation)
+    cache.set(2, "fresh", generation)
+    assert cache.get(1) is None
+    assert cache.get(2) == "fresh"
+
+    cache.set(1, "new", cache.generation())
+    assert cache.get(1) == "new"
+
+    # Забытые сбросы (больше maxsize ключей) считаются случившимися
+    old = cache.generation()
+    for key in range(10, 13):
+        cache.invalidate(key)
+    cache.set(3, "stale", old)
+    assert cache.get(3) is None
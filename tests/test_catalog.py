@@ -0,0 +1,43 @@
+import pytest
+
+from services.catalog import Catalog
+
+DEFAULTS = {
+    "shop_items": [
+        {"id": "book", "name": "Книга", "description": "", "price": 10, "type": "digital"},
+        {"id": "course", "name": "Курс", "description": "", "price": 50, "type": "digital"},
+    ],
+    "hearts_shop_items": [{"id": "premium_1d", "name": "💎 Премиум на 1 день", "price": 20, "days": 1}],
+}
+
+
+def test_ids_do_not_depend_on_order():
+    catalog = Catalog(DEFAULTS)
+    reordered = Catalog({"shop_items": list(reversed(DEFAULTS["shop_items"]))})
+    assert catalog.shop_items.get("course")["price"] == 50
+    assert reordered.shop_items.get("course")["price"] == 50
+    assert [item["name"] for item in catalog.shop_items] == ["Книга", "Курс"]
+    assert len(catalog.psychology_practices) == 0
+
+
+def test_yaml_overrides_only_listed_sections(tmp_path):
+    path = tmp_path / "catalog.yaml"
+    path.write_text(
+        "shop_items:\n"
+        "  - {id: book, name: Новая книга, description: '', price: 15, type: digital}\n",
+        encoding="utf-8",
+    )
+    catalog = Catalog.load(DEFAULTS, str(path))
+    assert catalog.shop_items.get("book")["price"] == 15
+    assert len(catalog.shop_items) == 1
+    assert catalog.hearts_shop_items.get("premium_1d")["days"] == 1
+
+
+def test_duplicate_ids_are_rejected():
+    with pytest.raises(ValueError):
+        Catalog({"shop_items": DEFAULTS["shop_items"] * 2})
+
+
+def test_missing_id_is_rejected():
+    with pytest.raises(ValueError):
+        Catalog({"shop_items": [{"name": "Книга", "description": "", "price": 10, "type": "digital"}]})
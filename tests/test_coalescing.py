@@ -0,0 +1,80 @@
+import asyncio
+
+import pytest
+
+from services.coalescing import SingleFlight, StreamFlight, payload_key
+
+PAYLOAD = {"model": "m", "messages": [{"role": "user", "content": "Привет"}], "temperature": 0.7, "max_tokens": 500}
+
+
+def test_payload_key_ignores_transport_fields():
+    assert payload_key(PAYLOAD) == payload_key({**PAYLOAD, "stream": False})
+    assert payload_key(PAYLOAD) != payload_key({**PAYLOAD, "temperature": 0.2})
+
+
+def test_concurrent_identical_requests_share_one_call():
+    calls = []
+
+    async def scenario():
+        flight = SingleFlight()
+
+        async def upstream():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return {"answer": 42}
+
+        results = await asyncio.gather(*(flight.do("k", upstream) for _ in range(5)))
+        assert results == [{"answer": 42}] * 5
+        assert flight.stats() == {"in_flight": 0, "leaders": 1, "coalesced": 4}
+
+        async def failing():
+            raise RuntimeError("boom")
+
+        with pytest.raises(RuntimeError):
+            await asyncio.gather(flight.do("e", failing), flight.do("e", failing))
+
+    asyncio.run(scenario())
+    assert len(calls) == 1
+
+
+def test_concurrent_identical_streams_share_one_upstream():
+    calls = []
+
+    async def scenario():
+        flight = StreamFlight()
+        gate = asyncio.Event()
+
+        async def upstream(emit):
+            calls.append(1)
+            emit("При")
+            await gate.wait()
+            emit("вет")
+            return {"completion_tokens": 2}
+
+        async def read(shared):
+            return "".join([part async for part in shared.follow()])
+
+        first = asyncio.create_task(read(flight.stream("k", upstream)))
+        await asyncio.sleep(0)
+        # Подключившийся посреди потока получает и уже пришедшие куски
+        late = flight.stream("k", upstream)
+        second = asyncio.create_task(read(late))
+        await asyncio.sleep(0)
+        gate.set()
+
+        assert await asyncio.gather(first, second) == ["Привет", "Привет"]
+        assert late.result == {"completion_tokens": 2}
+        assert flight.stats() == {"streams_in_flight": 0, "stream_leaders": 1, "streams_coalesced": 1}
+
+        async def failing(emit):
+            emit("обрыв")
+            raise RuntimeError("boom")
+
+        parts = []
+        with pytest.raises(RuntimeError):
+            async for part in flight.stream(None, failing).follow():
+                parts.append(part)
+        assert parts == ["обрыв"]
+
+    asyncio.run(scenario())
+    assert len(calls) == 1
@@ -0,0 +1,75 @@
+import asyncio
+
+from services.conversations import ConversationStore
+
+
+class FakeResult:
+    def __init__(self, rows):
+        self._rows = rows
+
+    def all(self):
+        return self._rows
+
+
+class FakeSession:
+    def __init__(self, db):
+        self.db = db
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, statement, params):
+        if isinstance(params, list):
+            self.db["rows"].extend(params)
+            return None
+        self.db["selects"] += 1
+        rows = [r for r in self.db["rows"] if r["user_id"] == params["user_id"]]
+        rows = sorted(rows, key=lambda r: r["created_at"], reverse=True)[:params["limit"]]
+        return FakeResult([(r["message_text"], r["is_ai_response"], r["created_at"]) for r in rows])
+
+
+class FakeSessionFactory:
+    def __init__(self):
+        self.db = {"rows": [], "selects": 0}
+
+    def __call__(self):
+        return FakeSession(self.db)
+
+    def begin(self):
+        return FakeSession(self.db)
+
+
+def test_history_is_bounded_and_served_from_memory_after_first_load():
+    async def scenario():
+        factory = FakeSessionFactory()
+        store = ConversationStore(factory, max_turns=3)
+        for i in range(5):
+            store.append(1, f"вопрос {i}", is_ai_response=False)
+        await store.flush()
+
+        history = await store.history(1)
+        assert [turn.text for turn in history] == ["вопрос 2", "вопрос 3", "вопрос 4"]
+        store.append(1, "ответ", is_ai_response=True)
+        assert [turn.text for turn in await store.history(1)] == ["вопрос 3", "вопрос 4", "ответ"]
+        assert factory.db["selects"] == 1
+
+        # Незаписанная реплика видна и после промаха по кэшу
+        store.append(2, "ещё не в БД", is_ai_response=False)
+        assert [turn.text for turn in await store.history(2)] == ["ещё не в БД"]
+
+    asyncio.run(scenario())
+
+
+def test_context_keeps_newest_turns_within_token_budget():
+    async def scenario():
+        store = ConversationStore(FakeSessionFactory(), max_turns=10, estimate=len)
+        for text in ("старое длинное сообщение", "коротко", "ок"):
+            store.append(1, text, is_ai_response=False)
+        await store.history(1)
+        messages = await store.context(1, token_budget=len("коротко") + len("ок") + 8)
+        assert [m["content"] for m in messages] == ["коротко", "ок"]
+
+    asyncio.run(scenario())
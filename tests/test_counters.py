@@ -0,0 +1,92 @@
+import asyncio
+
+from services.counters import CounterAggregator
+
+
+class FailingSessionFactory:
+    def begin(self):
+        raise RuntimeError("db is down")
+
+
+class StatsDB:
+    """Фабрика сессий поверх словаря user_stats; коммит подтверждается с задержкой `commit_delay`"""
+
+    def __init__(self, hearts, users=(), commit_delay=0.0):
+        self.hearts = dict(hearts)
+        self.users = set(users) | set(hearts)
+        self.commit_delay = commit_delay
+
+    def begin(self):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await asyncio.sleep(self.commit_delay)
+        return False
+
+    async def execute(self, sql, params):
+        if "INSERT INTO user_stats" in str(sql):
+            for user_id in params["user_ids"]:
+                if user_id in self.users:
+                    self.hearts.setdefault(user_id, 10)
+            return []
+        updated = []
+        for key, value in params.items():
+            if key.startswith("id_") and value in self.hearts:
+                self.hearts[value] += params["h_" + key[3:]]
+                updated.append((value,))
+        return updated
+
+
+def test_overlay_and_failed_flush_keeps_deltas():
+    async def scenario():
+        aggregator = CounterAggregator(FailingSessionFactory(), max_pending=100)
+        aggregator.add(1, hearts=3)
+        aggregator.add(1, hearts=2)
+
+        user = aggregator.overlay({"telegram_id": 1, "hearts": 10})
+        assert user["hearts"] == 15
+
+        assert await aggregator.flush() == 0
+        assert aggregator.pending(1) == 5
+
+    asyncio.run(scenario())
+
+
+def test_read_overlapping_a_flush_is_repeated_and_not_double_counted():
+    async def scenario():
+        db = StatsDB({1: 10}, commit_delay=0.02)
+        aggregator = CounterAggregator(db, max_pending=100)
+        aggregator.add(1, hearts=5)
+
+        async def read():
+            await asyncio.sleep(0.01)
+            return {"telegram_id": 1, "hearts": db.hearts[1]}
+
+        # Чтение началось до сброса, а строку прочитало уже после UPDATE
+        reader = asyncio.create_task(aggregator.consistent_read(read))
+        await asyncio.sleep(0)
+        await aggregator.flush()
+        user = aggregator.overlay(await reader)
+
+        assert user["hearts"] == 15
+        assert aggregator.reread == 1
+
+    asyncio.run(scenario())
+
+
+def test_flush_creates_missing_stats_rows():
+    async def scenario():
+        # У пользователя 2 нет строки user_stats, пользователя 3 нет вовсе
+        db = StatsDB({1: 10}, users={2})
+        aggregator = CounterAggregator(db, max_pending=100)
+        for telegram_id in (1, 2, 3):
+            aggregator.add(telegram_id, hearts=5)
+
+        assert await aggregator.flush() == 3
+        assert db.hearts == {1: 15, 2: 15}
+        assert aggregator.pending(2) == 0
+
+    asyncio.run(scenario())
@@ -0,0 +1,66 @@
+import asyncio
+from datetime import date, datetime, timedelta, timezone
+
+from services.broadcast import BroadcastResult
+from services.delivery import DeliveryScheduler, DueBucket, due_buckets, find_timezone, user_timezone
+
+SLOTS = {"morning": 9, "evening": 18}
+ZONES = ("Europe/Moscow", "Asia/Yekaterinburg", "Asia/Kamchatka")
+
+
+def test_due_buckets_follow_local_time():
+    # 06:07 UTC: 9:07 в Москве, 11:07 в Екатеринбурге, 18:07 на Камчатке
+    now = datetime(2026, 10, 17, 6, 7, tzinfo=timezone.utc)
+
+    assert due_buckets(SLOTS, ZONES, now) == [
+        DueBucket("morning", "Europe/Moscow", date(2026, 10, 17), 7),
+        DueBucket("evening", "Asia/Kamchatka", date(2026, 10, 17), 7),
+    ]
+    assert due_buckets(SLOTS, ZONES, now)[0].run_key == "morning:2026-10-17:Europe/Moscow:07"
+
+
+def test_find_timezone_accepts_name_or_label():
+    assert find_timezone(" омск ") == "Asia/Omsk"
+    assert find_timezone("asia/yekaterinburg") == "Asia/Yekaterinburg"
+    assert find_timezone("Марс") is None
+
+
+def test_user_timezone_falls_back_to_default():
+    assert user_timezone("Asia/Omsk").zone == "Asia/Omsk"
+    assert user_timezone("Europe/Kiev").zone == "Europe/Moscow"
+    assert user_timezone(None).zone == "Europe/Moscow"
+
+
+class FakeJobs:
+    def __init__(self):
+        self.runs = []
+
+    async def run(self, name, run_key, text_, audience=None):
+        self.runs.append(run_key)
+        result = BroadcastResult(name)
+        result.sent = 1
+        return result
+
+
+class AlwaysFull(DeliveryScheduler):
+    async def _has_recipients(self, bucket):
+        return True
+
+
+def test_tick_catches_up_missed_minutes_once():
+    async def scenario():
+        jobs = FakeJobs()
+        scheduler = AlwaysFull(
+            None, jobs, lambda slot, day: f"{slot} {day}", SLOTS, ("Europe/Moscow",), catch_up=timedelta(minutes=3)
+        )
+        now = datetime(2026, 10, 17, 6, 7, 30, tzinfo=timezone.utc)
+
+        assert await scheduler.tick(now) == 3
+        assert await scheduler.tick(now) == 0
+        assert await scheduler.tick(now + timedelta(minutes=1)) == 1
+        await asyncio.gather(*scheduler._running)
+
+        assert jobs.runs == [f"morning:2026-10-17:Europe/Moscow:{minute:02d}" for minute in (5, 6, 7, 8)]
+        assert scheduler.stats()["sent"] == 4
+
+    asyncio.run(scenario())
@@ -0,0 +1,48 @@
+import asyncio
+
+import httpx
+
+from services.openai_client import OpenAIClient
+
+
+def test_requests_share_one_client_with_api_key():
+    seen = []
+
+    def handler(request):
+        seen.append((request.url.path, request.headers["Authorization"]))
+        return httpx.Response(200, json={"choices": [{"message": {"content": "ok"}}]})
+
+    async def scenario():
+        client = OpenAIClient("sk-test", transport=httpx.MockTransport(handler), http2=False)
+        await client.start()
+        first = client._client
+        for _ in range(3):
+            data = await client.chat_completion({"model": "m", "messages": []})
+            assert data["choices"][0]["message"]["content"] == "ok"
+        assert client._client is first
+        assert client.stats()["requests"] == 3
+        await client.stop()
+
+    asyncio.run(scenario())
+    assert seen == [("/v1/chat/completions", "Bearer sk-test")] * 3
+
+
+def test_stream_yields_content_deltas():
+    body = (
+        'data: {"choices": [{"delta": {"role": "assistant"}}]}\n\n'
+        'data: {"choices": [{"delta": {"content": "Привет"}}]}\n\n'
+        'data: {"choices": [{"delta": {"content": ", мир"}}]}\n\n'
+        "data: [DONE]\n\n"
+    )
+
+    def handler(request):
+        assert b'"stream": true' in request.content
+        return httpx.Response(200, text=body, headers={"Content-Type": "text/event-stream"})
+
+    async def scenario():
+        client = OpenAIClient("sk-test", transport=httpx.MockTransport(handler), http2=False)
+        parts = [part async for part in client.stream_chat_completion({"messages": []})]
+        await client.stop()
+        return parts
+
+    assert asyncio.run(scenario()) == ["Привет", ", мир"]
@@ -0,0 +1,19 @@
+from datetime import datetime
+
+import pytz
+
+from services.periods import period_bounds
+
+MOSCOW = pytz.timezone("Europe/Moscow")
+
+
+def test_day_starts_at_local_midnight_in_utc():
+    # 22:30 UTC 31 декабря — в Москве уже 1 января
+    now = pytz.utc.localize(datetime(2025, 12, 31, 22, 30))
+    assert period_bounds("day", MOSCOW, now) == (datetime(2025, 12, 31, 21, 0), datetime(2026, 1, 1, 21, 0))
+
+
+def test_week_and_month_are_half_open_calendar_ranges():
+    now = pytz.utc.localize(datetime(2025, 12, 17, 12, 0))  # среда
+    assert period_bounds("week", MOSCOW, now) == (datetime(2025, 12, 14, 21, 0), datetime(2025, 12, 21, 21, 0))
+    assert period_bounds("month", MOSCOW, now) == (datetime(2025, 11, 30, 21, 0), datetime(2025, 12, 31, 21, 0))
@@ -0,0 +1,22 @@
+from services.progression import LevelCurve
+
+
+def test_default_curve_matches_flat_100_xp():
+    curve = LevelCurve()
+    assert curve.apply(1, 90, 25) == (2, 15)
+    assert curve.apply(3, 0, 250) == (5, 50)
+
+
+def test_custom_curve_repeats_last_step_and_caps_level():
+    curve = LevelCurve.from_string("100,200", max_level=4)
+    assert curve.thresholds == [0, 100, 300, 500]
+    assert curve.apply(1, 0, 350) == (3, 50)
+    assert curve.apply(4, 10, 1000) == (4, 1010)
+    assert curve.progress(3, 50, old_level=1).leveled_up
+
+
+def test_level_before_reverses_apply():
+    curve = LevelCurve.from_string("100,200", max_level=4)
+    for level, experience, delta in [(1, 90, 25), (2, 0, 350), (4, 10, 1000), (1, 0, 5)]:
+        new_level, new_experience = curve.apply(level, experience, delta)
+        assert curve.level_before(new_level, new_experience, delta) == level
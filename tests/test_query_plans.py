@@ -0,0 +1,219 @@
+"""Регрессия планов запросов: горячие запросы не должны читать большие таблицы целиком.
+
+Нужен живой Postgres: `TEST_DATABASE_URL=postgresql://user@host/db pytest`.
+Тест создаёт временную схему из `models.metadata` (ту же, что у бота),
+заполняет её данными, накатывает индексы из миграций и проверяет `EXPLAIN`
+каждого запроса из `main.py`/`webhook.py`. SQL берётся из тех же констант
+и построителей, что и в коде; вручную повторены только запросы, которые
+написаны прямо в обработчиках.
+"""
+import importlib.util
+import json
+import os
+from pathlib import Path
+import re
+import uuid
+
+import pytest
+import pytz
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+from models import metadata
+from services.broadcast_jobs import CLAIM_SQL
+from services.counters import flush_sql
+from services.delivery import BUCKET_PROBE_SQL, BUCKET_WHERE
+from services.periods import period_params, period_sql
+from services.progression import LevelCurve, add_experience_sql
+from services.quota import RECORD_USAGE_SQL, TIER_LIMITS, quota_windows
+from services.users import (
+    ADMIN_COLUMNS,
+    CONTEXT_COLUMNS,
+    ENSURE_STATS_SQL,
+    MARK_REACHABLE_SQL,
+    MARK_UNREACHABLE_SQL,
+    REACHABLE_WHERE,
+    keyset_page_sql,
+    select_users_sql,
+)
+
+psycopg2 = pytest.importorskip("psycopg2")
+pytest.importorskip("alembic")
+
+DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+pytestmark = pytest.mark.skipif(not DATABASE_URL, reason="TEST_DATABASE_URL не задан")
+
+MIGRATIONS = Path(__file__).resolve().parents[1] / "migrations" / "versions"
+
+USERS_COUNT = 200000
+
+SEED = f"""
+INSERT INTO users (telegram_id, username, name, referral_code, referrer_id, is_banned, unreachable_at, timezone)
+SELECT g, CASE WHEN g % 3 = 0 THEN 'user' || g END, 'Имя', 'ref' || g,
+       CASE WHEN g % 5 = 0 THEN g / 5 END, g % 50 = 0, CASE WHEN g % 7 = 0 THEN now() END,
+       (ARRAY['Europe/Moscow', 'Europe/Moscow', 'Europe/Moscow', 'Asia/Yekaterinburg', 'Asia/Novosibirsk'])[g % 5 + 1]
+FROM generate_series(1, {USERS_COUNT}) AS g;
+INSERT INTO user_stats (user_id, hearts) SELECT telegram_id, 10 FROM users;
+INSERT INTO diary_entries (user_id, entry_text, mood, created_at)
+SELECT g % {USERS_COUNT} + 1, 'запись', 'ok', now() - g * interval '1 minute'
+FROM generate_series(1, 100000) AS g;
+INSERT INTO habits (user_id, title, created_at, is_completed)
+SELECT g % {USERS_COUNT} + 1, 'привычка', now() - g * interval '1 minute', false
+FROM generate_series(1, 40000) AS g;
+INSERT INTO habit_completions (habit_id, proof_text, completed_at)
+SELECT g % 40000 + 1, 'готово', now() - g * interval '1 minute'
+FROM generate_series(1, 100000) AS g;
+INSERT INTO payments (user_id, amount, currency, item_id, status, payment_method, created_at)
+SELECT g % {USERS_COUNT} + 1, 299, 'RUB', 'premium_1',
+       CASE WHEN g % 100 = 0 THEN 'pending' ELSE 'completed' END, 'crypto', now() - g * interval '1 minute'
+FROM generate_series(1, 100000) AS g;
+INSERT INTO promo_codes (code, discount_percent, uses_remaining)
+SELECT 'PROMO' || g, 10, 5 FROM generate_series(1, 20000) AS g;
+INSERT INTO user_messages (user_id, message_text, is_ai_response, created_at)
+SELECT g % {USERS_COUNT} + 1, 'реплика', g % 2 = 0, now() - g * interval '1 minute'
+FROM generate_series(1, 100000) AS g;
+INSERT INTO broadcast_jobs (name, run_key, text, status, updated_at)
+SELECT 'evening', 'evening:' || g, 'челлендж', CASE WHEN g = 60 THEN 'running' ELSE 'done' END,
+       now() - (60 - g) * interval '1 day'
+FROM generate_series(1, 60) AS g;
+INSERT INTO broadcast_progress (job_id, user_id)
+SELECT j, u FROM generate_series(55, 60) AS j, generate_series(1, 20000) AS u;
+"""
+
+# Таблицы, полное чтение которых в проде недопустимо
+LARGE_TABLES = {
+    "users", "user_stats", "payments", "diary_entries", "habits", "habit_completions", "promo_codes",
+    "user_messages", "broadcast_progress",
+}
+
+CURVE = LevelCurve()
+TIMEZONE = pytz.timezone("Europe/Moscow")
+PERIOD = period_params("day", TIMEZONE)
+
+# (имя, SQL, параметры) — запросы из main.py и webhook.py
+QUERIES = [
+    ("fetch_user", select_users_sql(CONTEXT_COLUMNS, "telegram_id = :telegram_id"), {"telegram_id": 42}),
+    ("fetch_diary_password", "SELECT diary_password FROM users WHERE telegram_id = :telegram_id",
+     {"telegram_id": 42}),
+    ("find_user_by_username", select_users_sql(ADMIN_COLUMNS, "username = :username"), {"username": "user42"}),
+    ("referrer_by_code", "SELECT telegram_id FROM users WHERE referral_code = :code", {"code": "ref42"}),
+    ("referrals_of_user", "SELECT telegram_id FROM users WHERE referrer_id = :referrer_id",
+     {"referrer_id": 42}),
+    ("update_user", "UPDATE users SET name = :name WHERE telegram_id = :telegram_id",
+     {"name": "Новое", "telegram_id": 42}),
+    ("add_hearts", "UPDATE user_stats SET hearts = hearts + :amount WHERE user_id = :telegram_id",
+     {"amount": 5, "telegram_id": 42}),
+    ("add_experience", add_experience_sql(CURVE), {"telegram_id": 42, "exp": 10}),
+    ("ensure_stats", ENSURE_STATS_SQL, {"user_ids": [42, 43]}),
+    ("flush_counters", flush_sql(2), {"id_0": 42, "h_0": 5, "id_1": 43, "h_1": 10}),
+    ("record_ai_usage", RECORD_USAGE_SQL,
+     {"user_id": 42, "tokens": 350, **dict(zip(("day_start", "window_start"),
+                                              quota_windows(TIER_LIMITS["trial"], TIMEZONE)))}),
+    ("conversation_history", "SELECT message_text, is_ai_response, created_at FROM user_messages "
+     "WHERE user_id = :user_id ORDER BY created_at DESC LIMIT :limit", {"user_id": 42, "limit": 10}),
+    ("count_diary_entries", "SELECT COUNT(*) FROM diary_entries WHERE user_id = :user_id", {"user_id": 42}),
+    ("list_habits", "SELECT * FROM habits WHERE user_id = :user_id ORDER BY created_at DESC", {"user_id": 42}),
+    ("diary_entries_for_period", f"""
+        SELECT entry_text, created_at, COUNT(*) OVER () AS total
+        FROM diary_entries
+        WHERE user_id = :user_id AND {period_sql("created_at")}
+        ORDER BY created_at DESC
+        LIMIT :limit
+    """, {"user_id": 42, "limit": 10, **PERIOD}),
+    ("count_habits", "SELECT COUNT(*) FROM habits WHERE user_id = :user_id", {"user_id": 42}),
+    ("count_completed_habits_today", f"""
+        SELECT COUNT(*) FROM habit_completions hc
+        JOIN habits h ON hc.habit_id = h.id
+        WHERE h.user_id = :user_id AND {period_sql("hc.completed_at")}
+    """, {"user_id": 42, **PERIOD}),
+    ("validate_promo_code", "SELECT * FROM promo_codes WHERE code = :code AND "
+     "(uses_remaining > 0 OR uses_remaining IS NULL) AND (valid_until > NOW() OR valid_until IS NULL)",
+     {"code": "PROMO42"}),
+    ("use_promo_code", "UPDATE promo_codes SET uses_remaining = uses_remaining - 1 WHERE code = :code",
+     {"code": "PROMO42"}),
+    ("webhook_subscription_expires",
+     "SELECT subscription_expires_at FROM users WHERE telegram_id = :user_id", {"user_id": 42}),
+    ("get_users_many", select_users_sql(ADMIN_COLUMNS, "telegram_id = ANY(:values)"),
+     {"values": list(range(100, 200))}),
+    ("find_users_by_username", select_users_sql(ADMIN_COLUMNS, "username = ANY(:values)"),
+     {"values": ["user3", "user6", "user9"]}),
+    ("broadcast_recipients_page", keyset_page_sql(("telegram_id",), REACHABLE_WHERE), {"after": 5000, "limit": 1000}),
+    ("delivery_bucket_probe", BUCKET_PROBE_SQL, {"timezone": "Asia/Yekaterinburg", "minute": 7}),
+    ("delivery_bucket_page", keyset_page_sql(("telegram_id",), BUCKET_WHERE),
+     {"timezone": "Europe/Moscow", "minute": 7, "after": 5000, "limit": 1000}),
+    ("mark_unreachable", MARK_UNREACHABLE_SQL,
+     {"telegram_ids": list(range(100, 200)), "reasons": ["blocked"] * 100}),
+    ("mark_reachable", MARK_REACHABLE_SQL, {"telegram_id": 42}),
+    ("claim_broadcast_recipients", CLAIM_SQL,
+     {"job_id": 60, "user_ids": list(range(20001, 20101)), "last_user_id": 20100}),
+    ("recent_referrals", select_users_sql(("telegram_id", "name", "created_at"), "referrer_id = :referrer_id")
+     + " ORDER BY created_at DESC LIMIT :limit", {"referrer_id": 42, "limit": 10}),
+]
+
+
+def schema_ddl():
+    """CREATE TABLE и CREATE INDEX для всех таблиц `models.metadata`"""
+    dialect = postgresql.dialect(paramstyle="named")  # без экранирования % для psycopg2
+    for table in metadata.sorted_tables:
+        yield str(CreateTable(table).compile(dialect=dialect))
+        for index in table.indexes:
+            yield str(CreateIndex(index).compile(dialect=dialect))
+
+
+def migration_indexes():
+    """Индексы, объявленные в `INDEXES` миграций"""
+    for path in sorted(MIGRATIONS.glob("*.py")):
+        spec = importlib.util.spec_from_file_location(path.stem, path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        yield from getattr(module, "INDEXES", [])
+
+
+def pyformat(sql):
+    """`:name` (стиль text() в main.py) -> `%(name)s` для psycopg2, `%` -> `%%`"""
+    return re.sub(r"(?<![:\w]):(\w+)", r"%(\1)s", sql.replace("%", "%%"))
+
+
+def seq_scans(plan):
+    """Таблицы, которые план читает последовательным сканированием"""
+    found = []
+    if plan.get("Node Type") == "Seq Scan":
+        found.append(plan["Relation Name"])
+    for child in plan.get("Plans", []):
+        found.extend(seq_scans(child))
+    return found
+
+
+@pytest.fixture(scope="module")
+def cursor():
+    schema = f"plans_{uuid.uuid4().hex[:8]}"
+    conn = psycopg2.connect(DATABASE_URL)
+    conn.autocommit = True
+    cur = conn.cursor()
+    cur.execute(f"CREATE SCHEMA {schema}")
+    cur.execute(f"SET search_path TO {schema}")
+    try:
+        for ddl in schema_ddl():
+            cur.execute(ddl)
+        cur.execute(SEED)
+        # Индексы, которых нет в metadata (или объявленные и там, и в миграции)
+        for name, table, columns, where in migration_indexes():
+            cur.execute(
+                f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})" + (f" WHERE {where}" if where else "")
+            )
+        cur.execute("ANALYZE")
+        yield cur
+    finally:
+        cur.execute(f"DROP SCHEMA {schema} CASCADE")
+        conn.close()
+
+
+@pytest.mark.parametrize("name, sql, params", QUERIES, ids=[query[0] for query in QUERIES])
+def test_hot_query_avoids_seq_scan_on_large_tables(cursor, name, sql, params):
+    cursor.execute(f"EXPLAIN (FORMAT JSON) {pyformat(sql)}", params)
+    plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+
+    scanned = set(seq_scans(plan[0]["Plan"])) & LARGE_TABLES
+    assert not scanned, f"{name}: Seq Scan по {', '.join(sorted(scanned))}"
@@ -0,0 +1,49 @@
+from datetime import datetime
+
+import pytz
+
+from services.quota import TIER_LIMITS, QuotaService, current_usage, quota_windows, request_max_tokens
+
+MOSCOW = pytz.timezone("Europe/Moscow")
+
+
+def test_counters_from_previous_windows_read_as_zero():
+    limits = TIER_LIMITS["premium"]
+    monday = pytz.utc.localize(datetime(2025, 12, 15, 12, 0))
+    day_start, window_start = quota_windows(limits, MOSCOW, monday)
+    user = {
+        "daily_requests": 7, "total_requests": 30, "request_tokens": 9000,
+        "daily_window_start": day_start, "quota_window_start": window_start,
+    }
+    assert current_usage(user, limits, MOSCOW, monday) == (7, 30, 9000)
+
+    # Следующие сутки того же месяца: дневной счётчик обнулился, месячный — нет
+    tuesday = pytz.utc.localize(datetime(2025, 12, 16, 12, 0))
+    assert current_usage(user, limits, MOSCOW, tuesday) == (0, 30, 9000)
+    # Новый месяц
+    january = pytz.utc.localize(datetime(2026, 1, 2, 12, 0))
+    assert current_usage(user, limits, MOSCOW, january) == (0, 0, 0)
+
+
+def test_max_tokens_is_capped_by_tier_and_remaining_budget():
+    trial = TIER_LIMITS["trial"]
+    empty = current_usage({}, trial, MOSCOW)
+    assert request_max_tokens(trial, empty) == 500
+    assert request_max_tokens(TIER_LIMITS["premium"], empty) == 800
+    assert request_max_tokens(trial, empty._replace(window_tokens=10800)) == 200
+
+
+def test_daily_window_follows_the_users_timezone():
+    limits = TIER_LIMITS["premium"]
+    # 15:30 UTC — во Владивостоке уже 16 декабря, в Москве ещё 15-е
+    now = pytz.utc.localize(datetime(2025, 12, 15, 15, 30))
+    day_start, window_start = quota_windows(limits, pytz.timezone("Asia/Vladivostok"), now)
+    user = {
+        "user_type": "premium", "timezone": "Asia/Vladivostok",
+        "daily_requests": 5, "total_requests": 5, "request_tokens": 900,
+        "daily_window_start": day_start, "quota_window_start": window_start,
+    }
+    quota = QuotaService(None)
+    assert quota.usage(user, now).daily_requests == 5
+    # Без пояса — сутки по Москве: счётчик из «других» суток читается нулём
+    assert quota.usage({**user, "timezone": None}, now).daily_requests == 0
@@ -0,0 +1,40 @@
+import asyncio
+
+import httpx
+
+from services.rates import RateProvider
+
+
+def test_rate_provider_serves_stale_rate_and_falls_back_after_max_age():
+    responses = [{"rates": {"RUB": 95.0}}, {"rates": {"RUB": 97.0}}]
+    calls = []
+
+    def handler(request):
+        calls.append(request.url)
+        if not responses:
+            return httpx.Response(503)
+        return httpx.Response(200, json=responses.pop(0))
+
+    async def scenario():
+        now = [0.0]
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        rates = RateProvider(refresh_interval=10, max_age=60, client=client, clock=lambda: now[0])
+
+        assert await rates.get_rate() == 95.0
+        now[0] = 5
+        assert await rates.get_rate() == 95.0
+        assert len(calls) == 1
+
+        # Устарел: старое значение сразу, обновление в фоне
+        now[0] = 20
+        assert await rates.get_rate() == 95.0
+        await rates.refresh()
+        assert await rates.get_rate() == 97.0
+
+        # API лежит дольше max_age — запасной курс и отметка в статистике
+        now[0] = 100
+        assert await rates.get_rate() == 90.0
+        assert rates.stats()["fallbacks"] == 1
+        await client.aclose()
+
+    asyncio.run(scenario())
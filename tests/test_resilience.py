@@ -0,0 +1,72 @@
+import asyncio
+
+import httpx
+import pytest
+
+from services.resilience import CircuitBreaker, CircuitOpen, Resilient
+
+
+def status_error(status, headers=None):
+    request = httpx.Request("POST", "https://api.example.com/v1/chat/completions")
+    return httpx.HTTPStatusError("error", request=request, response=httpx.Response(status, headers=headers, request=request))
+
+
+def test_retries_transient_errors_honouring_retry_after():
+    delays = []
+
+    async def sleep(delay):
+        delays.append(delay)
+
+    errors = [status_error(429, {"Retry-After": "3"}), status_error(503)]
+
+    async def operation():
+        if errors:
+            raise errors.pop(0)
+        return "ok"
+
+    resilient = Resilient(attempts=3, base_delay=0.1, sleep=sleep)
+    assert asyncio.run(resilient.call(operation)) == "ok"
+    assert delays[0] == 3
+    assert resilient.stats()["success_after_retry"] == 1
+    assert resilient.stats()["retry"] == 2
+
+
+def test_client_errors_are_not_retried():
+    async def operation():
+        raise status_error(400)
+
+    resilient = Resilient(sleep=lambda delay: asyncio.sleep(0))
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(resilient.call(operation))
+    assert resilient.outcomes["retry"] == 0
+    assert resilient.breaker.state == "closed"
+
+
+def test_breaker_fails_fast_then_probes_after_cooldown():
+    now = [0.0]
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30, clock=lambda: now[0])
+    resilient = Resilient(breaker, attempts=1)
+    calls = []
+
+    async def failing():
+        calls.append(1)
+        raise status_error(502)
+
+    async def ok():
+        return "ok"
+
+    async def scenario():
+        for _ in range(2):
+            with pytest.raises(httpx.HTTPStatusError):
+                await resilient.call(failing)
+        with pytest.raises(CircuitOpen):
+            await resilient.call(failing)
+        assert len(calls) == 2
+
+        now[0] = 31
+        assert await resilient.call(ok) == "ok"
+        assert breaker.state == "closed"
+
+    asyncio.run(scenario())
+    assert resilient.stats()["short_circuited"] == 1
+    assert breaker.trips == 1
@@ -0,0 +1,43 @@
+import asyncio
+
+from services.streaming import StreamingMessage, split_message
+
+
+class FakeMessage:
+    def __init__(self, sent):
+        self.sent = sent
+        self.text = None
+
+    async def edit_text(self, text, **kwargs):
+        self.text = text
+
+    async def answer(self, text, **kwargs):
+        message = FakeMessage(self.sent)
+        message.text = text
+        self.sent.append(message)
+        return message
+
+
+def test_split_message_cuts_on_whitespace_within_limit():
+    assert split_message("aaa bbb ccc", limit=8) == ["aaa bbb", "ccc"]
+    assert split_message("a" * 10, limit=4) == ["aaaa", "aaaa", "aa"]
+    assert all(len(chunk) <= 4096 for chunk in split_message("слово " * 2000))
+
+
+def test_renderer_throttles_edits_and_continues_in_new_messages():
+    async def scenario():
+        now = [0.0]
+        sent = []
+        placeholder = FakeMessage(sent)
+        renderer = StreamingMessage(placeholder, header="> ", min_interval=1.0, limit=10, clock=lambda: now[0])
+
+        await renderer.feed("раз")
+        assert placeholder.text == "> раз"  # первый кусок — сразу
+        await renderer.feed(" два")
+        assert placeholder.text == "> раз"  # интервал не прошёл
+        now[0] = 1.5
+        await renderer.feed(" три четыре")
+        await renderer.finish()
+        assert [placeholder.text] + [m.text for m in sent] == ["> раз два", "три четыре"]
+
+    asyncio.run(scenario())
@@ -0,0 +1,115 @@
+import asyncio
+
+import pytest
+
+from services.uow import (
+    ReleaseConnectionRequestMiddleware,
+    UnitOfWorkFailed,
+    UnitOfWorkMiddleware,
+    after_commit,
+    session_scope,
+)
+
+
+class FakeSession:
+    def __init__(self, log):
+        self.log = log
+
+    async def commit(self):
+        self.log.append("commit")
+
+    async def rollback(self):
+        self.log.append("rollback")
+
+    async def close(self):
+        self.log.append("close")
+
+
+class FakeFactory:
+    def __init__(self):
+        self.log = []
+        self.created = 0
+
+    def __call__(self):
+        self.created += 1
+        return FakeSession(self.log)
+
+
+def test_helpers_share_one_session_and_commit_once():
+    factory = FakeFactory()
+    committed = []
+
+    async def handler(event, data):
+        async with session_scope(factory) as first:
+            pass
+        async with session_scope(factory) as second:
+            assert second is first
+        after_commit(lambda: committed.append(True))
+        assert not committed
+
+    asyncio.run(UnitOfWorkMiddleware(factory)(handler, object(), {}))
+
+    assert factory.created == 1
+    assert factory.log == ["commit", "close"]
+    assert committed == [True]
+
+
+def test_error_rolls_back_and_drops_commit_hooks():
+    factory = FakeFactory()
+    committed = []
+
+    async def handler(event, data):
+        after_commit(lambda: committed.append(True))
+        async with session_scope(factory):
+            raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(UnitOfWorkMiddleware(factory)(handler, object(), {}))
+
+    assert factory.log == ["rollback", "close"]
+    assert committed == []
+
+
+def test_swallowed_error_fails_the_rest_of_the_update():
+    factory = FakeFactory()
+    committed = []
+
+    async def helper():
+        # Хелперы ловят Exception и возвращают None
+        try:
+            async with session_scope(factory):
+                raise RuntimeError("boom")
+        except Exception:
+            return None
+
+    async def handler(event, data):
+        await helper()
+        after_commit(lambda: committed.append(True))
+        with pytest.raises(UnitOfWorkFailed):
+            async with session_scope(factory):
+                pass
+
+    asyncio.run(UnitOfWorkMiddleware(factory)(handler, object(), {}))
+
+    assert factory.created == 1
+    assert factory.log == ["rollback", "close"]
+    assert committed == []
+
+
+def test_commits_before_bot_api_request():
+    factory = FakeFactory()
+
+    async def make_request(bot, method):
+        factory.log.append("request")
+
+    async def handler(event, data):
+        async with session_scope(factory):
+            pass
+        await ReleaseConnectionRequestMiddleware()(make_request, None, None)
+        async with session_scope(factory):
+            pass
+
+    asyncio.run(UnitOfWorkMiddleware(factory)(handler, object(), {}))
+
+    assert factory.created == 2
+    assert factory.log == ["commit", "close", "request", "commit", "close"]
@@ -0,0 +1,28 @@
+import asyncio
+from types import SimpleNamespace
+
+from services.user_context import RequestUserMiddleware, current_user_context
+
+
+def test_middleware_loads_user_once():
+    calls = []
+
+    async def loader(telegram_id):
+        calls.append(telegram_id)
+        return {"telegram_id": telegram_id, "hearts": 10}
+
+    async def handler(event, data):
+        ctx = current_user_context(42)
+        assert ctx is not None and ctx.loaded
+        assert data["user"] is ctx.user
+        ctx.increment("hearts", 5)
+        assert current_user_context(7) is None
+        return ctx.user["hearts"]
+
+    middleware = RequestUserMiddleware(loader)
+    data = {"event_from_user": SimpleNamespace(id=42)}
+    result = asyncio.run(middleware(handler, object(), data))
+
+    assert result == 15
+    assert calls == [42]
+    assert current_user_context() is None
@@ -0,0 +1,96 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from services.users import BALANCE_COLUMNS, UserRecord, iter_user_records, update_stats
+
+
+def test_user_record_behaves_like_a_mapping():
+    user = UserRecord.from_row(BALANCE_COLUMNS, (1, 10, 2, 30))
+
+    assert user["hearts"] == 10
+    assert user.get("name", "Без имени") == "Без имени"
+    assert user.get("saved_requests", 0) == 0
+    with pytest.raises(KeyError):
+        user["name"]
+
+    user.update({"hearts": 15, "diary_password": "secret"})
+    assert user.to_dict() == {"telegram_id": 1, "hearts": 15, "level": 2, "experience": 30}
+    assert not hasattr(user, "__dict__")
+
+
+class FakePages:
+    """Фабрика сессий: `begin()` отдаёт страницы из `ids` по keyset-условию"""
+
+    def __init__(self, ids):
+        self.ids = sorted(ids)
+        self.queries = 0
+
+    def begin(self):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, sql, params):
+        self.queries += 1
+        page = [(i,) for i in self.ids if i > params["after"]][:params["limit"]]
+        return SimpleNamespace(all=lambda: page)
+
+
+def test_iter_user_records_prefetches_a_bounded_number_of_pages():
+    async def scenario():
+        pages = FakePages(range(1, 1001))
+        users = iter_user_records(pages, batch_size=100, prefetch=2)
+
+        assert (await users.__anext__())["telegram_id"] == 1
+        await asyncio.sleep(0.01)
+        # Текущая страница + не больше двух готовых + одна, ждущая места в очереди
+        assert pages.queries == 4
+        assert [user["telegram_id"] async for user in users] == list(range(2, 1001))
+        assert pages.queries == 11
+
+        stopped = FakePages(range(1, 1001))
+        early = iter_user_records(stopped, batch_size=100, prefetch=1)
+        assert (await early.__anext__())["telegram_id"] == 1
+        await early.aclose()
+        await asyncio.sleep(0.01)
+        assert stopped.queries <= 3
+
+    asyncio.run(scenario())
+
+
+class MissingStatsSession:
+    """Сессия, в которой у пользователя ещё нет строки user_stats"""
+
+    def __init__(self):
+        self.has_row = False
+        self.statements = []
+
+    async def execute(self, statement, params):
+        self.statements.append(str(statement).split()[0])
+        if str(statement).split()[0] == "INSERT":
+            self.has_row = True
+            return SimpleNamespace(all=lambda: [])
+        rows = [(42,)] if self.has_row else []
+        return SimpleNamespace(all=lambda: rows)
+
+
+def test_update_stats_creates_missing_row_and_retries():
+    async def scenario():
+        session = MissingStatsSession()
+        rows = await update_stats(session, "UPDATE user_stats SET hearts = hearts - 5", None, 42)
+
+        assert rows == [(42,)]
+        assert session.statements == ["UPDATE", "INSERT", "UPDATE"]
+
+        # Строка уже есть: один UPDATE без вставки
+        session.statements.clear()
+        await update_stats(session, "UPDATE user_stats SET hearts = hearts - 5", None, 42)
+        assert session.statements == ["UPDATE"]
+
+    asyncio.run(scenario())
@@ -1,5 +1,8 @@
-from datetime import datetime, timedelta, timezone
-from typing import Dict, Optional, Any, Callable
+from datetime import datetime
+from typing import Dict, Any, Optional
+
+from services.delivery import user_timezone
+from services.quota import TIER_LIMITS, current_usage
 
 TRIAL_DAYS = 3
 
@@ -27,34 +30,19 @@ async def check_request_limit_and_update(
     is_premium: bool,
     daily_limit: int,
     weekly_limit: int,
-    update_func: Callable[[int, Dict[str, Any]], Any]
+    tz: Optional[Any] = None,
 ) -> bool:
     """
-    Проверяет лимит и при необходимости сбрасывает счётчики через `update_func`.
-    update_func: async функция, например: update_user(user_id, {total_requests: 0, ...})
+    Проверяет лимит запросов по счётчикам user_stats.
+    Окна (сутки для премиума, неделя для пробного периода) сбрасываются лениво
+    в services.quota, поэтому писать в БД не нужно. Без `tz` сутки считаются
+    в поясе пользователя.
     """
     if not user:
         return False
 
-    now = datetime.now(timezone.utc)
-    last_request = user.get('last_request_date')
-    telegram_id = user.get('telegram_id')
-
+    tier = "premium" if is_premium else "trial"
+    usage = current_usage(user, TIER_LIMITS[tier], tz or user_timezone(user.get("timezone")))
     if is_premium:
-        if not last_request or last_request.date() != now.date():
-            await update_func(telegram_id, {
-                "total_requests": 0,
-                "last_request_date": now
-            })
-            return True
-        return user.get("total_requests", 0) < daily_limit
-
-    # Не премиум
-    if not last_request or (now - last_request).days >= 7:
-        await update_func(telegram_id, {
-            "weekly_requests": 0,
-            "last_request_date": now
-        })
-        return True
-
-    return user.get("weekly_requests", 0) < weekly_limit
+        return usage.daily_requests < daily_limit
+    return usage.window_requests < weekly_limit
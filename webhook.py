@@ -1,10 +1,12 @@
 from fastapi import FastAPI, Request, status
 from fastapi.responses import JSONResponse
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 from sqlalchemy import text
 from bot import bot, async_session, payments, users
 import logging
 
+from services.cache import user_cache
+
 logger = logging.getLogger(__name__)
 
 app = FastAPI()
@@ -60,6 +62,8 @@ async def extend_premium(user_id: int, days: int):
             {"expires": new_expires, "user_id": user_id}
         )
         await session.commit()
+    # Кэш общий с ботом: следующий апдейт прочитает новую подписку из БД
+    user_cache.invalidate(user_id)
 
 async def process_yoomoney_payment(user_id: int, amount: float):
     """Обработка платежа через ЮMoney"""